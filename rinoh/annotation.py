@@ -6,7 +6,6 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-from .util import Decorator
 from .text import MixedStyledText
 
 
@@ -39,10 +38,35 @@ class HyperLink(Annotation):
         self.target = target
 
 
-class AnnotatedSpan(Decorator):
+class AnnotatedSpan(object):
+    """Wraps a span, attaching an :class:`Annotation` to it.
+
+    The returned object is an instance of a subclass of both this class and
+    the span's class, sharing the span's attributes. These subclasses are
+    created only once for each span class and cached in :attr:`_types`."""
+
+    __slots__ = ('annotation', )
+    _types = {}
+
+    def __new__(cls, span, annotation):
+        span_type = type(span)
+        try:
+            annotated_type = cls._types[span_type]
+        except KeyError:
+            if issubclass(span_type, cls):      # nested annotated text
+                annotated_type = span_type
+            else:
+                annotated_type = type(cls.__name__ + span_type.__name__,
+                                      (cls, span_type), {})
+            cls._types[span_type] = annotated_type
+        annotated_span = object.__new__(annotated_type)
+        annotated_span.__dict__.update(span.__dict__)
+        annotated_span.annotation = annotation
+        return annotated_span
+
     def __init__(self, span, annotation):
-        super().__init__(span)
-        self.annotation = annotation
+        """Everything is set up by :meth:`__new__`; this prevents the span
+        class's initializer from being invoked."""
 
 
 class AnnotatedText(MixedStyledText):
@@ -6,5 +6,22 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
+__all__ = ['psg', 'pdf', 'BasicImageStore']
 
-__all__ = ['psg', 'pdf']
+
+class BasicImageStore(object):
+    """Image store used for backends that do not provide an `ImageStore` of
+    their own. Each request creates a new `Image` using `backend`; images are
+    neither cached, prefetched nor downsampled."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_image(self, filename_or_file, scale=1.0, resolution=None):
+        return self.backend.Image(filename_or_file)
+
+    def prefetch(self, filename):
+        pass
+
+    def close(self):
+        pass
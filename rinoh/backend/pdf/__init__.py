@@ -6,39 +6,79 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
+import hashlib
 import math
+import os
+import pickle
 
 from io import StringIO, BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from . import cos
-from .reader import PDFReader, PDFPageReader
+from .reader import PDFReader, PDFPageReader, PDFReaderCache
 from .filter import FlateDecode
+from .util import FilePool
+from .xobject import XObjectImage
 from .xobject.jpeg import JPEGReader
 from .xobject.png import PNGReader
 
+from ... import __version__
 from ...font.type1 import Type1Font
 from ...font.opentype import OpenTypeFont
 
 
+# the zlib compression level used when no CompressionProfile is given
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+def compression_level(compression, category):
+    """Return the zlib compression level (0-9) for streams of `category` set
+    by the :class:`CompressionProfile` `compression` (see
+    :mod:`rinoh.document`). The compression levels map directly to zlib's.
+
+    Data that is compressed already (JPEG images and the image data of PNG
+    images without an alpha channel) is always copied as is."""
+    if compression is None:
+        return DEFAULT_COMPRESSION_LEVEL
+    return getattr(compression, category)
+
+
+def compression_filter(compression, category):
+    """Return the filter to apply to streams of `category`, or `None` to
+    store them uncompressed (level 0)"""
+    level = compression_level(compression, category)
+    return FlateDecode(level=level) if level else None
+
+
 class Document(object):
     extension = '.pdf'
 
     def __init__(self, rinoh_document, creator):
         self.rinoh_document = rinoh_document
+        self.compression = rinoh_document.compression
         self.cos_document = cos.Document(creator)
         self.pages = []
         self.fonts = {}
+        self.glyph_encodings = GlyphEncodings(self)
         self._font_number = 0
-        self._image_number = 0
+        self._image_numbers = {}
+        # files from which JPEG data is copied while writing the PDF
+        self.source_files = FilePool()
 
     def get_unique_font_number(self):
         self._font_number += 1
         return self._font_number
 
-    def get_unique_image_number(self):
-        self._image_number += 1
-        return self._image_number
+    def get_image_number(self, image):
+        """Return the number identifying `image` in this document; an image
+        placed more than once is always referred to by the same number."""
+        try:
+            return self._image_numbers[image]
+        except KeyError:
+            image_number = len(self._image_numbers) + 1
+            self._image_numbers[image] = image_number
+            return image_number
 
     def get_metadata(self, field):
         return str(self.cos_document.info[field.capitalize()])
@@ -48,17 +88,18 @@ class Document(object):
 
     def register_font(self, font):
         try:
-            font_number, font_rsc = self.fonts[font]
+            font_name, font_rsc = self.fonts[font]
         except KeyError:
+            font_filter = compression_filter(self.compression, 'fonts')
             if isinstance(font, Type1Font):
                 font_file = cos.Type1FontFile(font.font_program.header,
                                               font.font_program.body,
-                                              filter=FlateDecode())
+                                              filter=font_filter)
             elif isinstance(font, OpenTypeFont):
                 ff_cls = (cos.OpenTypeFontFile if 'CFF' in font
                           else cos.TrueTypeFontFile)
                 with open(font.filename, 'rb') as font_data:
-                    font_file = ff_cls(font_data.read(), filter=FlateDecode())
+                    font_file = ff_cls(font_data.read(), filter=font_filter)
             font_desc = cos.FontDescriptor(font.name,
                                            4, # TODO: properly determine flags
                                            font.bounding_box,
@@ -79,18 +120,30 @@ class Document(object):
                 cf_cls = cos.CIDFontType0 if 'CFF' in font else cos.CIDFontType2
                 cid_font = cf_cls(font.name, cid_system_info, font_desc, w=w)
                 mapping = font['cmap'][(3, 1)].mapping
-                to_unicode = cos.ToUnicode(mapping, filter=FlateDecode())
+                to_unicode = cos.ToUnicode(mapping, filter=font_filter)
                 font_rsc = cos.CompositeFont(cid_font, 'Identity-H', to_unicode)
-            font_number = self.get_unique_font_number()
-            self.fonts[font] = font_number, font_rsc
-        return font_number, font_rsc
+            font_name = 'F{}'.format(self.get_unique_font_number())
+            self.fonts[font] = font_name, font_rsc
+        return font_name, font_rsc
 
     def write(self, file):
         for page in self.pages:
-            contents = cos.Stream(filter=FlateDecode())
+            contents_filter = compression_filter(self.compression,
+                                                 'contents')
+            contents = cos.Stream(filter=contents_filter, deferred=True)
             contents.write(page.canvas.getvalue().encode('utf_8'))
             page.cos_page['Contents'] = contents
-        self.cos_document.write(file)
+        jpeg_readers = [image.xobject for image in self._image_numbers
+                        if isinstance(image.xobject, JPEGReader)]
+        for jpeg_reader in jpeg_readers:
+            jpeg_reader.source_files = self.source_files
+        try:
+            self.cos_document.write(file,
+                                    self.rinoh_document.compression_threads)
+        finally:
+            for jpeg_reader in jpeg_readers:
+                jpeg_reader.source_files = None
+            self.source_files.close()
 
 
 class Page(object):
@@ -231,9 +284,8 @@ class Canvas(StringIO):
             print('B', file=self)
 
     def register_font(self, document, font):
-        font_number, font_rsc = document.backend_document.register_font(font)
-        font_name = 'F{}'.format(font_number)
-        self.fonts.setdefault(font_name, font_rsc)
+        font_name, font_rsc = document.backend_document.register_font(font)
+        self.fonts[font_name] = font_rsc
         return font_name, font_rsc
 
     def show_glyphs(self, left, cursor, span, glyph_and_widths, document):
@@ -241,44 +293,34 @@ class Canvas(StringIO):
         size = span.height(document)
         color = span.get_style('font_color', document)
         font_name, font_rsc = self.register_font(document, font)
-        string = ''
-        current_string = ''
+        encoding = document.backend_document.glyph_encodings[font]
         total_width = 0
+        adjustments = []
         for glyph_and_width in glyph_and_widths:
-            glyph, width = glyph_and_width.glyph, glyph_and_width.width
+            width = glyph_and_width.width
             total_width += width
-            displ = (1000 * width) / size
-            code = glyph.code
-            if font.encoding:
-                if code < 0:
-                    try:
-                        differences = font_rsc['Encoding']['Differences']
-                    except KeyError:
-                        occupied = list(font.encoding.values())
-                        differences = cos.EncodingDifferences(occupied)
-                        font_rsc['Encoding']['Differences'] = differences
-                    code = differences.register(glyph)
-                char = CODE_TO_CHAR[code]
-            else:
-                high, low = code >> 8, code & 0xFF
-                char = CODE_TO_CHAR[high] + CODE_TO_CHAR[low]
-            adjust = int(glyph.width - displ)
-            if adjust:
-                string += '({}{}) {} '.format(current_string, char,
-                                              adjust)
-                current_string = ''
-            else:
-                current_string += char
-        if current_string:
-            string += '({})'.format(current_string)
-        with self.save_state():
-            print('BT', file=self)
-            print('/{} {} Tf'.format(font_name, size), file=self)
-            self.fill_color(color)
-            print('{:f} {:f} Td'.format(left, - (cursor - span.y_offset(document))),
-                  file=self)
-            print('[{}] TJ'.format(string), file=self)
-            print('ET', file=self)
+            adjustments.append(int(glyph_and_width.glyph.width
+                                   - (1000 * width) / size))
+        if any(adjustments):
+            strings = []
+            run = []
+            for glyph_and_width, adjust in zip(glyph_and_widths, adjustments):
+                run.append(encoding[glyph_and_width.glyph])
+                if adjust:
+                    strings.append('({}) {} '.format(''.join(run), adjust))
+                    run = []
+            if run:
+                strings.append('({})'.format(''.join(run)))
+            string = ''.join(strings)
+        elif glyph_and_widths:
+            string = '({})'.format(''.join([encoding[item.glyph]
+                                            for item in glyph_and_widths]))
+        else:
+            string = ''
+        r, g, b, a = color.rgba
+        top = - (cursor - span.y_offset(document))
+        self.write(SHOW_GLYPHS.format(font_name, size, r, g, b, left, top,
+                                      string))
         return total_width
 
     def annotate(self, annotation, left, top, width, height):
@@ -287,12 +329,9 @@ class Canvas(StringIO):
 
     def place_image(self, image, left, top, document, scale=1.0, width=None,
                     rotate=0):
-        image_number = document.backend_document.get_unique_image_number()
+        image_number = document.backend_document.get_image_number(image)
         self.images[image_number] = image
-        rad = math.radians(rotate)
-        sine, cosine = abs(math.sin(rad)), abs(math.cos(rad))
-        im_width = image.width * cosine + image.height * sine
-        im_height = image.width * sine + image.height * cosine
+        im_width, im_height = image.rotated_size(rotate)
         if width is not None:
             assert scale is None
             scale = width / im_width
@@ -337,9 +376,7 @@ class PageCanvas(Canvas):
         cos_document = self.page.document.backend_document.cos_document
         cos_page = self.cos_page.cos_page
         names = cos_document.catalog.setdefault('Names', cos.Dictionary(True))
-        dests = names.setdefault('Dests', cos.Dictionary(True))
-        # TODO: dest_names should be sorted by name
-        dests_names = dests.setdefault('Names', cos.Array())
+        dests = names.setdefault('Dests', cos.NameTree())
         annots = cos_page.setdefault('Annots', cos.Array())
         for annotation_location in annotations:
             annotation = annotation_location.annotation
@@ -349,10 +386,7 @@ class PageCanvas(Canvas):
                 dest = cos.Array([cos_page, cos.Name('XYZ'),
                                   cos.Real(left), cos.Real(top), cos.Real(0)],
                                  indirect=True)
-                key = cos.String(annotation.name)
-                if key not in dests_names:  # avoid dupes
-                    dests_names.append(key)
-                    dests_names.append(dest)
+                dests.add(cos.String(annotation.name), dest)
                 continue
             right = left + annotation_location.width
             bottom = top - annotation_location.height
@@ -382,14 +416,29 @@ class AnnotationLocation(object):
 
 
 class Image(object):
-    def __init__(self, filename_or_file):
+    # file signatures identifying the reader to try first
+    MAGIC = ((b'%PDF', PDFPageReader),
+             (b'\x89PNG\r\n\x1a\n', PNGReader),
+             (b'\xff\xd8', JPEGReader))
+
+    # quality setting for Pillow's JPEG encoder used for downsampled images
+    JPEG_QUALITY = 85
+
+    def __init__(self, filename_or_file, compression_level=6,
+                 pdf_readers=None):
+        self.compression_level = compression_level
         try:
             file_position = filename_or_file.tell()
+            magic = filename_or_file.read(8)
+            filename_or_file.seek(file_position)
         except AttributeError:
             file_position = None
-        for Reader in (PDFPageReader, PNGReader, JPEGReader):
+            with open(filename_or_file, 'rb') as file:
+                magic = file.read(8)
+        for Reader in self._readers(magic):
             try:
-                self.xobject = Reader(filename_or_file)
+                self.xobject = self._read(Reader, filename_or_file,
+                                          pdf_readers)
                 break
             except ValueError:
                 pass
@@ -398,7 +447,22 @@ class Image(object):
                     filename_or_file.seek(file_position)
         else:
             png_file = self._convert_to_png(filename_or_file)
-            self.xobject = PNGReader(png_file)
+            self.xobject = PNGReader(png_file, compression_level)
+
+    def _readers(self, magic):
+        """Return the readers to try in turn; the one matching the file
+        signature `magic` comes first so that it is usually the only one."""
+        readers = [Reader for signature, Reader in self.MAGIC
+                   if magic.startswith(signature)]
+        readers += [Reader for _, Reader in self.MAGIC if Reader not in readers]
+        return readers
+
+    def _read(self, Reader, filename_or_file, pdf_readers):
+        if Reader is PNGReader:     # only PNG image data can be re-encoded
+            return Reader(filename_or_file, self.compression_level)
+        if Reader is PDFPageReader:
+            return Reader(filename_or_file, pdf_readers=pdf_readers)
+        return Reader(filename_or_file)
 
     @property
     def width(self):
@@ -419,6 +483,270 @@ class Image(object):
         png_image.seek(0)
         return png_image
 
+    def rotated_size(self, rotate):
+        """Return the width and height of the bounding box of this image
+        rotated by `rotate` degrees"""
+        rad = math.radians(rotate)
+        sine, cosine = abs(math.sin(rad)), abs(math.cos(rad))
+        return (self.width * cosine + self.height * sine,
+                self.width * sine + self.height * cosine)
+
+    def downsample(self, filename_or_file, width, height):
+        """Return a copy of this bitmap image, read from `filename_or_file`
+        and resampled to `width` x `height` pixels using Pillow. The copy has
+        the same size in points as this image.
+
+        JPEG images are recompressed as JPEG; other images are stored as
+        PNG. Raises :class:`ImportError` if Pillow is not available."""
+        from PIL import Image as PILImage
+        input_image = PILImage.open(filename_or_file)
+        if input_image.mode == 'P':
+            transparent = 'transparency' in input_image.info
+            input_image = input_image.convert('RGBA' if transparent else 'RGB')
+        elif input_image.mode == '1':
+            input_image = input_image.convert('L')
+        resized = input_image.resize((width, height), PILImage.LANCZOS)
+        output = BytesIO()
+        metadata = {}
+        if input_image.info.get('icc_profile'):
+            metadata['icc_profile'] = input_image.info['icc_profile']
+        if input_image.format == 'JPEG':
+            resized.save(output, 'JPEG', quality=self.JPEG_QUALITY, **metadata)
+        else:
+            resized.save(output, 'PNG', **metadata)
+        output.seek(0)
+        image = Image(output, self.compression_level)
+        dpi_x, dpi_y = self.xobject.dpi
+        image.xobject.dpi = (dpi_x * width / self.xobject['Width'],
+                             dpi_y * height / self.xobject['Height'])
+        return image
+
+
+class ImageStore(dict):
+    """Maps content digests of image files to the :class:`Image` decoded from
+    them, so that each distinct image is probed and decoded only once.
+
+    An image is looked up using :meth:`get_image`. The digest of a file
+    identified by its path is cached for as long as its modification time and
+    size do not change. If `cache_directory` is given, decoded bitmap images
+    are additionally pickled to this directory so that subsequent documents
+    (or runs) can skip decoding them.
+
+    Images can be decoded ahead of time in a pool of `max_workers` threads by
+    calling :meth:`prefetch`. As zlib releases the GIL while (de)compressing,
+    this speeds up handling documents containing many (PNG) images. The
+    threads are started when needed and shut down by :meth:`close`.
+
+    PDF files from which pages are embedded are parsed only once. They stay
+    memory-mapped until :meth:`close` is called.
+
+    Bitmap images can be limited to a maximum effective resolution; see
+    :meth:`get_image`. The downsampled images are cached alongside the
+    original images.
+
+    Image data that needs to be re-encoded is compressed according to the
+    `images` level of the :class:`CompressionProfile` `compression`."""
+
+    # images are only downsampled if their effective resolution exceeds the
+    # requested resolution by this factor
+    DOWNSAMPLE_THRESHOLD = 1.5
+
+    def __init__(self, cache_directory=None, compression=None, max_workers=4):
+        super().__init__()
+        self.cache_directory = cache_directory
+        self.compression_level = compression_level(compression, 'images')
+        self.max_workers = max_workers
+        self._digests = {}
+        self._executor = None
+        self._pending = {}
+        self.pdf_readers = PDFReaderCache()
+
+    def get_image(self, filename_or_file, scale=1.0, resolution=None):
+        """Return the :class:`Image` for `filename_or_file`. Raises
+        :class:`OSError` if the file cannot be read.
+
+        If `resolution` is given, a bitmap image placed at `scale` whose
+        effective resolution exceeds `resolution` (in DPI) is replaced by a
+        downsampled copy. If Pillow is not available, the image is returned
+        as is."""
+        digest = self.digest(filename_or_file)
+        try:
+            image = self[digest]
+        except KeyError:
+            try:
+                image = self._pending.pop(digest).result()
+            except KeyError:
+                image = self._decode(digest, filename_or_file)
+            self[digest] = image
+        size = self._downsampled_size(image, scale, resolution)
+        if size is None:
+            return image
+        key = '{}-{}x{}'.format(digest, *size)
+        try:
+            return self[key]
+        except KeyError:
+            downsampled = self._load(key)
+            if downsampled is None:
+                try:
+                    downsampled = image.downsample(filename_or_file, *size)
+                    self._store(key, downsampled)
+                except ImportError:
+                    downsampled = image
+            self[key] = downsampled
+            return downsampled
+
+    def _downsampled_size(self, image, scale, resolution):
+        """Return the size in pixels to downsample `image` placed at `scale`
+        to in order to achieve `resolution`, or `None` if no downsampling is
+        required"""
+        if resolution is None or not isinstance(image.xobject, XObjectImage):
+            return None
+        effective_resolution = max(image.xobject.dpi) / scale
+        if effective_resolution <= resolution * self.DOWNSAMPLE_THRESHOLD:
+            return None
+        factor = resolution / effective_resolution
+        return (max(1, round(image.xobject['Width'] * factor)),
+                max(1, round(image.xobject['Height'] * factor)))
+
+    def prefetch(self, filename):
+        """Start decoding the image stored in the file at path `filename` in
+        a background thread. Errors are reported by :meth:`get_image`."""
+        try:
+            digest = self.digest(filename)
+        except OSError:
+            return
+        if digest not in self and digest not in self._pending:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            self._pending[digest] = self._executor.submit(self._decode,
+                                                          digest, filename)
+
+    def close(self):
+        """Wait for the images being decoded in the background to finish,
+        shut down the worker threads and close the PDF files embedded pages
+        are read from. Call this once the document has been written."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.pdf_readers.close()
+
+    def _decode(self, digest, filename_or_file):
+        image = self._load(digest)
+        if image is None:
+            image = Image(filename_or_file, self.compression_level,
+                          self.pdf_readers)
+            self._store(digest, image)
+        return image
+
+    def digest(self, filename_or_file):
+        """Return the SHA-1 digest of the contents of `filename_or_file`"""
+        try:
+            file_position = filename_or_file.tell()
+        except AttributeError:
+            stat = os.stat(filename_or_file)
+            key = (os.path.abspath(filename_or_file), stat.st_mtime_ns,
+                   stat.st_size)
+            try:
+                return self._digests[key]
+            except KeyError:
+                with open(filename_or_file, 'rb') as file:
+                    digest = self._digests[key] = self._hash(file)
+                return digest
+        digest = self._hash(filename_or_file)
+        filename_or_file.seek(file_position)
+        return digest
+
+    @staticmethod
+    def _hash(file):
+        sha1 = hashlib.sha1()
+        for chunk in iter(lambda: file.read(512 * 1024), b''):
+            sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _cache_path(self, digest):
+        filename = '{}-z{}-{}.pickle'.format(digest, self.compression_level,
+                                             __version__)
+        return os.path.join(self.cache_directory, filename)
+
+    def _load(self, digest):
+        if self.cache_directory is None:
+            return None
+        try:
+            with open(self._cache_path(digest), 'rb') as file:
+                return pickle.load(file)
+        except (IOError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+    def _store(self, digest, image):
+        # only decoded bitmaps are cached; forms refer to objects in their
+        # source PDF and JPEG images are copied from their source file
+        if (self.cache_directory is None
+                or not isinstance(image.xobject, XObjectImage)
+                or getattr(image.xobject, 'filename', None) is not None):
+            return
+        try:
+            data = pickle.dumps(image, pickle.HIGHEST_PROTOCOL)
+            os.makedirs(self.cache_directory, exist_ok=True)
+            with open(self._cache_path(digest), 'wb') as file:
+                file.write(data)
+        except (IOError, pickle.PicklingError, TypeError):
+            pass
+
+
+SHOW_GLYPHS = ('q\nBT\n'
+               '/{} {} Tf\n'
+               '{} {} {} rg\n'
+               '{:f} {:f} Td\n'
+               '[{}] TJ\n'
+               'ET\nQ\n')
+
+
+class GlyphEncodings(dict):
+    """Maps fonts registered with the backend `document` to their
+    :class:`GlyphEncoding`."""
+
+    def __init__(self, document):
+        super().__init__()
+        self.document = document
+
+    def __missing__(self, font):
+        font_name, font_rsc = self.document.register_font(font)
+        encoding = self[font] = GlyphEncoding(font, font_rsc)
+        return encoding
+
+
+class GlyphEncoding(dict):
+    """Caches the PDF string representation of each glyph of `font` that is
+    shown in the document. Glyphs outside of the font's encoding are added to
+    the encoding differences of the font resource `font_rsc`."""
+
+    def __init__(self, font, font_rsc):
+        super().__init__()
+        self.font = font
+        self.font_rsc = font_rsc
+
+    def __missing__(self, glyph):
+        code = glyph.code
+        if self.font.encoding:
+            if code < 0:
+                code = self._differences().register(glyph)
+            char = CODE_TO_CHAR[code]
+        else:
+            high, low = code >> 8, code & 0xFF
+            char = CODE_TO_CHAR[high] + CODE_TO_CHAR[low]
+        self[glyph] = char
+        return char
+
+    def _differences(self):
+        encoding = self.font_rsc['Encoding']
+        try:
+            differences = encoding['Differences']
+        except KeyError:
+            occupied = list(self.font.encoding.values())
+            differences = cos.EncodingDifferences(occupied)
+            encoding['Differences'] = differences
+        return differences
+
 
 CODE_TO_CHAR = {}
 
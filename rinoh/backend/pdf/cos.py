@@ -7,12 +7,14 @@
 
 
 import codecs
-import hashlib, time
+import copyreg
+import hashlib, re, time
 
 from binascii import hexlify
 from codecs import BOM_UTF16_BE
 from contextlib import contextmanager
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import wraps
 from io import BytesIO
@@ -55,6 +57,10 @@ class Object(object):
     def direct_bytes(self, document):
         return self.PREFIX + self._bytes(document) + self.POSTFIX
 
+    def write_direct(self, file, document):
+        """Write the direct representation of this object to `file`"""
+        file.write(self.direct_bytes(document))
+
     def delete(self, document):
         try:
             reference = document._by_object_id[id(self)]
@@ -69,6 +75,11 @@ class Object(object):
         if self.indirect and id(self) not in visited:
             document.register(self)
 
+    def content_digest(self, document):
+        """Return a digest identifying the serialized form of this indirect
+        object, or `None` if it is not to be deduplicated"""
+        return None
+
 
 class Null(Object):
     def __init__(self, indirect=False):
@@ -92,6 +103,8 @@ class Reference(object):
         return self.document[self.identifier]
 
     def bytes(self, document):
+        if document is not self.document:   # refers into a source PDF file
+            return document.import_reference(self).bytes(document)
         return '{} {} R'.format(self.identifier,
                                 self.generation).encode('utf_8')
 
@@ -134,6 +147,18 @@ class Integer(Object, int):
         return int.__str__(self).encode('utf_8')
 
 
+class Immutable(Object):
+    """An object whose serialized form never changes; it is determined only
+    once"""
+
+    def direct_bytes(self, document):
+        try:
+            return self._direct_bytes
+        except AttributeError:
+            self._direct_bytes = super().direct_bytes(document)
+            return self._direct_bytes
+
+
 class Real(Object, float):
     def __new__(cls, value, indirect=False):
         return float.__new__(cls, value)
@@ -148,17 +173,19 @@ class Real(Object, float):
         return float.__repr__(self).encode('utf_8')
 
 
-class String(Object, bytes):
+class String(Immutable, bytes):
     PREFIX = b'('
     POSTFIX = b')'
-    ESCAPED_CHARACTERS = {ord(b'\n'): br'\n',
-                          ord(b'\r'): br'\r',
-                          ord(b'\t'): br'\t',
-                          ord(b'\b'): br'\b',
-                          ord(b'\f'): br'\f',
-                          ord(b'\\'): br'\\',
-                          ord(b'('): br'\(',
-                          ord(b')'): br'\)'}
+    ESCAPED_CHARACTERS = {b'\n': br'\n',
+                          b'\r': br'\r',
+                          b'\t': br'\t',
+                          b'\b': br'\b',
+                          b'\f': br'\f',
+                          b'\\': br'\\',
+                          b'(': br'\(',
+                          b')': br'\)'}
+    ESCAPE = re.compile(b'|'.join(re.escape(char)
+                                  for char in ESCAPED_CHARACTERS))
 
     def __new__(cls, value, indirect=False):
         try:
@@ -186,16 +213,16 @@ class String(Object, bytes):
                                    '...' if len(self) > 10 else '')
 
     def _bytes(self, document):
-        escaped = bytearray()
-        for char in self:
-            if char in self.ESCAPED_CHARACTERS:
-                escaped += self.ESCAPED_CHARACTERS[char]
-            else:
-                escaped.append(char)
-        return escaped
+        if self.ESCAPE.search(self) is None:
+            return bytes(self)
+        return self.ESCAPE.sub(self._escape, self)
+
+    @classmethod
+    def _escape(cls, match):
+        return cls.ESCAPED_CHARACTERS[match.group()]
 
 
-class HexString(Object, bytes):
+class HexString(Immutable, bytes):
     PREFIX = b'<'
     POSTFIX = b'>'
 
@@ -224,8 +251,12 @@ class Date(String):
         return String.__new__(cls, string, indirect)
 
 
-class Name(Object, bytes):
+class Name(Immutable, bytes):
     PREFIX = b'/'
+    ESCAPE = re.compile(b'[' + re.escape(WHITESPACE + DELIMITERS + b'#')
+                        + b']')
+    ESCAPED_CHARACTERS = {bytes([char]): '#{:02x}'.format(char).encode('ascii')
+                          for char in WHITESPACE + DELIMITERS + b'#'}
 
     # TODO: names should be unique (per document), so check
     def __new__(cls, value, indirect=False):
@@ -245,13 +276,13 @@ class Name(Object, bytes):
         return str(self)
 
     def _bytes(self, document):
-        escaped = bytearray()
-        for char in self:
-            if char in WHITESPACE + DELIMITERS + b'#':
-                escaped += '#{:02x}'.format(char).encode('ascii')
-            else:
-                escaped.append(char)
-        return escaped
+        if self.ESCAPE.search(self) is None:
+            return bytes(self)
+        return self.ESCAPE.sub(self._escape, self)
+
+    @classmethod
+    def _escape(cls, match):
+        return cls.ESCAPED_CHARACTERS[match.group()]
 
 
 class Container(Object):
@@ -268,6 +299,15 @@ class Container(Object):
             for item in self.children():
                 item.register_indirect(document, visited)
 
+    def refers_to_indirect(self):
+        """Whether this container (or a container nested in it) refers to
+        an indirect object"""
+        for item in self.children():
+            if item.indirect or (isinstance(item, Container)
+                                 and item.refers_to_indirect()):
+                return True
+        return False
+
 
 class Array(Container, list):
     PREFIX = b'['
@@ -351,12 +391,28 @@ class Dictionary(Container, OrderedDict):
         for item in self.values():
             yield item.object
 
+    # smaller dictionaries are not deduplicated
+    DEDUPLICATE_MIN_ITEMS = 16
+
+    def content_digest(self, document):
+        if len(self) < self.DEDUPLICATE_MIN_ITEMS or self.refers_to_indirect():
+            return None
+        return hashlib.sha1(self.__class__.__name__.encode('ascii')
+                            + self.direct_bytes(document)).digest()
 
-from .filter import PassThrough, FilterPipeline
+
+from .filter import PassThrough, FilterPipeline, Encoder
 
 
 class Stream(Dictionary):
-    def __init__(self, filter=None, **items):
+    """A stream's data is encoded as it is written to the stream, unless
+    `deferred` is true. Then the data is kept as-is until :meth:`encode` is
+    called, so that the streams of a document can be encoded concurrently
+    when the document is written."""
+
+    _pending = None
+
+    def __init__(self, filter=None, deferred=False, **items):
         # (Streams are always indirectly referenced)
         self._data = BytesIO()
         try:
@@ -365,26 +421,40 @@ class Stream(Dictionary):
             self.filter = filter or PassThrough()
         super().__init__(indirect=True, **items)
         self._coder = None
+        if deferred:
+            self._pending = BytesIO()
 
     def direct_bytes(self, document):
-        out = bytearray()
-        if self._coder:
-            self._coder.close()
-            self.reset()
+        out = BytesIO()
+        self.write_direct(out, document)
+        return out.getvalue()
+
+    def write_direct(self, file, document):
+        self.encode()
         if not isinstance(self.filter, PassThrough):
             self['Filter'] = self.filter.name
             if self.filter.params:
                 self['DecodeParms'] = self.filter.params
         if 'Length' in self:
             self['Length'].delete(document)
-        self['Length'] = Integer(self._data.tell())
-        out += super().direct_bytes(document)
-        out += b'\nstream\n'
-        out += self._data.getvalue()
-        out += b'\nendstream'
-        return out
+        self['Length'] = Integer(self.data_length())
+        file.write(super().direct_bytes(document))
+        file.write(b'\nstream\n')
+        for chunk in self.data_chunks():
+            file.write(chunk)
+        file.write(b'\nendstream')
+
+    def data_length(self):
+        """The length of the (encoded) stream data"""
+        return self._data.tell()
+
+    def data_chunks(self):
+        """Yield the (encoded) stream data, possibly in several chunks"""
+        yield self._data.getvalue()
 
     def read(self, n=-1):
+        if self._pending is not None:
+            self.encode()
         try:
             return self._coder.read(n)
         except AttributeError:
@@ -393,6 +463,8 @@ class Stream(Dictionary):
             return self.read(n)
 
     def write(self, b, **kwargs):
+        if self._pending is not None:
+            return self._pending.write(b)
         try:
             return self._coder.write(b)
         except AttributeError:
@@ -406,6 +478,53 @@ class Stream(Dictionary):
     def reset(self):
         self._coder = None
 
+    def content_digest(self, document):
+        """The digest covers the (unencoded, for a deferred stream) data and
+        the filter used to encode it, in addition to the dictionary entries
+        other than those describing the encoded data"""
+        if self.refers_to_indirect():
+            return None
+        sha1 = hashlib.sha1(self.__class__.__name__.encode('ascii'))
+        for key, value in self.items():
+            if key not in (b'Length', b'Filter', b'DecodeParms'):
+                sha1.update(key.bytes(document) + b' ' + value.bytes(document))
+        sha1.update(self.filter.name.bytes(document))
+        if self.filter.params:
+            sha1.update(self.filter.params.bytes(document))
+        sha1.update(str(getattr(self.filter, 'level', None)).encode('ascii'))
+        if self._pending is not None:
+            sha1.update(b'pending')
+            with self._pending.getbuffer() as data:
+                sha1.update(data)
+        else:
+            self.encode()
+            for chunk in self.data_chunks():
+                sha1.update(chunk)
+        return sha1.digest()
+
+    def encode(self):
+        """Encode the data written to a deferred stream and flush the
+        encoder"""
+        if self._pending is not None:
+            data = self._pending.getvalue()
+            self._pending = None
+            self.write(data)
+        if self._coder:
+            # closing a decoder left by read() would close the stream data
+            if isinstance(self._coder, Encoder):
+                self._coder.close()
+            self.reset()
+
+    def __reduce__(self):
+        # flush the encoder first; it cannot be pickled
+        self.encode()
+        # subclasses' __init__ take arguments; bypass it when unpickling
+        return (copyreg.__newobj__, (type(self), ), self.__dict__, None,
+                iter(self.items()))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def __getattr__(self, name):
         # almost as good as inheriting from BytesIO (which is not possible)
         return getattr(self._data, name)
@@ -428,15 +547,24 @@ class ObjectStream(Stream):
                 offset = int(self['First'] + object_reader.read_number())
                 offsets[i] = offset
             self._object_reader = object_reader
-        object_reader.file.seek(offsets[index])
+        object_reader.position = offsets[index]
         return object_reader.next_item(indirect=True)
 
 
 
 class Document(dict):
+    """Maps object identifiers to the indirect objects in a PDF document.
+
+    Indirect objects are registered when the document is written. Streams and
+    large dictionaries that do not refer to other indirect objects and whose
+    content matches that of an object registered earlier are not written
+    again; references to them point to the first object instead."""
+
     PRODUCER = 'RinohType v{} PDF backend ({})'.format(__version__,
                                                        __release_date__)
 
+    _max_identifier = 0
+
     def __init__(self, creator):
         self.catalog = Catalog()
         self.info = Dictionary(indirect=True)
@@ -446,21 +574,53 @@ class Document(dict):
         self.info['CreationDate'] = Date(self.timestamp)
         self.id = None
         self._by_object_id = {}
+        self._by_digest = {}
+        self._imported = {}
 
     def register(self, obj):
         if id(obj) not in self._by_object_id:
+            digest = obj.content_digest(self)
+            if digest in self._by_digest:
+                self._by_object_id[id(obj)] = self._by_digest[digest]
+                return
             identifier, generation = self.max_identifier + 1, 0
             reference = Reference(self, identifier, generation)
             self._by_object_id[id(obj)] = reference
             self[identifier] = obj
+            if digest is not None:
+                self._by_digest[digest] = reference
+
+    def import_reference(self, reference):
+        """Return the reference in this document corresponding to
+        `reference`, which points to an object in another document (a PDF file
+        from which pages are embedded).
+
+        The objects reachable from an embedded page are registered with this
+        document like any other object. Since a source document is parsed only
+        once (see :class:`reader.PDFReaderCache`) and its objects are cached,
+        an object shared by several embedded pages (fonts, images) is included
+        only once. The source document's object numbers are mapped to
+        references in this document only once."""
+        key = id(reference.document), reference.identifier
+        try:
+            return self._imported[key]
+        except KeyError:
+            imported = self._by_object_id[id(reference.object)]
+            self._imported[key] = imported
+            return imported
+
+    def __setitem__(self, identifier, obj):
+        super().__setitem__(identifier, obj)
+        self._max_identifier = max(self._max_identifier, identifier)
+
+    def __delitem__(self, identifier):
+        super().__delitem__(identifier)
+        if identifier == self._max_identifier:
+            self._max_identifier = max(self.keys(), default=0)
 
     @property
     def max_identifier(self):
-        try:
-            identifier = max(self.keys())
-        except ValueError:
-            identifier = 0
-        return identifier
+        return self._max_identifier
 
     def _write_xref_table(self, file, addresses):
         def out(string):
@@ -484,7 +644,18 @@ class Document(dict):
                 self.info[field].delete(self)
             self.info[field] = String(string)
 
-    def write(self, file_or_filename):
+    def encode_streams(self, threads):
+        """Encode the data of all streams in this document using a pool of
+        `threads` worker threads. zlib releases the GIL while compressing."""
+        streams = [obj for obj in self.values() if isinstance(obj, Stream)]
+        with ThreadPoolExecutor(threads) as executor:
+            for _ in executor.map(Stream.encode, streams):
+                pass
+
+    def write(self, file_or_filename, compression_threads=None):
+        """Write this document to `file_or_filename`. If
+        `compression_threads` is given, streams are compressed concurrently
+        using as many threads before writing them out in order."""
         def out(string):
             file.write(string + b'\n')
 
@@ -500,6 +671,8 @@ class Document(dict):
         if 'ModDate' in self.info:
             self.info['ModDate'].delete(self)
         self.info['ModDate'] = Date(self.timestamp)
+        if compression_threads:
+            self.encode_streams(compression_threads)
 
         out('%PDF-{}'.format(PDF_VERSION).encode('utf_8'))
         file.write(b'%\xDC\xE1\xD8\xB7\n')
@@ -510,8 +683,8 @@ class Document(dict):
                 obj = self[identifier]
                 addresses[identifier] = file.tell()
                 out('{} 0 obj'.format(identifier).encode('utf_8'))
-                out(obj.direct_bytes(self))
-                out(b'endobj')
+                obj.write_direct(file, self)
+                out(b'\nendobj')
         xref_table_address = file.tell()
         self._write_xref_table(file, addresses)
         out(b'trailer')
@@ -572,6 +745,66 @@ class Page(Dictionary):
                                   Real(width), Real(height)])
 
 
+class NameTree(Dictionary):
+    """A name tree (such as the named destinations tree) mapping strings to
+    objects. Entries are added using :meth:`add` and stored in a dict; the
+    tree's nodes are only built when the document is written.
+
+    Each leaf node holds at most `MAX_ENTRIES` entries and each intermediate
+    node at most `MAX_ENTRIES` kids. The entries are distributed evenly, so
+    that all leaves are at the same depth."""
+
+    MAX_ENTRIES = 64
+
+    def __init__(self, indirect=True):
+        super().__init__(indirect)
+        self._entries = {}
+
+    def add(self, name, value):
+        """Map `name` (a :class:`String`) to `value`, unless `name` is
+        already present in this tree"""
+        self._entries.setdefault(name, value)
+
+    def register_indirect(self, document, visited=None):
+        self._build()
+        super().register_indirect(document, visited)
+
+    def _build(self):
+        for key in ('Names', 'Kids'):
+            if key in self:
+                del self[key]
+        entries = sorted(self._entries.items())
+        if len(entries) <= self.MAX_ENTRIES:
+            self['Names'] = self._names_array(entries)
+            return
+        nodes = [self._node('Names', self._names_array(chunk),
+                            chunk[0][0], chunk[-1][0])
+                 for chunk in self._split(entries)]
+        while len(nodes) > self.MAX_ENTRIES:
+            nodes = [self._node('Kids', Array(chunk), chunk[0]['Limits'][0],
+                                chunk[-1]['Limits'][1])
+                     for chunk in self._split(nodes)]
+        self['Kids'] = Array(nodes)
+
+    def _split(self, items):
+        """Split `items` into as few chunks of (nearly) equal size as
+        possible, none of which exceeds `MAX_ENTRIES` items"""
+        count = -(-len(items) // self.MAX_ENTRIES)
+        bounds = [index * len(items) // count for index in range(count + 1)]
+        return [items[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    @staticmethod
+    def _names_array(entries):
+        return Array(item for entry in entries for item in entry)
+
+    @staticmethod
+    def _node(key, array, first, last):
+        node = Dictionary(indirect=True)
+        node[key] = array
+        node['Limits'] = Array([first, last])
+        return node
+
+
 class Rectangle(Array):
     def __init__(self, left, bottom, right, top, indirect=False):
         super().__init__([Real(value) for value in (left, bottom, right, top)],
@@ -773,7 +1006,7 @@ class Type1FontFile(Stream):
     key = 'FontFile'
 
     def __init__(self, header, body, filter=None):
-        super().__init__(filter)
+        super().__init__(filter, deferred=True)
         self['Length1'] = Integer(len(header))
         self['Length2'] = Integer(len(body))
         self['Length3'] = Integer(0)
@@ -785,7 +1018,7 @@ class TrueTypeFontFile(Stream):
     key = 'FontFile2'
 
     def __init__(self, font_data, filter=None):
-        super().__init__(filter)
+        super().__init__(filter, deferred=True)
         self.write(font_data)
 
 
@@ -793,7 +1026,7 @@ class OpenTypeFontFile(Stream):
     key = 'FontFile3'
 
     def __init__(self, font_data, filter=None):
-        super().__init__(filter)
+        super().__init__(filter, deferred=True)
         self['Subtype'] = Name('OpenType')
         self.write(font_data)
 
@@ -841,7 +1074,7 @@ class EncodingDifferences(Object):
 
 class ToUnicode(Stream):
     def __init__(self, mapping, filter=None):
-        super().__init__(filter=filter)
+        super().__init__(filter=filter, deferred=True)
         with self._begin_resource('/CIDInit /ProcSet findresource'):
             with self._begin_resource('12 dict'):
                 with self._begin('cmap'):
@@ -6,7 +6,7 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-import struct, zlib
+import zlib
 
 from binascii import hexlify, unhexlify
 from math import ceil
@@ -16,6 +16,11 @@ from struct import pack, unpack
 from ...util import consumer, class_property
 from .util import FIFOBuffer
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Filter(object):
     params_class = None
@@ -209,6 +214,12 @@ class FlateDecodeParams(Dictionary):
         columns = self.get('Columns', 1)
         return ceil(colors * bits_per_component / 8 * columns)
 
+    @property
+    def bytes_per_pixel(self):
+        colors = self.get('Colors', 1)
+        bits_per_component = self.get('BitsPerComponent', 8)
+        return max(colors * bits_per_component // 8, 1)
+
 
 class FlateDecode(Filter):
     params_class = FlateDecodeParams
@@ -226,7 +237,8 @@ class FlateDecode(Filter):
         decoded = FlateDecoder(source)
         if self.params and self.params['Predictor'] > 1:
             if self.params['Predictor'] >= 10:
-                return PNGReconstructor(decoded, self.params.bytes_per_column)
+                return PNGReconstructor(decoded, self.params.bytes_per_column,
+                                        self.params.bytes_per_pixel)
             else:
                 raise NotImplementedError
         else:
@@ -276,57 +288,125 @@ class LZWDecode(Filter):   # not implemented
 
 
 class PNGReconstructor(FIFOBuffer):
+    """Undoes the PNG prediction applied to the rows of `source`, each of
+    which is `bytes_per_row` long and preceded by a byte indicating the filter
+    type. The left neighbor of a byte lies `bytes_per_pixel` bytes back.
+
+    As many rows as fit the number of bytes requested are reconstructed at
+    once. UP rows are added to the previous row in one go and SUB rows are
+    reconstructed using a cumulative sum (if NumPy is available). AVERAGE and
+    PAETH depend on the reconstructed left neighbor in a non-linear way; these
+    rows are reconstructed byte by byte."""
+
     NONE = 0
     SUB = 1
     UP = 2
     AVERAGE = 3
     PAETH = 4
 
-    # TODO: bitsper...
-    def __init__(self, source, bytes_per_column):
+    def __init__(self, source, bytes_per_row, bytes_per_pixel=1):
         super().__init__(source)
-        self.bytes_per_column = bytes_per_column
-        self._column_struct = struct.Struct('>{}B'.format(bytes_per_column))
-        self._last_values = [0] * bytes_per_column
+        self.bytes_per_row = bytes_per_row
+        self.bytes_per_pixel = bytes_per_pixel
+        self._previous_row = bytes(bytes_per_row)
+        self._reconstruct = {self.NONE: self._none, self.UP: self._up,
+                             self.SUB: self._sub, self.AVERAGE: self._average,
+                             self.PAETH: self._paeth}
+        if numpy is not None:
+            self._reconstruct.update({self.UP: self._up_numpy,
+                                      self.SUB: self._sub_numpy})
 
-    def read_from_source(self, _n_ignored):
-        # number of bytes requested `n` is ignored; a single row is fetched
-        try:
-            predictor, = struct.unpack('>B', self._source.read(1))
-        except struct.error:
-            return b''
-        row = self._source.read(self._column_struct.size)
-        values = list(self._column_struct.unpack(row))
-
-        if predictor == self.NONE:
-            out_row = row
-        elif predictor == self.SUB:
-            recon_a = 0
-            for index, filt_x in enumerate(values):
-                recon_a = values[index] = (filt_x + recon_a) % 256
-            out_row = self._column_struct.pack(*values)
-        elif predictor == self.UP:
-            for index, (filt_x, recon_b) in enumerate(zip(values,
-                                                          self._last_values)):
-                values[index] = (filt_x + recon_b) % 256
-            out_row = self._column_struct.pack(*values)
-        elif predictor == self.AVERAGE:
-            recon_a = 0
-            for index, (filt_x, recon_b) in enumerate(zip(values,
-                                                          self._last_values)):
-                average = (recon_a + recon_b) // 2
-                recon_a = values[index] = (filt_x + average) % 256
-            out_row = self._column_struct.pack(*values)
-        elif predictor == self.PAETH:
-            recon_a = recon_c = 0
-            for index, (filt_x, recon_b) in enumerate(zip(values,
-                                                          self._last_values)):
-                prediction = paeth_predictor(recon_a, recon_b, recon_c)
-                recon_a = values[index] = (filt_x + prediction) % 256
-            out_row = self._column_struct.pack(*values)
-
-        self._last_values = values
-        return out_row
+    def read_from_source(self, n):
+        row_size = self.bytes_per_row
+        stride = row_size + 1
+        data = self._source.read(max(n // row_size, 1) * stride)
+        out_rows = []
+        for start in range(0, len(data), stride):
+            row = data[start + 1:start + stride]
+            if len(row) < row_size:     # truncated last row
+                row += bytes(row_size - len(row))
+            reconstruct = self._reconstruct[data[start]]
+            self._previous_row = reconstruct(row, self._previous_row)
+            out_rows.append(self._previous_row)
+        return b''.join(out_rows)
+
+    @staticmethod
+    def _none(row, previous_row):
+        return row
+
+    @staticmethod
+    def _up(row, previous_row):
+        # add the rows byte by byte (modulo 256) using integer arithmetic
+        length = len(row)
+        low_bits = int.from_bytes(b'\x7f' * length, 'big')
+        a = int.from_bytes(row, 'big')
+        b = int.from_bytes(previous_row, 'big')
+        result = ((a & low_bits) + (b & low_bits)) ^ ((a ^ b) & ~low_bits)
+        return result.to_bytes(length, 'big')
+
+    @staticmethod
+    def _up_numpy(row, previous_row):
+        return (numpy.frombuffer(row, numpy.uint8)
+                + numpy.frombuffer(previous_row, numpy.uint8)).tobytes()
+
+    def _sub(self, row, previous_row):
+        return self._per_lane(self._sub_lane, row, previous_row)
+
+    @staticmethod
+    def _sub_lane(lane, lane_above):
+        left = 0
+        for filt_x in lane:
+            left = (filt_x + left) & 0xFF
+            yield left
+
+    def _sub_numpy(self, row, previous_row):
+        # the cumulative sum over each of the pixels' bytes wraps around
+        values = numpy.frombuffer(row, numpy.uint8)
+        pixels = values.reshape(-1, self.bytes_per_pixel)
+        return numpy.cumsum(pixels, axis=0, dtype=numpy.uint8).tobytes()
+
+    def _average(self, row, previous_row):
+        return self._per_lane(self._average_lane, row, previous_row)
+
+    @staticmethod
+    def _average_lane(lane, lane_above):
+        left = 0
+        for filt_x, above in zip(lane, lane_above):
+            left = (filt_x + ((left + above) >> 1)) & 0xFF
+            yield left
+
+    def _paeth(self, row, previous_row):
+        return self._per_lane(self._paeth_lane, row, previous_row)
+
+    @staticmethod
+    def _paeth_lane(lane, lane_above):
+        left = upper_left = 0
+        for filt_x, above in zip(lane, lane_above):
+            # paeth_predictor(left, above, upper_left), inlined
+            pa = abs(above - upper_left)
+            pb = abs(left - upper_left)
+            pc = abs(left + above - 2 * upper_left)
+            if pa <= pb and pa <= pc:
+                prediction = left
+            elif pb <= pc:
+                prediction = above
+            else:
+                prediction = upper_left
+            left = (filt_x + prediction) & 0xFF
+            upper_left = above
+            yield left
+
+    def _per_lane(self, reconstruct_lane, row, previous_row):
+        """Reconstruct each of the bytes of a pixel separately; the left
+        neighbor of a byte is the preceding byte in its lane"""
+        bpp = self.bytes_per_pixel
+        if bpp == 1:
+            return bytes(reconstruct_lane(row, previous_row))
+        values = bytearray(len(row))
+        for lane in range(bpp):
+            values[lane::bpp] = bytes(reconstruct_lane(row[lane::bpp],
+                                                       previous_row[lane::bpp]))
+        return bytes(values)
 
 
 def paeth_predictor(a, b, c):
@@ -415,7 +495,7 @@ class RunLengthEncoder(Encoder):
 
 class RunLengthDecoder(FIFOBuffer, Decoder):
     def read_from_source(self, n):
-        out_data = b''
+        out_data = bytearray()
         while len(out_data) < n:
             in_byte = self._source.read(1)
             if not in_byte:
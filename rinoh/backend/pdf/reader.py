@@ -6,10 +6,10 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-import struct, time
+import mmap, os, re, time
 
 from binascii import unhexlify
-from io import SEEK_CUR, SEEK_END
+from threading import RLock
 
 from ...util import all_subclasses
 from . import cos
@@ -26,57 +26,80 @@ FILTER_SUBCLASSES = {cls.name: cls for cls in all_subclasses(Filter)}
 
 
 
+# regular expressions used by the tokenizer
+WHITESPACE_CHARS = br'\0\t\n\f\r '
+REGULAR_CHARS = br'[^\0\t\n\f\r ()<>\[\]{}/%]'
+
+WHITESPACE = re.compile(br'(?:[' + WHITESPACE_CHARS + br']+|%[^\r\n]*)*')
+TOKEN = re.compile(br'<<|>>|[()<>\[\]{}/%]|[' + WHITESPACE_CHARS + br']|'
+                   + REGULAR_CHARS + br'+')
+NEXT_LINE = re.compile(br'[^\r\n]*(?:\r\n|\r|\n)?')
+NUMBER = re.compile(br'[+-]?(?:\d+\.?\d*|\.\d+)')
+REFERENCE = re.compile(br'(\d+)[' + WHITESPACE_CHARS + br']+(\d+)['
+                       + WHITESPACE_CHARS + br']+R(?!' + REGULAR_CHARS + br')')
+NAME = re.compile(REGULAR_CHARS + br'*')
+NAME_ESCAPE = re.compile(br'#([0-9A-Fa-f]{2})')
+STRING_SPECIAL = re.compile(br'[()\\]')
+STRING_ESCAPE = re.compile(br'\\(?:([0-7]{1,3})|(\r\n|\r|\n)|(.))', re.DOTALL)
+HEX_STRING = re.compile(br'([0-9A-Fa-f' + WHITESPACE_CHARS + br']*)>')
+HEX_WHITESPACE = re.compile(br'[' + WHITESPACE_CHARS + br']+')
+
+STRING_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b',
+                  b'f': b'\f', b'(': b'(', b')': b')', b'\\': b'\\'}
+
+
 class PDFObjectReader(object):
+    """Reads PDF objects from `file_or_filename`, whose contents are kept in
+    memory (files specified by filename are memory-mapped). The tokenizer
+    matches compiled regular expressions against this data, keeping track of
+    the current `position`."""
+
     def __init__(self, file_or_filename, document=None):
         try:
-            self.file = open(file_or_filename, 'rb')
+            file = open(file_or_filename, 'rb')
         except TypeError:
-            self.file = file_or_filename
+            file_or_filename.seek(0)
+            self.data = file_or_filename.read()
+        else:   # map the file into memory; avoids system calls on each read
+            with file:
+                try:
+                    self.data = mmap.mmap(file.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                except ValueError:  # empty files cannot be mapped
+                    self.data = b''
+        self.position = 0
         self.document = document or self
 
+    def close(self):
+        """Unmap the file, if it was memory-mapped"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def read(self, n):
+        """Return the next `n` bytes of the data"""
+        start = self.position
+        self.position = min(start + n, len(self.data))
+        return self.data[start:self.position]
+
+    def _match(self, regex):
+        match = regex.match(self.data, self.position)
+        if match:
+            self.position = match.end()
+        return match
+
     def jump_to_next_line(self):
-        while True:
-            char = self.file.read(1)
-            if char == b'\n':
-                break
-            elif char == b'\r':
-                next_char = self.file.read(1)
-                if next_char != b'\n':
-                    self.file.seek(-1, SEEK_CUR)
-                break
+        self._match(NEXT_LINE)
 
     def eat_whitespace(self):
-        while True:
-            char = self.file.read(1)
-            if char == b'':
-                break
-            if char not in cos.WHITESPACE:
-                self.file.seek(-1, SEEK_CUR)
-                break
+        self._match(WHITESPACE)
 
     def next_token(self):
-        token = self.file.read(1)
-        if token in (cos.HexString.PREFIX, cos.HexString.POSTFIX):
-            # check for dict begin/end
-            char = self.file.read(1)
-            if char == token:
-                token += char
-            else:
-                self.file.seek(-1, SEEK_CUR)
-        elif token in cos.DELIMITERS + cos.WHITESPACE:
-            pass
-        else:
-            while True:
-                char = self.file.read(1)
-                if char in cos.DELIMITERS + cos.WHITESPACE:
-                    self.file.seek(-1, SEEK_CUR)
-                    break
-                token += char
-        return token
+        match = self._match(TOKEN)
+        return match.group() if match else b''
 
     def next_item(self, indirect=False):
         self.eat_whitespace()
-        restore_pos = self.file.tell()
+        restore_pos = self.position
         token = self.next_token()
         if token == cos.String.PREFIX:
             item = self.read_string(indirect)
@@ -96,52 +119,36 @@ class PDFObjectReader(object):
             item = cos.Null(indirect=indirect)
         else:
             # number or indirect reference
-            self.file.seek(restore_pos)
-            item = self.read_number(indirect)
-            restore_pos = self.file.tell()
-            if isinstance(item, cos.Integer):
-                try:
-                    generation = self.read_number()
-                    self.eat_whitespace()
-                    r = self.next_token()
-                    if isinstance(generation, cos.Integer) and r == b'R':
-                        item = cos.Reference(self.document, int(item),
-                                             int(generation))
-                    else:
-                        raise ValueError
-                except ValueError:
-                    self.file.seek(restore_pos)
+            self.position = restore_pos
+            reference = self._match(REFERENCE)
+            if reference:
+                identifier, generation = reference.groups()
+                item = cos.Reference(self.document, int(identifier),
+                                     int(generation))
+            else:
+                item = self.read_number(indirect)
         return item
 
     def peek(self, length=50):
-        restore_pos = self.file.tell()
-        print(self.file.read(length))
-        self.file.seek(restore_pos)
+        print(self.data[self.position:self.position + length])
 
     # TODO: move reader function outside to simplify unit testing
     def read_array(self, indirect=False):
         array = cos.Array(indirect=indirect)
         while True:
             self.eat_whitespace()
-            token = self.file.read(1)
-            if token == cos.Array.POSTFIX:
+            if self.data[self.position:self.position + 1] == b']':
+                self.position += 1
                 break
-            self.file.seek(-1, SEEK_CUR)
             item = self.next_item()
             array.append(item)
         return array
 
     def read_name(self, indirect=False):
-        name = b''
-        while True:
-            char = self.file.read(1)
-            if char in cos.DELIMITERS + cos.WHITESPACE:
-                self.file.seek(-1, SEEK_CUR)
-                break
-            elif char == b'#':
-                char_code = self.file.read(2)
-                char = chr(int(char_code.decode('ascii'), 16)).encode('ascii')
-            name += char
+        name = self._match(NAME).group()
+        if b'#' in name:
+            name = NAME_ESCAPE.sub(lambda match: bytes([int(match.group(1),
+                                                            16)]), name)
         return cos.Name(name, indirect=indirect)
 
     def read_dictionary_or_stream(self, indirect=False):
@@ -154,7 +161,7 @@ class PDFObjectReader(object):
             key, value = self.read_name(), self.next_item()
             dictionary[key] = value
         self.eat_whitespace()
-        dict_pos = self.file.tell()
+        dict_pos = self.position
         if self.next_token() == b'stream':
             self.jump_to_next_line()
             length = int(dictionary['Length'])
@@ -184,13 +191,13 @@ class PDFObjectReader(object):
             else:
                 stream_filter = None
             stream = cos.Stream(stream_filter)
-            stream.update(dictionary)
-            stream._data.write(self.file.read(length))
+            stream.update(dictionary.items())   # keep references unresolved
+            stream._data.write(self.read(length))
             self.eat_whitespace()
             assert self.next_token() == b'endstream'
             dictionary = stream
         else:
-            self.file.seek(dict_pos)
+            self.position = dict_pos
         # try to map to specific Dictionary sub-class
         type = dictionary.get('Type', None)
         subtype = dictionary.get('Subtype', None)
@@ -199,66 +206,51 @@ class PDFObjectReader(object):
             dictionary.__class__ = DICTIONARY_SUBCLASSES[key]
         return dictionary
 
-    escape_chars = b'nrtbf()\\'
-
     def read_string(self, indirect=False):
-        string = b''
-        escape = False
-        parenthesis_level = 0   # TODO: is currently not used
+        data = self.data
+        start = position = self.position
+        parenthesis_level = 0
         while True:
-            char = self.file.read(1)
-            if escape:
-                if char in self.escape_chars:
-                    string += char
-                elif char == b'\n':
-                    pass
-                elif char == b'\r' and self.file.read(1) != '\n':
-                    self.file.seek(-1, SEEK_CUR)
-                elif char.isdigit():
-                    for i in range(2):
-                        extra = self.file.read(1)
-                        if extra.isdigit():
-                            char += extra
-                        else:
-                            self.file.seek(-1, SEEK_CUR)
-                            break
-                    string += struct.pack('B', int(char, 8))
-                else:
-                    string += b'\\' + char
-                escape = False
-            elif char == b'\\':
-                escape = True
+            match = STRING_SPECIAL.search(data, position)
+            if match is None:
+                raise ValueError('Unterminated string')
+            position = match.end()
+            char = match.group()
+            if char == b'\\':
+                position += 1
             elif char == b'(':
                 parenthesis_level += 1
-            elif char == b')' and parenthesis_level > 0:
+            elif parenthesis_level > 0:
                 parenthesis_level -= 1
-            elif char == cos.String.POSTFIX:
-                break
             else:
-                string += char
+                break
+        self.position = position
+        string = data[start:position - 1]
+        if b'\\' in string:
+            string = STRING_ESCAPE.sub(self._unescape, string)
         return cos.String(string, indirect=indirect)
 
+    @staticmethod
+    def _unescape(match):
+        octal, end_of_line, char = match.groups()
+        if octal:
+            return bytes([int(octal, 8) & 0xFF])
+        elif end_of_line:
+            return b''
+        return STRING_ESCAPES.get(char, char)
+
     def read_hex_string(self, indirect=False):
-        hex_string = b''
-        while True:
-            self.eat_whitespace()
-            char = self.file.read(1)
-            if char == cos.HexString.POSTFIX:
-                break
-            hex_string += char
+        hex_string = HEX_WHITESPACE.sub(b'', self._match(HEX_STRING).group(1))
         if len(hex_string) % 2 > 0:
             hex_string += b'0'
         return cos.HexString(unhexlify(hex_string), indirect=indirect)
 
     def read_number(self, indirect=False):
         self.eat_whitespace()
-        number_string = b''
-        while True:
-            char = self.file.read(1)
-            if char not in b'+-.0123456789':
-                self.file.seek(-1, SEEK_CUR)
-                break
-            number_string += char
+        match = self._match(NUMBER)
+        if match is None:
+            raise ValueError('Expected a number')
+        number_string = match.group()
         try:
             number = cos.Integer(number_string, indirect=indirect)
         except ValueError:
@@ -271,13 +263,14 @@ class PDFReader(PDFObjectReader, cos.Document):
 
     def __init__(self, file_or_filename):
         super().__init__(file_or_filename)
-        self.file.seek(0)
-        if self.file.read(len(self.PDF_SIGNATURE)) != self.PDF_SIGNATURE:
+        if self.data[:len(self.PDF_SIGNATURE)] != self.PDF_SIGNATURE:
             raise ValueError('Not a PDF file: missing %PDF signature')
         self.timestamp = time.time()
         self._by_object_id = {}
+        self._by_digest = {}
+        self._imported = {}
         xref_offset = self.find_xref_offset()
-        self._xref, trailer = self.parse_xref_table(xref_offset)
+        self._xref, trailer = self.parse_xref(xref_offset)
         if 'Info' in trailer:
             self.info = trailer['Info']
         else:
@@ -315,8 +308,8 @@ class PDFReader(PDFObjectReader, cos.Document):
 
     def parse_indirect_object(self, address):
         # save file state
-        restore_pos = self.file.tell()
-        self.file.seek(address)
+        restore_pos = self.position
+        self.position = address
         identifier = int(self.read_number())
         generation = int(self.read_number())
         self.eat_whitespace()
@@ -327,19 +320,28 @@ class PDFReader(PDFObjectReader, cos.Document):
         self._by_object_id[id(obj)] = reference
         self.eat_whitespace()
         assert self.next_token() == b'endobj'
-        self.file.seek(restore_pos)
+        self.position = restore_pos
         return identifier, obj
 
+    def parse_xref(self, offset):
+        """Parse the cross-reference table or stream located at `offset`.
+        Returns the cross-reference table and the trailer dictionary."""
+        self.position = offset
+        if self.next_token() == b'xref':
+            return self.parse_xref_table(offset)
+        else:
+            return self.parse_xref_stream(offset)
+
     def parse_xref_table(self, offset):
         xref = XRefTable(self)
-        self.file.seek(offset)
+        self.position = offset
         assert self.next_token() == b'xref'
         while True:
             try:
                 first, total = int(self.read_number()), self.read_number()
                 self.jump_to_next_line()
                 for identifier in range(first, first + total):
-                    line = self.file.read(20)
+                    line = self.read(20)
                     fields = identifier, int(line[:10]), int(line[11:16])
                     if line[17] == ord(b'n'):
                         xref[identifier] = IndirectObjectEntry(*fields)
@@ -351,7 +353,7 @@ class PDFReader(PDFObjectReader, cos.Document):
         trailer = self.parse_trailer()
         prev_xref = xref_stm = None
         if 'Prev' in trailer:
-            prev_xref, prev_trailer = self.parse_xref_table(trailer['Prev'])
+            prev_xref, prev_trailer = self.parse_xref(trailer['Prev'])
         if 'XRefStm' in trailer:
             xref_stm, _ = self.parse_xref_stream(trailer['XRefStm'])
             xref_stm.prev = prev_xref
@@ -362,7 +364,7 @@ class PDFReader(PDFObjectReader, cos.Document):
         identifier, xref_stream = self.parse_indirect_object(offset)
         self[identifier] = xref_stream
         if 'Prev' in xref_stream:
-            prev = self.parse_indirect_object(xref_stream['Prev'])
+            prev, _ = self.parse_xref(xref_stream['Prev'])
         else:
             prev = None
         xref = XRefTable(self, prev)
@@ -372,49 +374,46 @@ class PDFReader(PDFObjectReader, cos.Document):
         if 'Index' in xref_stream:
             index = iter(int(value) for value in xref_stream['Index'])
         else:
-            index = (0, size)
-        row_struct = struct.Struct('>' + ''.join('{}B'.format(width)
-                                                 for width in widths))
-        xref_stream.seek(0)
+            index = iter((0, size))
+        field_offsets = [sum(widths[:i]) for i in range(4)]
+        field_slices = [slice(start, end) for start, end
+                        in zip(field_offsets, field_offsets[1:])]
+        row_size = field_offsets[-1]
+        data = xref_stream.read()
+        xref_stream.reset()
+        position = 0
         while True:
             try:
                 first, total = next(index), next(index)
             except StopIteration:
                 break
             for identifier in range(first, first + total):
-                fields = row_struct.unpack(xref_stream.read(row_struct.size))
+                row = data[position:position + row_size]
+                position += row_size
+                fields = [int.from_bytes(row[field_slice], 'big')
+                          for field_slice in field_slices]
                 if widths[0] == 0:
-                    field_type = 1
-                else:
-                    field_type = fields[0]
-                    fields = fields[1:]
+                    fields[0] = 1
+                field_type, *fields = fields
                 field_class = FIELD_CLASSES[field_type]
                 xref[identifier] = field_class(identifier, *fields)
-        assert identifier + 1 == size
         return xref, xref_stream
 
     EOF_MARKER = b'%%EOF'
     START_XREF = b'startxref'
 
     def find_xref_offset(self):
-        offset = self.file.seek(- len(self.EOF_MARKER), SEEK_END)
-        for i in range(10):
-            self.file.seek(offset)
-            if self.file.read(len(self.EOF_MARKER)) == self.EOF_MARKER:
-                break
-            offset -= 1
-        else:
+        # the trailer is located in the last 1024 bytes of the file
+        tail_offset = max(len(self.data) - 1024, 0)
+        eof_index = self.data.rfind(self.EOF_MARKER, tail_offset)
+        if eof_index < 0:
             raise ValueError('Not a PDF file: missing %%EOF')
-        offset -= len(self.START_XREF)
-        while True:
-            self.file.seek(offset)
-            value = self.file.read(len(self.START_XREF))
-            if value == self.START_XREF:
-                self.jump_to_next_line()
-                xref_offset = self.read_number()
-                break
-            offset -= 1
-        return int(xref_offset)
+        start_xref_index = self.data.rfind(self.START_XREF, tail_offset,
+                                           eof_index)
+        if start_xref_index < 0:
+            raise ValueError('Not a PDF file: missing startxref')
+        self.position = start_xref_index + len(self.START_XREF)
+        return int(self.read_number())
 
 
 class XRefTable(dict):
@@ -473,17 +472,98 @@ FIELD_CLASSES = {0: FreeObjectEntry,
                  2: CompressedObjectEntry}
 
 
+class PDFReaderCache(dict):
+    """Maps the path, modification time and size of parsed PDF files to their
+    :class:`PDFReader`, so that embedding several pages of a PDF file does not
+    parse it again for each page. Objects are loaded from the file as they are
+    accessed, so the files are only unmapped by :meth:`close` once the
+    document embedding the pages has been written.
+
+    A :class:`PDFReader` is not thread-safe; hold :attr:`lock` while using the
+    readers handed out by :meth:`get_reader`."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = RLock()
+
+    def get_reader(self, file_or_filename):
+        """Return a :class:`PDFReader` for `file_or_filename`. PDF files
+        specified by their path are parsed only once (for as long as they are
+        unmodified)."""
+        try:
+            stat = os.stat(file_or_filename)
+        except TypeError:
+            return PDFReader(file_or_filename)
+        key = (os.path.abspath(file_or_filename), stat.st_mtime_ns,
+               stat.st_size)
+        with self.lock:
+            try:
+                return self[key]
+            except KeyError:
+                reader = self[key] = PDFReader(file_or_filename)
+                return reader
+
+    def close(self):
+        with self.lock:
+            while self:
+                _, reader = self.popitem()
+                reader.close()
+
+
 class PDFPageReader(XObjectForm):
-    def __init__(self, file_or_filename, page_number=1):
-        pdf_file = PDFReader(file_or_filename)
-        page = pdf_file.catalog['Pages']['Kids'][page_number - 1]
-        super().__init__(page['MediaBox'])
+    """Page `page_number` of a PDF file, embedded as a form XObject. If
+    `pdf_readers` (a :class:`PDFReaderCache`) is given, the PDF file is parsed
+    only once for all pages embedded from it."""
+
+    def __init__(self, file_or_filename, page_number=1, pdf_readers=None):
+        if pdf_readers is None:
+            self._read_page(PDFReader(file_or_filename), page_number)
+        else:
+            with pdf_readers.lock:
+                self._read_page(pdf_readers.get_reader(file_or_filename),
+                                page_number)
+
+    def _read_page(self, pdf_file, page_number):
+        page = self._find_page(pdf_file.catalog['Pages'], page_number - 1)
+        super().__init__(self._inherited(page, 'MediaBox'))
         content_stream = page['Contents']
-        if 'Filter' in content_stream:
-            self['Filter'] = content_stream['Filter']
-        if 'Resources' in page:
-            self['Resources'] = page['Resources']
-        self.write(content_stream.getvalue())
+        if isinstance(content_stream, cos.Array):   # concatenate the streams
+            self.write(b'\n'.join(content_stream[index].read()
+                                  for index in range(len(content_stream))))
+        else:
+            if 'Filter' in content_stream:
+                self['Filter'] = content_stream['Filter']
+            self.write(content_stream.getvalue())
+        resources = self._inherited(page, 'Resources')
+        if resources is not None:
+            self['Resources'] = resources
+
+    @staticmethod
+    def _find_page(pages, index):
+        """Return the page with the given `index` from the page tree node
+        `pages`; only the subtrees leading to the page are loaded"""
+        kids = pages['Kids']
+        for kid in (kids[i] for i in range(len(kids))):
+            if kid.get('Type') == b'Pages':
+                if index < kid['Count']:
+                    return PDFPageReader._find_page(kid, index)
+                index -= kid['Count']
+            elif index == 0:
+                return kid
+            else:
+                index -= 1
+        raise IndexError('PDF file has no page with this number')
+
+    @staticmethod
+    def _inherited(page, key):
+        """Look up the inheritable page attribute `key` in `page` and its
+        ancestors in the page tree"""
+        node = page
+        while node is not None:
+            if key in node:
+                return node[key]
+            node = node['Parent'] if 'Parent' in node else None
+        return None
 
     @property
     def width(self):
@@ -6,43 +6,97 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-from io import BytesIO, SEEK_END
+from collections import OrderedDict
 
 
 class FIFOBuffer(object):
-    def __init__(self, source, buffer_size=4096):
+    """Buffers the data produced by :meth:`read_from_source`, to be consumed
+    by :meth:`read`. The data is stored in a bytearray; the bytes that have
+    been consumed are only discarded once they make up the larger part of
+    the buffer.
+
+    Initially, `buffer_size` bytes are requested from the source on each
+    fill. This amount is doubled (up to `max_fill_size`) each time a single
+    :meth:`read` needs more than one fill, so that large reads are served
+    by few calls to :meth:`read_from_source`."""
+
+    def __init__(self, source, buffer_size=4096, max_fill_size=1024 * 1024):
         self._source = source
         self._buffer_size = buffer_size
-        self._fifo = BytesIO()
-        self._write_pos = 0
+        self._max_fill_size = max_fill_size
+        self._fill_size = buffer_size
+        self._fifo = bytearray()
         self._read_pos = 0
 
     @property
     def size(self):
-        return self._write_pos - self._read_pos
+        return len(self._fifo) - self._read_pos
 
     def read_from_source(self, n):
         raise NotImplementedError
 
     def fill_buffer(self):
-        self._fifo.seek(self._write_pos)
-        data = self.read_from_source(self._buffer_size)
-        self._fifo.write(data)
-        self._write_pos = self._fifo.tell()
+        data = self.read_from_source(self._fill_size)
+        self._fifo += data
         return len(data) > 0
 
     def read(self, n=-1):
-        while n is None or n < 0 or self.size < n:
-            if not self.fill_buffer():
-                break
-        self._fifo.seek(self._read_pos)
-        out = self._fifo.read(n)
-        self._read_pos = self._fifo.tell()
-        if self._read_pos >= self._buffer_size:
-            self._fifo = BytesIO(self._fifo.read())
-            self._write_pos = self._fifo.seek(0, SEEK_END)
-            self._read_pos = 0
+        fifo = self._fifo
+        start = self._read_pos
+        if n is None or n < 0:
+            while self.fill_buffer():
+                self._grow_fill_size()
+            end = len(fifo)
+        else:
+            end = start + n
+            if end > len(fifo):
+                if self.fill_buffer():
+                    while end > len(fifo):
+                        self._grow_fill_size()
+                        if not self.fill_buffer():
+                            break
+                end = min(end, len(fifo))
+        if end - start > self._buffer_size:     # avoid an intermediate copy
+            with memoryview(fifo) as view:
+                out = view[start:end].tobytes()
+        else:
+            out = bytes(fifo[start:end])
+        if end >= self._buffer_size and 2 * end >= len(fifo):
+            del fifo[:end]
+            end = 0
+        self._read_pos = end
         return out
 
+    def _grow_fill_size(self):
+        self._fill_size = min(2 * self._fill_size, self._max_fill_size)
+
     def close(self):
         self._source.close()
+
+
+class FilePool(object):
+    """Hands out binary file objects for reading, keeping at most `max_open`
+    files open at any time. Files that have not been used for the longest
+    time are closed first.
+
+    Since files are shared, callers should seek before reading."""
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self._files = OrderedDict()
+
+    def open(self, filename):
+        try:
+            file = self._files.pop(filename)
+        except KeyError:
+            while len(self._files) >= self.max_open:
+                _, least_recently_used = self._files.popitem(last=False)
+                least_recently_used.close()
+            file = open(filename, 'rb')
+        self._files[filename] = file
+        return file
+
+    def close(self):
+        while self._files:
+            _, file = self._files.popitem()
+            file.close()
@@ -7,8 +7,10 @@
 
 import os
 
+from threading import Lock
+
 from ...filter import FlateDecode
-from ...cos import Stream
+from ...cos import Stream, Integer
 
 
 __all__ = ['get_icc_stream', 'SRGB', 'ADOBERGB', 'UNCALIBRATED']
@@ -22,15 +24,26 @@ ICC_PATH = os.path.abspath(os.path.dirname(__file__))
 ICC_FILENAME = {SRGB: 'sRGB_IEC61966-2-1_black_scaled.icc',
                 ADOBERGB: None}   # TODO
 ICC_STREAM = {}
-
-
-def get_icc_stream(color_space):
-    try:
-        return ICC_STREAM[color_space]
-    except KeyError:
-        icc_file_path = os.path.join(ICC_PATH, ICC_FILENAME[color_space])
-        stream = Stream(filter=FlateDecode())
-        with open(icc_file_path, 'rb') as icc:
-            stream.write(icc.read())
-        ICC_STREAM[color_space] = stream
-        return stream
+ICC_STREAM_LOCK = Lock()
+
+
+def get_icc_stream(color_space, num_components, alternate):
+    """Return the ICC profile stream for `color_space` describing
+    `num_components` color components, with `alternate` as the alternate
+    color space. The returned stream is shared and should not be modified.
+
+    Images are decoded in worker threads (see :class:`ImageStore`), so the
+    cache is guarded by a lock."""
+    key = color_space, num_components, alternate
+    with ICC_STREAM_LOCK:
+        try:
+            return ICC_STREAM[key]
+        except KeyError:
+            icc_file_path = os.path.join(ICC_PATH, ICC_FILENAME[color_space])
+            stream = Stream(filter=FlateDecode())
+            with open(icc_file_path, 'rb') as icc:
+                stream.write(icc.read())
+            stream['N'] = Integer(num_components)
+            stream['Alternate'] = alternate
+            ICC_STREAM[key] = stream
+            return stream
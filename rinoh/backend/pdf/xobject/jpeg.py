@@ -5,6 +5,8 @@
 # Use of this source code is subject to the terms of the GNU Affero General
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
+import os
+
 from io import SEEK_CUR
 from struct import Struct, unpack, calcsize
 
@@ -34,14 +36,25 @@ def create_reader(data_format, process_struct=lambda data: data[0], endian='>'):
 # * http://www.cipa.jp/std/documents/e/DC-008-2012_E.pdf
 
 class JPEGReader(XObjectImage):
+    """A JPEG image embedded as-is (DCTDecode).
+
+    If the image is read from a file specified by its filename, only the
+    image's metadata is kept in memory; the JPEG data is copied from the file
+    to the PDF file while writing it. The file is then opened using the
+    :class:`FilePool` assigned to :attr:`source_files` by the backend document
+    being written, if any."""
+
     COLOR_SPACE = {1: DEVICE_GRAY,
                    3: DEVICE_RGB,
                    4: DEVICE_CMYK}
 
+    # files from which JPEG data is copied at the time the PDF is written
+    source_files = None
+
     def __init__(self, file_or_filename):
         try:
             self._file = open(file_or_filename, 'rb')
-            self.filename = file_or_filename
+            self.filename = os.path.abspath(file_or_filename)
         except TypeError:
             self._file = file_or_filename
             self.filename = None
@@ -51,11 +64,13 @@ class JPEGReader(XObjectImage):
             raise ValueError('PDF only supports JPEG files with 8 bits '
                              'per component')
         device_color_space = self.COLOR_SPACE[num_components]
-        if icc_profile is None and exif_color_space is not UNCALIBRATED:
-            icc_profile = get_icc_stream(exif_color_space)
         if icc_profile is not None:
             icc_profile['N'] = Integer(num_components)
             icc_profile['Alternate'] = device_color_space
+        elif exif_color_space is not UNCALIBRATED:
+            icc_profile = get_icc_stream(exif_color_space, num_components,
+                                         device_color_space)
+        if icc_profile is not None:
             colorspace = Array([Name('ICCBased'), icc_profile])
         else:
             colorspace = device_color_space
@@ -63,12 +78,53 @@ class JPEGReader(XObjectImage):
                          filter=DCTDecode())
         if adobe_color_transform and num_components == 4:  # invert CMYK colors
             self['Decode'] = Array([Integer(1), Integer(0)] * 4)
-        self._file.seek(0)
-        while True:
-            buffer = self._file.read(512 * 1024)  # 512 KB
+        if self.filename is not None:
+            self._length = os.fstat(self._file.fileno()).st_size
+            self._file.close()
+        else:
+            self._length = None
+            self._file.seek(0)
+            while True:
+                buffer = self._file.read(512 * 1024)  # 512 KB
+                if not buffer:
+                    break
+                self._data.write(buffer)
+        del self._file
+
+    def data_length(self):
+        if self._length is None:
+            return super().data_length()
+        return self._length
+
+    def content_digest(self, document):
+        # an image read from a file is not deduplicated here, as hashing it
+        # would read the whole file an extra time; ImageStore already shares
+        # a single reader between all files with identical contents
+        if self._length is not None:
+            return None
+        return super().content_digest(document)
+
+    def data_chunks(self):
+        if self._length is None:
+            yield from super().data_chunks()
+            return
+        if self.source_files is None:
+            with open(self.filename, 'rb') as file:
+                yield from self._copy_chunks(file)
+        else:
+            file = self.source_files.open(self.filename)
+            file.seek(0)
+            yield from self._copy_chunks(file)
+
+    def _copy_chunks(self, file):
+        remaining = self._length
+        while remaining:
+            buffer = file.read(min(remaining, 512 * 1024))  # 512 KB
             if not buffer:
-                break
-            self._data.write(buffer)
+                raise IOError("JPEG file '{}' was truncated"
+                              .format(self.filename))
+            remaining -= len(buffer)
+            yield buffer
 
     read_uchar = create_reader('B')
 
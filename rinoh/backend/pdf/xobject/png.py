@@ -5,9 +5,6 @@
 # Use of this source code is subject to the terms of the GNU Affero General
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
-from io import BytesIO
-from itertools import islice
-from struct import Struct, pack
 
 import png as purepng
 
@@ -23,7 +20,13 @@ __all__ = ['PNGReader']
 
 
 class PNGReader(XObjectImage):
-    def __init__(self, file_or_filename):
+    """Embeds a PNG image. Its image data is copied as is, unless the image
+    has an alpha channel or transparent palette entries. The separated color
+    and alpha channels are then compressed at `compression_level`, as are the
+    palette and ICC profile."""
+
+    def __init__(self, file_or_filename, compression_level=6):
+        self.compression_level = compression_level
         png = purepng.Reader(file_or_filename)
         try:
             png.preamble()
@@ -37,7 +40,7 @@ class PNGReader(XObjectImage):
                                          columns=png.width)
         super().__init__(png.width, png.height, self._colorspace(png),
                          png.bitdepth, self._dpi(png),
-                         filter=FlateDecode(color_params))
+                         filter=FlateDecode(color_params, compression_level))
         if png.rendering_intent is not None:
             self['Intent'] = RENDERING_INTENT[png.rendering_intent]
         if png.alpha:  # grayscale/RGB with alpha channel
@@ -46,7 +49,8 @@ class PNGReader(XObjectImage):
                                              columns=png.width)
             self['SMask'] = XObjectImage(png.width, png.height, DEVICE_GRAY,
                                          png.bitdepth,
-                                         filter=FlateDecode(smask_params))
+                                         filter=FlateDecode(smask_params,
+                                                            compression_level))
             for color_row, alpha_row in self._split_color_alpha(png):
                 self.write(color_row, bypass_predictor=True)
                 self['SMask'].write(alpha_row, bypass_predictor=True)
@@ -58,7 +62,7 @@ class PNGReader(XObjectImage):
                     # TODO: if only a single color has trn 0, go to else
                     self['SMask'] = XObjectImage(png.width, png.height,
                                                  DEVICE_GRAY, 8,
-                                                 filter=FlateDecode())
+                                                 filter=self._filter())
                     for alpha_row in self._plte_index_to_alpha(png):
                         self['SMask'].write(alpha_row)
                 else:  # a single color is transparent
@@ -66,6 +70,9 @@ class PNGReader(XObjectImage):
                               for _ in range(2))
                     self['Mask'] = Array(Integer(value) for value in values)
 
+    def _filter(self):
+        return FlateDecode(level=self.compression_level)
+
     def _dpi(self, png):
         try:
             (x_density, y_density), unit = png.resolution
@@ -78,13 +85,15 @@ class PNGReader(XObjectImage):
 
     def _colorspace(self, png):
         device_color_space = COLOR_SPACE[png.color_type & 3]
+        num_components = 3 if device_color_space == DEVICE_RGB else 1
         icc_profile = self._icc_profile(png)
-        if icc_profile is None and png.rendering_intent is not None:
-            icc_profile = get_icc_stream(SRGB)
         if icc_profile is not None:
-            icc_profile['N'] = Integer(3 if device_color_space == DEVICE_RGB
-                                       else 1)
+            icc_profile['N'] = Integer(num_components)
             icc_profile['Alternate'] = device_color_space
+        elif png.rendering_intent is not None:
+            icc_profile = get_icc_stream(SRGB, num_components,
+                                         device_color_space)
+        if icc_profile is not None:
             colorspace = Array([Name('ICCBased'), icc_profile])
         else:
             cal_colorspace = {}
@@ -113,7 +122,7 @@ class PNGReader(XObjectImage):
                 colorspace = device_color_space
         if png.colormap:  # palette
             num_entries = len(png.plte) // 3
-            palette_stream = Stream(filter=FlateDecode())
+            palette_stream = Stream(filter=self._filter())
             palette_stream.write(png.plte)
             colorspace = Array([INDEXED, colorspace,
                                 Integer(num_entries - 1), palette_stream])
@@ -121,43 +130,63 @@ class PNGReader(XObjectImage):
 
     def _icc_profile(self, png):
         if hasattr(png, 'icc_profile'):
-            icc_profile = Stream(filter=FlateDecode())
+            icc_profile = Stream(filter=self._filter())
             icc_profile.write(png.icc_profile)
             return icc_profile
         else:
             return None
 
     def _split_color_alpha(self, png):
+        """Yield the (still filtered) rows of the color and alpha channels.
+
+        The color and alpha samples are gathered using extended slices, which
+        are handled at C speed. Since the PNG filters operate on matching
+        bytes of neighboring pixels, the filtered rows can be split as is."""
         bytedepth = png.bitdepth // 8
         num_color_bytes = png.color_planes * bytedepth
-        idat = BytesIO()
+        num_pixel_bytes = num_color_bytes + bytedepth
+        row_num_bytes = 1 + num_pixel_bytes * png.width
+        color_row = bytearray(1 + num_color_bytes * png.width)
+        alpha_row = bytearray(1 + bytedepth * png.width)
+        data = bytearray()
         for idat_chunk in png.idatdecomp():
-            idat.write(idat_chunk)
-        row_num_bytes = 1 + (png.color_planes + 1) * bytedepth * png.width
-        pixel_color_fmt = '{}B{}x'.format(num_color_bytes, bytedepth)
-        pixel_alpha_fmt = '{}x{}B'.format(num_color_bytes, bytedepth)
-        row_color_struct = Struct('B' + pixel_color_fmt * png.width)
-        row_alpha_struct = Struct('B' + pixel_alpha_fmt * png.width)
-        idat.seek(0)
-        row_bytes = bytearray(row_num_bytes)
-        for i in range(png.height):
-            idat.readinto(row_bytes)
-            color_values = row_color_struct.unpack(row_bytes)
-            alpha_values = row_alpha_struct.unpack(row_bytes)
-            yield bytes(color_values), bytes(alpha_values)
-        assert idat.read() == b''
+            data += idat_chunk
+            num_rows = len(data) // row_num_bytes
+            color, alpha = [], []
+            for index in range(0, num_rows * row_num_bytes, row_num_bytes):
+                row = data[index:index + row_num_bytes]
+                color_row[0] = alpha_row[0] = row[0]    # filter type
+                for i in range(num_color_bytes):
+                    color_row[1 + i::num_color_bytes] = \
+                        row[1 + i::num_pixel_bytes]
+                for i in range(bytedepth):
+                    alpha_row[1 + i::bytedepth] = \
+                        row[1 + num_color_bytes + i::num_pixel_bytes]
+                color.append(bytes(color_row))
+                alpha.append(bytes(alpha_row))
+            del data[:num_rows * row_num_bytes]
+            if color:
+                yield b''.join(color), b''.join(alpha)
+        assert not data
 
     def _plte_index_to_alpha(self, png):
+        """Yield the alpha values for the palette indices in this image's
+        rows, in blocks of rows."""
         num_entries = len(png.plte) // 3
-        frm = b''.join(pack('B', i) for i in range(num_entries))
-        to = (b''.join(pack('B', alpha) for alpha in png.trns)
-              + b'\xFF' * (num_entries - len(png.trns)))
-        trans = bytearray.maketrans(frm, to)
-        rows = (self.read(png.row_bytes) for _ in range(png.height))
-        if png.bitdepth < 8:
-            rows = to_8bit_per_pixel(rows, png.bitdepth, png.width)
-        for row_bytes in rows:
-            yield row_bytes.translate(trans)
+        frm = bytes(range(num_entries))
+        to = bytes(png.trns) + b'\xFF' * (num_entries - len(png.trns))
+        trans = bytes.maketrans(frm, to)
+        row_bytes = png.row_bytes
+        rows_per_block = max(1, (256 * 1024) // row_bytes)
+        block_bytes = rows_per_block * row_bytes
+        for _ in range(0, png.height, rows_per_block):
+            block = self.read(block_bytes)
+            if png.bitdepth < 8:
+                rows = (block[index:index + row_bytes]
+                        for index in range(0, len(block), row_bytes))
+                block = b''.join(to_8bit_per_pixel(rows, png.bitdepth,
+                                                   png.width))
+            yield block.translate(trans)
         assert self.read() == b''
         self.reset()
 
@@ -176,15 +205,20 @@ CCIR_XA11_D65_WHITE_POINT = Array([Real(0.9505), Real(1.0000), Real(1.0890)])
 
 
 def to_8bit_per_pixel(rows, bitdepth, width):
+    """Unpack `rows` of `bitdepth`-bit samples to one byte per sample.
+
+    Each byte holds 8 // `bitdepth` samples; for each of these, a translation
+    table extracts the sample from all bytes in the row at once."""
     px_per_byte = 8 // bitdepth
     mask = 2**bitdepth - 1
-    shft = [(i - 1) * bitdepth for i in range(px_per_byte, 0, -1)]
-
-    row_buffer = bytearray(width)
+    tables = [bytes((byte >> ((px_per_byte - 1 - i) * bitdepth)) & mask
+                    for byte in range(256))
+              for i in range(px_per_byte)]
     for row_bytes in rows:
-        row_buffer[:] = islice(((byte >> shift) & mask
-                                for byte in row_bytes
-                                for shift in shft), width)
+        row_buffer = bytearray(len(row_bytes) * px_per_byte)
+        for i, table in enumerate(tables):
+            row_buffer[i::px_per_byte] = row_bytes.translate(table)
+        del row_buffer[width:]
         yield row_buffer
 
 
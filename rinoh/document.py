@@ -18,6 +18,18 @@ Classes representing a document:
 * :const:`PORTRAIT`: The page's height is larger than its width.
 * :const:`LANDSCAPE`: The page's width is larger than its height.
 
+A :class:`Document` can be rendered using an output profile, which limits the
+resolution of bitmap images:
+
+* :const:`SCREEN`: Images are downsampled to 150 DPI.
+* :const:`PRINT`: Images are downsampled to 300 DPI.
+
+The compression of the output is controlled by a compression profile:
+
+* :const:`DRAFT_COMPRESSION`: Fast, light compression.
+* :const:`DEFAULT_COMPRESSION`: A balance between speed and output size.
+* :const:`RELEASE_COMPRESSION`: Slow, maximum compression.
+
 """
 
 
@@ -28,7 +40,7 @@ from collections import OrderedDict
 from itertools import count
 
 from . import __version__, __release_date__
-from .backend import pdf
+from .backend import pdf, BasicImageStore
 from .flowable import RIGHT, LEFT
 from .layout import FlowableTarget, Container, ReflowRequired
 from .number import NUMBER
@@ -36,7 +48,10 @@ from .util import NotImplementedAttribute
 
 
 __all__ = ['Page', 'DocumentPart', 'DocumentSection', 'Document',
-           'PageOrientation', 'PORTRAIT', 'LANDSCAPE']
+           'PageOrientation', 'PORTRAIT', 'LANDSCAPE',
+           'OutputProfile', 'SCREEN', 'PRINT',
+           'CompressionProfile', 'DRAFT_COMPRESSION', 'DEFAULT_COMPRESSION',
+           'RELEASE_COMPRESSION']
 
 
 class PageOrientation(str):
@@ -47,6 +62,45 @@ PORTRAIT = PageOrientation('portrait')
 LANDSCAPE = PageOrientation('landscape')
 
 
+class OutputProfile(str):
+    """Identifies the intended use of the rendered document. Bitmap images
+    whose effective resolution exceeds `image_resolution` (DPI) are
+    downsampled before they are embedded."""
+
+    def __new__(cls, name, image_resolution):
+        profile = super().__new__(cls, name)
+        profile.image_resolution = image_resolution
+        return profile
+
+
+SCREEN = OutputProfile('screen', 150)
+PRINT = OutputProfile('print', 300)
+
+
+class CompressionProfile(str):
+    """Determines the compression level, from 0 (no compression) to 9
+    (maximum compression), used for each category of data written to the
+    output by the backend:
+
+    - `contents`: the page contents
+    - `fonts`: embedded fonts and their character mappings
+    - `images`: bitmap image data that needs to be re-encoded
+
+    The backend maps these levels onto its compression method."""
+
+    def __new__(cls, name, contents, fonts, images):
+        profile = super().__new__(cls, name)
+        profile.contents = contents
+        profile.fonts = fonts
+        profile.images = images
+        return profile
+
+
+DRAFT_COMPRESSION = CompressionProfile('draft', 1, 1, 1)
+DEFAULT_COMPRESSION = CompressionProfile('default', 6, 6, 6)
+RELEASE_COMPRESSION = CompressionProfile('release', 9, 9, 9)
+
+
 class Page(Container):
     """A single page in a document. A :class:`Page` is a :class:`Container`, so
     other containers can be added as children."""
@@ -67,6 +121,7 @@ class Page(Container):
         self.backend_page = document.backend.Page(self, backend_document,
                                                   width, height)
         self.section = None     # will point to the last section on this page
+        self._number = None     # set by DocumentPart.add_page
         self.overflowed_chains = []
         self._current_section = {}
         super().__init__('PAGE', None, 0, 0, width, height)
@@ -104,7 +159,8 @@ class Page(Container):
 
     @property
     def number(self):
-        return self.document_section.page_number(self)
+        """The number of this page within its document section"""
+        return self._number
 
     @property
     def number_format(self):
@@ -168,7 +224,12 @@ class DocumentPart(object):
         return self.number_of_pages
 
     def add_page(self, page):
-        """Append `page` (:class:`Page`) to this :class:`DocumentPart`."""
+        """Append `page` (:class:`Page`) to this :class:`DocumentPart` and
+        assign it its number within the document section. The parts of a
+        section are rendered in order, so the number of pages in the preceding
+        parts is known at this point."""
+        preceding_pages = self.document_section.number_of_pages_preceding(self)
+        page._number = preceding_pages + len(self.pages) + 1
         self.pages.append(page)
 
     def first_page(self):
@@ -198,10 +259,18 @@ class DocumentSection(object):
     def pages(self):
         return (page for part in self._parts for page in part.pages)
 
-    def page_number(self, this_page):
-        for i, page in enumerate(self.pages, start=1):
-            if this_page is page:
-                return i
+    def number_of_pages_preceding(self, document_part):
+        """The number of pages in the parts of this section that precede
+        `document_part`"""
+        count = 0
+        for part in self._parts:
+            if part is document_part:
+                break
+            count += part.number_of_pages
+        return count
+
+    def page_number(self, page):
+        return page.number
 
     def prepare(self):
         for part in self._parts:
@@ -225,6 +294,21 @@ class Document(object):
 
     CACHE_EXTENSION = '.rtc'
 
+    # directory in which to cache decoded images across documents (optional)
+    image_cache_directory = None
+
+    # the :class:`OutputProfile` to render for; images are embedded at their
+    # native resolution if `None`
+    output_profile = None
+
+    # the number of threads compressing the output's streams concurrently
+    # when writing it; streams are compressed one after the other if `None`
+    compression_threads = None
+
+    # the :class:`CompressionProfile` determining how the output is
+    # compressed; the backend's default if `None`
+    compression = None
+
     sections = NotImplementedAttribute()
 
     # FIXME: get backend document metadata from Document metadata
@@ -243,6 +327,14 @@ class Document(object):
         self.stylesheet = stylesheet
         self.backend = backend
         self.backend_document = self.backend.Document(self, self.CREATOR)
+        # images are decoded once and shared by all rendering iterations
+        try:
+            image_store = self.backend.ImageStore
+        except AttributeError:
+            self.images = BasicImageStore(self.backend)
+        else:
+            self.images = image_store(self.image_cache_directory,
+                                      self.compression)
 
         self._sections = [section_cls(self) for section_cls in self.sections]
         self.metadata = dict(title='Document Title',
@@ -342,6 +434,7 @@ to the terms of the GNU Affero General Public License version 3.''')
                 print('Writing output: {}'.format(filename))
             self.backend_document.write(file)
         finally:
+            self.images.close()
             if filename_root:
                 file.close()
 
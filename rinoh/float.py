@@ -38,9 +38,15 @@ class ImageBase(Flowable):
         self.width = width
         self.rotate = rotate
 
+    def prepare(self, document):
+        super().prepare(document)
+        if isinstance(self.filename_or_file, str):
+            document.images.prefetch(self.filename_or_file)
+
     def render(self, container, last_descender, state=None):
+        document = container.document
         try:
-            image = container.document.backend.Image(self.filename_or_file)
+            image = document.images.get_image(self.filename_or_file)
         except OSError:
             message = "Image file not found: '{}'".format(self.filename_or_file)
             self.warn(message)
@@ -57,9 +63,18 @@ class ImageBase(Flowable):
                             float(container.remaining_height) / image.height)
             else:
                 scale = self.scale
-        w, h = container.canvas.place_image(image, left, top,
-                                            container.document, scale=scale,
-                                            width=width, rotate=self.rotate)
+        if document.output_profile is not None:
+            if width is not None:
+                image_width, _ = image.rotated_size(self.rotate)
+                placed_scale = width / image_width
+            else:
+                placed_scale = scale
+            resolution = document.output_profile.image_resolution
+            image = document.images.get_image(self.filename_or_file,
+                                              placed_scale, resolution)
+        w, h = container.canvas.place_image(image, left, top, document,
+                                            scale=scale, width=width,
+                                            rotate=self.rotate)
         container.advance(h, ignore_overflow=self.scale == FIT)
         return w, 0
 
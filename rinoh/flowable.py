@@ -28,7 +28,7 @@ from .util import last
 from .style import Style, Styled
 
 
-__all__ = ['Flowable', 'FlowableStyle',
+__all__ = ['Flowable', 'FlowableStyle', 'ContentWidths',
            'DummyFlowable', 'WarnFlowable', 'SetMetadataFlowable',
            'InseparableFlowables', 'GroupedFlowables', 'StaticGroupedFlowables',
            'LabeledFlowable', 'GroupedLabeledFlowables',
@@ -57,6 +57,28 @@ class FlowableStyle(Style):
     default_base = None
 
 
+class ContentWidths(object):
+    """The minimum and maximum width of a flowable's content, as returned by
+    :meth:`Flowable.content_widths`.
+
+    `minimum` can also be a callable returning the minimum width, which is
+    then only determined when it is first needed. `static` indicates that
+    the widths do not depend on the state of the rendering pass (references
+    to page numbers, for example), so that they can be reused in subsequent
+    rendering passes."""
+
+    def __init__(self, minimum, maximum, static=False):
+        self._minimum = minimum
+        self.maximum = maximum
+        self.static = static
+
+    @property
+    def minimum(self):
+        if callable(self._minimum):
+            self._minimum = self._minimum()
+        return self._minimum
+
+
 class FlowableState(object):
     """Stores a :class:`Flowable`\'s rendering state, which can be copied. This
     enables saving the rendering state at certain points in the rendering
@@ -142,6 +164,29 @@ class Flowable(Styled):
         descender height of the preceding line or `None`."""
         raise NotImplementedError
 
+    def content_widths(self, container):
+        """Return the minimum and maximum width of this flowable, including
+        its horizontal margins, as :class:`ContentWidths`. The minimum width
+        is the width required to render the flowable's content when breaking
+        lines wherever possible. The maximum width allows rendering the
+        content without line breaks.
+
+        This implementation flows the flowable into a virtual container of
+        infinite width. It is only flowed into a container of zero width when
+        the minimum width is requested. Subclasses can override this with a
+        cheaper measurement."""
+        def flow_width(max_width):
+            buffer = VirtualContainer(container, width=max_width)
+            width, _ = self.flow(buffer, None)
+            return float(width)
+
+        return ContentWidths(lambda: flow_width(0), flow_width(float('+inf')))
+
+    def margins_width(self, document):
+        """Return the sum of this flowable's left and right margins."""
+        return (float(self.get_style('margin_left', document))
+                + float(self.get_style('margin_right', document)))
+
 
 # flowables that do not render anything (but with optional side-effects)
 
@@ -273,6 +318,20 @@ class GroupedFlowables(Flowable):
         except StopIteration:
             return max_flowable_width, descender
 
+    def content_widths(self, container):
+        widths = []
+        for flowable in self.flowables(container.document):
+            flowable.parent = self
+            widths.append(flowable.content_widths(container))
+        margins = self.margins_width(container.document)
+
+        def minimum():
+            return max((width.minimum for width in widths), default=0) + margins
+
+        maximum = max((width.maximum for width in widths), default=0) + margins
+        return ContentWidths(minimum, maximum,
+                             all(width.static for width in widths))
+
 
 class StaticGroupedFlowables(GroupedFlowables):
     def __init__(self, flowables, id=None, style=None, parent=None):
@@ -412,6 +471,7 @@ class HorizontallyAlignedFlowable(Flowable):
 
     def flow(self, container, last_descender, state=None):
         with MaybeContainer(container) as align_container:
+            width = None
             try:
                 width, descender = super().flow(align_container, last_descender,
                                                 state)
@@ -78,6 +78,47 @@ class Font(object):
     def get_kerning(self, a, b):
         raise NotImplementedError
 
+    def shape(self, glyphs, ligatures=True, kerning=True):
+        """Form ligatures from and kern the sequence of `glyphs`.
+
+        Returns a list of (glyph, advance adjustment) tuples, the adjustment
+        being expressed in font units. This implementation handles glyph pairs
+        one at a time using :meth:`get_ligature` and :meth:`get_kerning`."""
+        if not glyphs:
+            return []
+        if ligatures:
+            glyphs = form_ligatures(glyphs, self.get_ligature)
+        if kerning:
+            return kern(glyphs, self.get_kerning)
+        else:
+            return [(glyph, 0.0) for glyph in glyphs]
+
+
+def form_ligatures(glyphs, get_ligature):
+    glyphs = iter(glyphs)
+    result = []
+    prev_glyph = next(glyphs)
+    for glyph in glyphs:
+        ligature_glyph = get_ligature(prev_glyph, glyph)
+        if ligature_glyph:
+            prev_glyph = ligature_glyph
+        else:
+            result.append(prev_glyph)
+            prev_glyph = glyph
+    result.append(prev_glyph)
+    return result
+
+
+def kern(glyphs, get_kerning):
+    glyphs = iter(glyphs)
+    result = []
+    prev_glyph = next(glyphs)
+    for glyph in glyphs:
+        result.append((prev_glyph, get_kerning(prev_glyph, glyph)))
+        prev_glyph = glyph
+    result.append((prev_glyph, 0.0))
+    return result
+
 
 class TypeFace(dict):
     def __init__(self, name, *fonts, weight_order=WEIGHTS):
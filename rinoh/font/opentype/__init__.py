@@ -8,13 +8,14 @@
 
 from warnings import warn
 
-from ...util import cached
 from ...warnings import RinohWarning
 from .. import Font, GlyphMetrics, LeafGetter
 from ..style import MEDIUM, UPRIGHT, NORMAL
 from ..style import SMALL_CAPITAL
 
 from .parse import OpenTypeParser
+from .gpos import PairAdjustments
+from .gsub import SingleSubTable, LigatureSubTable, LigatureTrie
 from .ids import NAME_PS_NAME, PLATFORM_WINDOWS, LANGUAGE_WINDOWS_EN_US
 
 
@@ -45,8 +46,10 @@ class OpenTypeFont(Font, OpenTypeParser):
         self._glyphs_by_code = self._create_glyph_metrics()
         self._glyphs = self._create_glyphs_by_char(self._glyphs_by_code)
         self._suffixes = {}
+        self._substitutions = {}
         self._ligatures = {}
         self._kerning_pairs = {}
+        self._shaping_lookups = dict(GSUB={}, GPOS={})
 
     def _create_glyph_metrics(self):
         glyphs_by_code = {}
@@ -90,18 +93,29 @@ class OpenTypeFont(Font, OpenTypeParser):
                  .format(self.name, ord(char), char), RinohWarning)
             return self._glyphs['?']
 
-        if variant == SMALL_CAPITAL and 'GSUB' in self:
-            lookup_tables = self._get_lookup_tables('GSUB', 'smcp', 'latn')
-            for lookup_table in lookup_tables:
-                try:
-                    code = lookup_table.lookup(glyph.code)
-                    return self._glyphs_by_code[code]
-                except KeyError:
-                    pass
+        if variant == SMALL_CAPITAL:
+            substitutions = self._get_substitutions('latn', None, ('smcp', ))
+            try:
+                return self._glyphs_by_code[substitutions[glyph.code]]
+            except KeyError:
+                pass
         return glyph
 
-    def _get_lookup_tables(self, table, feature, script='DFLT', language=None):
+    def _get_lookup_tables(self, table, features, script='DFLT',
+                           language=None):
+        """Return the lookup tables from `table` ('GSUB' or 'GPOS') associated
+        with `features` (a single feature tag or a tuple of tags) for `script`
+        and `language`, in lookup list order"""
         lookup_tables = self[table]['LookupList']['Lookup']
+        return [lookup_tables[index] for index
+                in self._get_lookup_indices(table, features, script, language)]
+
+    def _get_lookup_indices(self, table, features, script='DFLT',
+                            language=None):
+        """Return the sorted lookup list indices of the lookups associated with
+        `features` (see :meth:`_get_lookup_tables`)"""
+        if isinstance(features, str):
+            features = (features, )
         try:
             script_table = self[table]['ScriptList'].by_tag[script][0]
         except KeyError:
@@ -109,7 +123,7 @@ class OpenTypeFont(Font, OpenTypeParser):
                 warn('{} does not support the script "{}". Trying default '
                      'script.'.format(self.name, script, RinohWarning))
                 try:
-                    return self._get_lookup_tables(table, feature)
+                    return self._get_lookup_indices(table, features)
                 except KeyError:
                     return []
             else:
@@ -126,40 +140,132 @@ class OpenTypeFont(Font, OpenTypeParser):
         else:
             lang_sys_table = script_table['DefaultLangSys']
         feature_indices = lang_sys_table['FeatureIndex']
+        lookup_list_indices = set()
         for index in feature_indices:
             record = self[table]['FeatureList']['Record'][index]
-            if record['Tag'] == feature:
-                lookup_list_indices = record['Value']['LookupListIndex']
-                return [lookup_tables[lookup_list_index]
-                        for lookup_list_index in lookup_list_indices]
-        return []
+            if record['Tag'] in features:
+                lookup_list_indices.update(record['Value']['LookupListIndex'])
+        return sorted(lookup_list_indices)
 
-    @cached
-    def get_ligature(self, glyph, successor_glyph):
-        if 'GSUB' in self:
-            lookup_tables = self._get_lookup_tables('GSUB', 'liga', 'latn')
+    def _get_compiled(self, cache, table, compile, script, language, features):
+        """Return the lookups for `features` from `table`, compiled by
+        `compile`. The result is stored in `cache` (a dictionary indexed by
+        `script`, `language` and `features`)."""
+        key = script, language, features
+        try:
+            return cache[key]
+        except KeyError:
+            lookup_tables = (self._get_lookup_tables(table, features, script,
+                                                     language)
+                             if table in self else [])
+            cache[key] = compiled = compile(lookup_tables)
+            return compiled
+
+    def _get_substitutions(self, script, language, features):
+        """Return a dictionary mapping glyph IDs to the glyph ID they are to be
+        replaced with by the single substitution lookups for `features`"""
+        def compile(lookup_tables):
+            substitutions = {}
             for lookup_table in lookup_tables:
-                try:
-                    code = lookup_table.lookup(glyph.code, successor_glyph.code)
-                    return self._glyphs_by_code[code]
-                except KeyError:
-                    pass
-        return None
+                for subtable in lookup_table['SubTable']:
+                    if not isinstance(subtable, SingleSubTable):
+                        continue
+                    for glyph_id, substitute in subtable.compile().items():
+                        substitutions.setdefault(glyph_id, substitute)
+            return substitutions
 
-    @cached
-    def get_kerning(self, a, b):
-        if 'GPOS' in self:
-            lookup_tables = self._get_lookup_tables('GPOS', 'kern', 'latn')
-            # TODO: 'kern' lookup list indices can point to pair adjustment (2)
-            #       or Chained Context positioning (8) lookup subtables
+        return self._get_compiled(self._substitutions, 'GSUB', compile,
+                                  script, language, features)
+
+    def _get_ligature_trie(self, script, language, features):
+        """Return the ligatures formed by the ligature substitution lookups
+        for `features` as a :class:`LigatureTrie`"""
+        def compile(lookup_tables):
+            trie = LigatureTrie()
             for lookup_table in lookup_tables:
-                try:
-                    return lookup_table.lookup(a.code, b.code)
-                except KeyError:
-                    pass
-        if 'kern' in self:
-            try:
-                return self['kern'][0].pairs[a.code][b.code]
-            except KeyError:
-                pass
-        return 0.0
+                for subtable in lookup_table['SubTable']:
+                    if isinstance(subtable, LigatureSubTable):
+                        trie.merge(subtable.compile())
+            return trie
+
+        return self._get_compiled(self._ligatures, 'GSUB', compile,
+                                  script, language, features)
+
+    def _get_pair_adjustments(self, script, language, features):
+        """Return the pair kerning defined by the pair adjustment lookups for
+        `features`, falling back to the 'kern' table, as
+        :class:`PairAdjustments`"""
+        def compile(lookup_tables):
+            fallback_pairs = self['kern'][0].pairs if 'kern' in self else None
+            return PairAdjustments(lookup_tables, fallback_pairs)
+
+        return self._get_compiled(self._kerning_pairs, 'GPOS', compile,
+                                  script, language, features)
+
+    def _get_shaping_lookups(self, table, script, language, features):
+        """Return the compiled lookups for `features` from `table`, in the order
+        they are to be applied"""
+        def compile(lookup_tables):
+            if not lookup_tables:
+                return []
+            compiled_lookups = self[table].compiled_lookups
+            return [compiled_lookups[index] for index
+                    in self._get_lookup_indices(table, features, script,
+                                                language)]
+
+        return self._get_compiled(self._shaping_lookups[table], table, compile,
+                                  script, language, features)
+
+    def shape(self, glyphs, ligatures=True, kerning=True):
+        """Apply the GSUB and GPOS lookups for the enabled features to the
+        sequence of `glyphs` as a whole.
+
+        Substitution lookups are applied one after the other, each processing
+        the complete glyph run. Positioning lookups then adjust the glyph
+        advances; horizontal mark placements are folded into the advances of
+        the mark and the glyph preceding it."""
+        if not glyphs:
+            return []
+        glyph_ids = [glyph.code for glyph in glyphs]
+        gsub_features = ('ccmp', ) + (('liga', 'clig') if ligatures else ())
+        gsub_lookups = self._get_shaping_lookups('GSUB', 'latn', None,
+                                                 gsub_features)
+        if gsub_lookups:
+            lookups = self['GSUB'].compiled_lookups
+            for lookup in gsub_lookups:
+                if lookup.applies_to(glyph_ids):
+                    lookup.substitute(glyph_ids, lookups)
+        glyphs_by_code = self._glyphs_by_code
+        glyphs = [glyphs_by_code[glyph_id] for glyph_id in glyph_ids]
+        advances = [glyph.width for glyph in glyphs]
+        gpos_features = ('kern', 'mark', 'mkmk') if kerning else ('mark',
+                                                                  'mkmk')
+        gpos_lookups = self._get_shaping_lookups('GPOS', 'latn', None,
+                                                 gpos_features)
+        if gpos_lookups:
+            placements = [0] * len(glyphs)
+            for lookup in gpos_lookups:
+                if lookup.applies_to(glyph_ids):
+                    lookup.position(glyph_ids, advances, placements)
+            for index, placement in enumerate(placements):
+                if placement and index > 0:
+                    advances[index - 1] += placement
+                    advances[index] -= placement
+        if (kerning and 'kern' in self and
+                not self._get_shaping_lookups('GPOS', 'latn', None,
+                                              ('kern', ))):
+            kerning_pairs = self._get_pair_adjustments('latn', None, ())
+            for index in range(len(glyph_ids) - 1):
+                advances[index] += kerning_pairs.get_adjustment(
+                    glyph_ids[index], glyph_ids[index + 1])
+        return [(glyph, advance - glyph.width)
+                for glyph, advance in zip(glyphs, advances)]
+
+    def get_ligature(self, glyph, successor_glyph):
+        ligatures = self._get_ligature_trie('latn', None, ('liga', ))
+        code = ligatures.get_ligature(glyph.code, successor_glyph.code)
+        return self._glyphs_by_code[code] if code is not None else None
+
+    def get_kerning(self, a, b):
+        kerning_pairs = self._get_pair_adjustments('latn', None, ('kern', ))
+        return kerning_pairs.get_adjustment(a.code, b.code)
@@ -0,0 +1,84 @@
+# This file is part of RinohType, the Python document preparation system.
+#
+# Copyright (c) Brecht Machiels.
+#
+# Use of this source code is subject to the terms of the GNU Affero General
+# Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
+
+
+from .parse import OpenTypeTable, uint16, ulong, offset, array
+from .layout import Coverage, ClassDefinition
+
+
+# glyph classes assigned by the GlyphClassDef table
+BASE_GLYPH = 1
+LIGATURE_GLYPH = 2
+MARK_GLYPH = 3
+COMPONENT_GLYPH = 4
+
+
+class MarkGlyphSetsTable(OpenTypeTable):
+    entries = [('MarkSetTableFormat', uint16),
+               ('MarkSetCount', uint16)]
+
+    def __init__(self, file, file_offset):
+        super().__init__(file, file_offset)
+        coverage_offsets = array(ulong, self['MarkSetCount'])(file)
+        self['Coverage'] = [Coverage(file, file_offset + coverage_offset)
+                            for coverage_offset in coverage_offsets]
+
+
+class GdefTable(OpenTypeTable):
+    """Glyph definition table"""
+    tag = 'GDEF'
+    entries = [('MajorVersion', uint16),
+               ('MinorVersion', uint16)]
+
+    def __init__(self, file, file_offset):
+        super().__init__(file, file_offset)
+        # the attachment point and ligature caret lists are not needed
+        glyph_class_def_offset, _, _, mark_attach_class_def_offset \
+            = array(offset, 4)(file)
+        mark_glyph_sets_offset = (offset(file)
+                                  if self['MinorVersion'] >= 2 else 0)
+        self['GlyphClassDef'] = (ClassDefinition(file, file_offset
+                                                 + glyph_class_def_offset)
+                                 if glyph_class_def_offset else None)
+        self['MarkAttachClassDef'] = (
+            ClassDefinition(file, file_offset + mark_attach_class_def_offset)
+            if mark_attach_class_def_offset else None)
+        self['MarkGlyphSetsDef'] = (
+            MarkGlyphSetsTable(file, file_offset + mark_glyph_sets_offset)
+            if mark_glyph_sets_offset else None)
+
+    def ignored_glyphs(self, lookup_flag, mark_filtering_set=None):
+        """Return the set of glyph IDs that a lookup with the given
+        :class:`LookupFlag` skips over"""
+        if self['GlyphClassDef'] is None:
+            return frozenset()
+        glyph_classes = self['GlyphClassDef'].class_by_glyph_id()
+        ignored_classes = set()
+        if lookup_flag['IgnoreBaseGlyphs']:
+            ignored_classes.add(BASE_GLYPH)
+        if lookup_flag['IgnoreLigatures']:
+            ignored_classes.add(LIGATURE_GLYPH)
+        if lookup_flag['IgnoreMarks']:
+            ignored_classes.add(MARK_GLYPH)
+        ignored = set(glyph_id for glyph_id, glyph_class
+                      in glyph_classes.items()
+                      if glyph_class in ignored_classes)
+        if not lookup_flag['IgnoreMarks']:
+            marks = [glyph_id for glyph_id, glyph_class
+                     in glyph_classes.items() if glyph_class == MARK_GLYPH]
+            mark_glyph_sets = self['MarkGlyphSetsDef']
+            attach_class_def = self['MarkAttachClassDef']
+            attachment_type = lookup_flag['MarkAttachmentType'] >> 8
+            if lookup_flag['UseMarkFilteringSet'] and mark_glyph_sets:
+                coverage = mark_glyph_sets['Coverage'][mark_filtering_set]
+                ignored.update(mark for mark in marks
+                               if mark not in coverage)
+            elif attachment_type and attach_class_def:
+                ignored.update(mark for mark in marks
+                               if attach_class_def.class_number(mark)
+                               != attachment_type)
+        return frozenset(ignored)
@@ -12,7 +12,7 @@ from .parse import OpenTypeTable, MultiFormatTable, Record
 from .parse import fixed, int16, uint16, tag, glyph_id, offset, Packed
 from .parse import array, context, context_array, indirect, indirect_array
 from .layout import LayoutTable, ScriptListTable, FeatureListTable, LookupTable
-from .layout import Coverage, ClassDefinition, Device
+from .layout import Coverage, ClassDefinition, Device, ExtensionSubtable
 from ...util import cached_property
 
 
@@ -97,6 +97,41 @@ class SingleAdjustmentSubtable(MultiFormatTable):
                    ('Value', context_array(ValueRecord, 'ValueCount',
                                            'ValueFormat'))]}
 
+    def compile(self):
+        """Return a :class:`SingleAdjustment` for this subtable"""
+        def placement_and_advance(value_record):
+            return (value_record.get('XPlacement', 0),
+                    value_record.get('XAdvance', 0))
+
+        index_by_glyph_id = self['Coverage'].index_by_glyph_id()
+        if self['PosFormat'] == 1:
+            value = placement_and_advance(self['Value'])
+            return SingleAdjustment((glyph_id, value)
+                                    for glyph_id in index_by_glyph_id)
+        else:
+            values = [placement_and_advance(value_record)
+                      for value_record in self['Value']]
+            return SingleAdjustment((glyph_id, values[index])
+                                    for glyph_id, index
+                                    in index_by_glyph_id.items())
+
+
+class SingleAdjustment(dict):
+    """Maps glyph IDs to their (X placement, X advance) adjustment"""
+
+    @property
+    def first_glyphs(self):
+        return self.keys()
+
+    def position(self, glyph_ids, index, advances, placements):
+        try:
+            x_placement, x_advance = self[glyph_ids[index]]
+        except KeyError:
+            return False
+        placements[index] += x_placement
+        advances[index] += x_advance
+        return True
+
 
 class PairSetTable(OpenTypeTable):
     entries = [('PairValueCount', uint16)]
@@ -167,11 +202,11 @@ class PairAdjustmentSubtable(MultiFormatTable):
             self['Class1Record'] = class_1_record
 
     def lookup(self, a_id, b_id):
+        try:
+            index = self['Coverage'].index(a_id)
+        except ValueError:
+            raise KeyError
         if self['PosFormat'] == 1:
-            try:
-                index = self['Coverage'].index(a_id)
-            except ValueError:
-                raise KeyError
             pair_value_record = self['PairSet'][index].by_second_glyph_id[b_id]
             return pair_value_record['Value1']['XAdvance']
         elif self['PosFormat'] == 2:
@@ -180,10 +215,139 @@ class PairAdjustmentSubtable(MultiFormatTable):
             class_2_record = self['Class1Record'][a_class][b_class]
             return class_2_record['Value1']['XAdvance']
 
-
-class EntryExitRecord(OpenTypeTable):
+    def compile(self):
+        """Return the X advance adjustments defined by this subtable in a form
+        that no longer references the parsed table structure (see
+        :class:`GlyphPairs` and :class:`ClassPairs`)"""
+        if self['PosFormat'] == 1:
+            pairs = GlyphPairs()
+            pair_sets = self['PairSet']
+            for a_id, index in self['Coverage'].index_by_glyph_id().items():
+                by_second_glyph_id = pair_sets[index].by_second_glyph_id
+                adjustments = {b_id: record['Value1']['XAdvance']
+                               for b_id, record in by_second_glyph_id.items()
+                               if 'XAdvance' in record['Value1']}
+                if adjustments:
+                    pairs[a_id] = adjustments
+            return pairs
+        elif self['PosFormat'] == 2:
+            matrix = [[class_2_record['Value1'].get('XAdvance')
+                       for class_2_record in class_2_records]
+                      for class_2_records in self['Class1Record']]
+            return ClassPairs(self['Coverage'].index_by_glyph_id(),
+                              self['ClassDef1'].class_by_glyph_id(),
+                              self['ClassDef2'].class_by_glyph_id(), matrix)
+
+
+class PairPositioning(object):
+    """Mixin applying the X advance adjustment for a glyph pair to the advance
+    of the first glyph"""
+
+    def get_adjustment(self, a_id, b_id):
+        raise NotImplementedError
+
+    def position(self, glyph_ids, index, advances, placements):
+        if index + 1 < len(glyph_ids):
+            adjustment = self.get_adjustment(glyph_ids[index],
+                                             glyph_ids[index + 1])
+            if adjustment is not None:
+                advances[index] += adjustment
+                return True
+        return False
+
+
+class GlyphPairs(PairPositioning, dict):
+    """Maps first glyph IDs to dictionaries mapping second glyph IDs to the
+    X advance adjustment for the glyph pair"""
+
+    @property
+    def first_glyphs(self):
+        return self.keys()
+
+    def get_adjustment(self, a_id, b_id):
+        """Return the adjustment for the (`a_id`, `b_id`) glyph pair, or `None`
+        if this glyph pair is not listed"""
+        try:
+            return self[a_id][b_id]
+        except KeyError:
+            return None
+
+    def merge(self, other):
+        """Add the glyph pairs from `other` that are not yet listed here"""
+        for a_id, other_adjustments in other.items():
+            adjustments = self.setdefault(a_id, {})
+            for b_id, adjustment in other_adjustments.items():
+                adjustments.setdefault(b_id, adjustment)
+
+
+class ClassPairs(PairPositioning):
+    """Class-pair X advance adjustment matrix, indexed by the classes assigned
+    to the first and second glyph of a glyph pair"""
+
+    __slots__ = ('coverage', 'class_def_1', 'class_def_2', 'matrix')
+
+    def __init__(self, coverage, class_def_1, class_def_2, matrix):
+        self.coverage = coverage
+        self.class_def_1 = class_def_1
+        self.class_def_2 = class_def_2
+        self.matrix = matrix
+
+    @property
+    def first_glyphs(self):
+        return self.coverage.keys()
+
+    def get_adjustment(self, a_id, b_id):
+        """Return the adjustment for the (`a_id`, `b_id`) glyph pair, or `None`
+        if this glyph pair is not covered"""
+        if a_id not in self.coverage:
+            return None
+        a_class = self.class_def_1.get(a_id, 0)
+        b_class = self.class_def_2.get(b_id, 0)
+        return self.matrix[a_class][b_class]
+
+
+class PairAdjustments(list):
+    """Pair kerning compiled from a list of GPOS lookup tables.
+
+    The pair adjustment subtables are converted to :class:`GlyphPairs` and
+    :class:`ClassPairs` instances which are tried in lookup order; the first
+    one that lists a glyph pair determines its adjustment. Consecutive glyph
+    pair subtables are merged into a single dictionary.
+
+    `fallback_pairs` holds glyph pairs (in the format of the :class:`KernTable`
+    subtable's `pairs`) to try when none of the lookup subtables match."""
+
+    def __init__(self, lookup_tables, fallback_pairs=None):
+        super().__init__()
+        # TODO: 'kern' lookup list indices can point to pair adjustment (2)
+        #       or Chained Context positioning (8) lookup subtables
+        for lookup_table in lookup_tables:
+            for subtable in lookup_table['SubTable']:
+                if isinstance(subtable, PairAdjustmentSubtable):
+                    self.append(subtable.compile())
+        if fallback_pairs:
+            self.append(GlyphPairs(fallback_pairs))
+
+    def append(self, pairs):
+        if isinstance(pairs, GlyphPairs) and self \
+                and isinstance(self[-1], GlyphPairs):
+            self[-1].merge(pairs)
+        else:
+            super().append(pairs)
+
+    def get_adjustment(self, a_id, b_id):
+        """Return the X advance adjustment for the (`a_id`, `b_id`) glyph pair
+        in font units"""
+        for pairs in self:
+            adjustment = pairs.get_adjustment(a_id, b_id)
+            if adjustment is not None:
+                return adjustment
+        return 0.0
+
+
+class EntryExitRecord(Record):
     entries = [('EntryAnchor', indirect(Anchor)),
-               ('ExitAnchor', indirect(Anchor, 'EntryExitCount'))]
+               ('ExitAnchor', indirect(Anchor))]
 
 
 class CursiveAttachmentSubtable(OpenTypeTable):
@@ -193,52 +357,110 @@ class CursiveAttachmentSubtable(OpenTypeTable):
                ('EntryExitRecord', context_array(EntryExitRecord, 'EntryExitCount'))]
 
 
-class MarkCoverage(OpenTypeTable):
-    pass
-
-
-class BaseCoverage(OpenTypeTable):
-    pass
-
-
-class Mark2Array(OpenTypeTable):
-    pass
-
-
-class BaseRecord(OpenTypeTable):
-##    entries = [('BaseAnchor', indirect_array(Anchor, 'ClassCount'))]
-
-    def __init__(self, file, file_offset, class_count):
-        super().__init__(self, file, file_offset)
-##        self['BaseAnchor'] = indirect_array(Anchor, 'ClassCount'])(file)
-
-
 class BaseArray(OpenTypeTable):
+    """Array of base (or Mark2) records, each listing an anchor for each mark
+    class. Anchors are `None` for classes that cannot attach to the base."""
     entries = [('BaseCount', uint16)]
-##               ('BaseRecord', context_array(BaseRecord, 'BaseCount'))]
 
     def __init__(self, file, file_offset, class_count):
-        super().__init__(self, file, file_offset)
-        self['BaseRecord'] = array(BaseRecord, self['BaseCount'],
-                                   class_count=class_count)(file)
+        super().__init__(file, file_offset)
+        anchor_offsets = [array(offset, class_count)(file)
+                          for i in range(self['BaseCount'])]
+        self['BaseRecord'] = [[Anchor(file, file_offset + anchor_offset)
+                               if anchor_offset else None
+                               for anchor_offset in record_offsets]
+                              for record_offsets in anchor_offsets]
 
 
 class MarkToBaseAttachmentSubtable(OpenTypeTable):
     entries = [('PosFormat', uint16),
-               ('MarkCoverage', indirect(MarkCoverage)),
-               ('BaseCoverage', indirect(BaseCoverage)),
+               ('MarkCoverage', indirect(Coverage)),
+               ('BaseCoverage', indirect(Coverage)),
                ('ClassCount', uint16),
                ('MarkArray', indirect(MarkArray)),
                ('BaseArray', indirect(BaseArray, 'ClassCount'))]
 
+    def compile(self):
+        """Return a :class:`MarkAttachment` for this subtable"""
+        return compile_mark_attachment(self['MarkCoverage'], self['MarkArray'],
+                                       self['BaseCoverage'], self['BaseArray'])
+
 
 class MarkToMarkAttachmentSubtable(OpenTypeTable):
     entries = [('PosFormat', uint16),
-               ('Mark1Coverage', indirect(MarkCoverage)),
-               ('Mark1Coverage', indirect(MarkCoverage)),
+               ('Mark1Coverage', indirect(Coverage)),
+               ('Mark2Coverage', indirect(Coverage)),
                ('ClassCount', uint16),
                ('Mark1Array', indirect(MarkArray)),
-               ('Mark1Array', indirect(Mark2Array))]
+               ('Mark2Array', indirect(BaseArray, 'ClassCount'))]
+
+    def compile(self):
+        """Return a :class:`MarkAttachment` for this subtable"""
+        return compile_mark_attachment(self['Mark1Coverage'],
+                                       self['Mark1Array'],
+                                       self['Mark2Coverage'],
+                                       self['Mark2Array'], to_mark=True)
+
+
+def compile_mark_attachment(mark_coverage, mark_array, base_coverage,
+                            base_array, to_mark=False):
+    """Create a :class:`MarkAttachment` from the parsed coverage and mark/base
+    array tables of a mark attachment subtable"""
+    mark_records = mark_array['MarkRecord']
+    marks = {glyph_id: (mark_records[index]['Class'],
+                        mark_records[index]['MarkAnchor']['XCoordinate'])
+             for glyph_id, index in mark_coverage.index_by_glyph_id().items()}
+    base_records = base_array['BaseRecord']
+    bases = {glyph_id: [anchor['XCoordinate'] if anchor else None
+                        for anchor in base_records[index]]
+             for glyph_id, index in base_coverage.index_by_glyph_id().items()}
+    return MarkAttachment(marks, bases, to_mark)
+
+
+class MarkAttachment(object):
+    """Compiled mark-to-base or mark-to-mark attachment subtable.
+
+    `marks` maps mark glyph IDs to their (mark class, anchor X coordinate)
+    and `bases` maps base glyph IDs to a list of anchor X coordinates indexed
+    by mark class (`None` for classes that cannot attach). Marks attach to the
+    closest preceding base glyph, skipping other marks, or to the directly
+    preceding mark glyph when `to_mark` is set.
+
+    Only the horizontal offset of the mark is adjusted; the anchor Y
+    coordinates are ignored since lines of text are set on a single
+    baseline."""
+
+    def __init__(self, marks, bases, to_mark=False):
+        self.marks = marks
+        self.bases = bases
+        self.to_mark = to_mark
+
+    @property
+    def first_glyphs(self):
+        return self.marks.keys()
+
+    def position(self, glyph_ids, index, advances, placements):
+        try:
+            mark_class, mark_x = self.marks[glyph_ids[index]]
+        except KeyError:
+            return False
+        base_index = index - 1
+        if not self.to_mark:
+            while base_index >= 0 and glyph_ids[base_index] in self.marks:
+                base_index -= 1
+        if base_index < 0:
+            return False
+        try:
+            base_x = self.bases[glyph_ids[base_index]][mark_class]
+        except KeyError:
+            return False
+        if base_x is None:
+            return False
+        # the mark's origin is positioned relative to the base glyph's origin
+        pen_offset = sum(advances[base_index:index])
+        placements[index] = (placements[base_index] + base_x - mark_x
+                             - pen_offset)
+        return True
 
 
 class GposTable(LayoutTable):
@@ -248,4 +470,5 @@ class GposTable(LayoutTable):
                     2: PairAdjustmentSubtable,
                     3: CursiveAttachmentSubtable,
                     4: MarkToBaseAttachmentSubtable,
-                    6: MarkToMarkAttachmentSubtable}
+                    6: MarkToMarkAttachmentSubtable,
+                    9: ExtensionSubtable}
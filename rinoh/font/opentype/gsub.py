@@ -6,11 +6,11 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-from .parse import OpenTypeTable, MultiFormatTable
+from .parse import OpenTypeTable, MultiFormatTable, Record
 from .parse import fixed, int16, uint16, tag, glyph_id, offset, array, indirect
 from .parse import context_array, indirect_array, Packed
 from .layout import LayoutTable, ScriptListTable, FeatureListTable, LookupTable
-from .layout import Coverage, ClassDefinition
+from .layout import Coverage, ClassDefinition, ExtensionSubtable
 
 
 # Single subsitution (subtable format 1)
@@ -27,10 +27,77 @@ class SingleSubTable(MultiFormatTable):
         except ValueError:
             raise KeyError
         if self['SubstFormat'] == 1:
-            return index + self['DeltaGlyphID']
+            return (glyph_id + self['DeltaGlyphID']) % 0x10000
         else:
             return self['Substitute'][index]
 
+    def compile(self):
+        """Return a :class:`SingleSubstitution` mapping glyph IDs to their
+        substitute"""
+        index_by_glyph_id = self['Coverage'].index_by_glyph_id()
+        if self['SubstFormat'] == 1:
+            delta = self['DeltaGlyphID']
+            return SingleSubstitution((glyph_id, (glyph_id + delta) % 0x10000)
+                                      for glyph_id in index_by_glyph_id)
+        else:
+            substitutes = self['Substitute']
+            return SingleSubstitution((glyph_id, substitutes[index])
+                                      for glyph_id, index
+                                      in index_by_glyph_id.items())
+
+
+class SingleSubstitution(dict):
+    """Maps glyph IDs to the glyph ID that replaces them"""
+
+    @property
+    def first_glyphs(self):
+        return self.keys()
+
+    def substitute(self, glyph_ids, index, lookups):
+        try:
+            glyph_ids[index] = self[glyph_ids[index]]
+        except KeyError:
+            return None
+        return index + 1
+
+
+# Multiple substitution (subtable format 2)
+class Sequence(OpenTypeTable):
+    entries = [('GlyphCount', uint16),
+               ('Substitute', context_array(glyph_id, 'GlyphCount'))]
+
+
+class MultipleSubTable(OpenTypeTable):
+    entries = [('SubstFormat', uint16),
+               ('Coverage', indirect(Coverage)),
+               ('SequenceCount', uint16),
+               ('Sequence', indirect_array(Sequence, 'SequenceCount'))]
+
+    def compile(self):
+        """Return a :class:`MultipleSubstitution` mapping glyph IDs to the
+        sequence of glyph IDs that replaces them"""
+        sequences = self['Sequence']
+        index_by_glyph_id = self['Coverage'].index_by_glyph_id()
+        return MultipleSubstitution((glyph_id, sequences[index]['Substitute'])
+                                    for glyph_id, index
+                                    in index_by_glyph_id.items())
+
+
+class MultipleSubstitution(dict):
+    """Maps glyph IDs to the sequence of glyph IDs that replaces them"""
+
+    @property
+    def first_glyphs(self):
+        return self.keys()
+
+    def substitute(self, glyph_ids, index, lookups):
+        try:
+            sequence = self[glyph_ids[index]]
+        except KeyError:
+            return None
+        glyph_ids[index:index + 1] = sequence
+        return index + len(sequence)
+
 
 # Alternate subtitition (subtable format 3)
 class AlternateSubTable(OpenTypeTable):
@@ -69,24 +136,113 @@ class LigatureSubTable(OpenTypeTable):
                 return ligature['LigGlyph']
         raise KeyError
 
+    def compile(self):
+        """Return the ligatures defined in this subtable as a
+        :class:`LigatureTrie`"""
+        trie = LigatureTrie()
+        ligature_sets = self['LigatureSet']
+        for first_id, index in self['Coverage'].index_by_glyph_id().items():
+            for ligature in ligature_sets[index]['Ligature']:
+                trie.add([first_id] + ligature['Component'],
+                         ligature['LigGlyph'])
+        return trie
+
+
+class LigatureTrie(dict):
+    """Prefix tree of ligature components. Each node maps a glyph ID to the
+    node for the next component. The ligature glyph ID formed by the
+    components leading up to a node is stored in the node under the `None`
+    key."""
+
+    @property
+    def first_glyphs(self):
+        return self.keys()
+
+    def add(self, component_ids, ligature_id):
+        """Register the ligature `ligature_id` for the `component_ids`
+        sequence, unless a ligature was already registered for it"""
+        node = self
+        for component_id in component_ids:
+            node = node.setdefault(component_id, {})
+        node.setdefault(None, ligature_id)
+
+    def merge(self, other):
+        """Add the ligatures from `other` that are not yet present here"""
+        def merge_node(node, other_node):
+            for key, value in other_node.items():
+                if key is None:
+                    node.setdefault(None, value)
+                else:
+                    merge_node(node.setdefault(key, {}), value)
+
+        merge_node(self, other)
+
+    def get_ligature(self, a_id, b_id):
+        """Return the ligature glyph ID for the `a_id`, `b_id` glyph pair, or
+        `None` if these glyphs do not form a ligature"""
+        try:
+            return self[a_id][b_id].get(None)
+        except KeyError:
+            return None
+
+    def substitute(self, glyph_ids, index, lookups):
+        """Replace the longest sequence of glyphs starting at `index` that
+        forms a ligature"""
+        node = self.get(glyph_ids[index])
+        ligature_id = None
+        position = index + 1
+        while node is not None:
+            if None in node:
+                ligature_id, end = node[None], position
+            if position == len(glyph_ids):
+                break
+            node = node.get(glyph_ids[position])
+            position += 1
+        if ligature_id is None:
+            return None
+        glyph_ids[index:end] = [ligature_id]
+        return index + 1
+
 
 # Chaining contextual subsitution (subtable format 6)
+class SubstLookupRecord(Record):
+    entries = [('SequenceIndex', uint16),
+               ('LookupListIndex', uint16)]
+
+
 class ChainSubRule(OpenTypeTable):
-    pass
-##    entries = [('BacktrackGlyphCount', uint16),
-##               ('Backtrack', context_array(glyph_id, 'BacktrackGlyphCount')),
-##               ('InputGlyphCount', uint16),
-##               ('Input', context_array(glyph_id, 'InputGlyphCount',
-##                                       lambda count: count - 1)),
-##               ('LookaheadGlyphCount', uint16),
-##               ('LookAhead', context_array(glyph_id, 'LookaheadGlyphCount')),
-##               ('SubstCount', uint16),
-##               ('SubstLookupRecord', context_array(glyph_id, 'SubstCount'))]
+    """Chaining context rule; also used for class-based rules, in which case
+    the sequences hold glyph classes instead of glyph IDs"""
+    entries = [('BacktrackGlyphCount', uint16),
+               ('Backtrack', context_array(glyph_id, 'BacktrackGlyphCount')),
+               ('InputGlyphCount', uint16)]
+    trailing_entries = [('LookaheadGlyphCount', uint16),
+                        ('LookAhead', context_array(glyph_id,
+                                                    'LookaheadGlyphCount')),
+                        ('SubstCount', uint16),
+                        ('SubstLookupRecord', context_array(SubstLookupRecord,
+                                                            'SubstCount'))]
+
+    def __init__(self, file, file_offset):
+        super().__init__(file, file_offset)
+        # the first input glyph is not listed in the rule
+        self['Input'] = array(glyph_id, self['InputGlyphCount'] - 1)(file)
+        self.parse(file, file_offset, self.trailing_entries)
+
+    def compile(self):
+        """Return this rule as a :class:`ChainRule`"""
+        def sequence(values):
+            return tuple(frozenset([value]) for value in values)
+
+        return ChainRule(sequence(self['Backtrack']), sequence(self['Input']),
+                         sequence(self['LookAhead']),
+                         self['SubstLookupRecord'])
 
 
 class ChainSubRuleSet(OpenTypeTable):
     entries = [('ChainSubRuleCount', uint16),
-               ('ChainSubRule', indirect(ChainSubRule))]
+               ('ChainSubRule', indirect_array(ChainSubRule,
+                                               'ChainSubRuleCount'))]
 
 
 class ChainingContextSubtable(MultiFormatTable):
@@ -94,13 +250,157 @@ class ChainingContextSubtable(MultiFormatTable):
     formats = {1: [('Coverage', indirect(Coverage)),
                    ('ChainSubRuleSetCount', uint16),
                    ('ChainSubRuleSet', indirect_array(ChainSubRuleSet,
-                                                      'ChainSubRuleSetCount'))]}
+                                                      'ChainSubRuleSetCount'))],
+               2: [('Coverage', indirect(Coverage)),
+                   ('BacktrackClassDef', indirect(ClassDefinition)),
+                   ('InputClassDef', indirect(ClassDefinition)),
+                   ('LookaheadClassDef', indirect(ClassDefinition)),
+                   ('ChainSubClassSetCount', uint16)],
+               3: [('BacktrackGlyphCount', uint16),
+                   ('BacktrackCoverage',
+                    indirect_array(Coverage, 'BacktrackGlyphCount')),
+                   ('InputGlyphCount', uint16),
+                   ('InputCoverage',
+                    indirect_array(Coverage, 'InputGlyphCount')),
+                   ('LookaheadGlyphCount', uint16),
+                   ('LookaheadCoverage',
+                    indirect_array(Coverage, 'LookaheadGlyphCount')),
+                   ('SubstCount', uint16),
+                   ('SubstLookupRecord',
+                    context_array(SubstLookupRecord, 'SubstCount'))]}
+
+    def __init__(self, file, file_offset):
+        super().__init__(file, file_offset)
+        if self['SubstFormat'] == 2:
+            # offsets to rule sets for classes without rules are NULL
+            set_offsets = array(offset, self['ChainSubClassSetCount'])(file)
+            self['ChainSubClassSet'] = \
+                [ChainSubRuleSet(file, file_offset + set_offset)
+                 if set_offset else None for set_offset in set_offsets]
+
+    def compile(self):
+        """Return a :class:`ChainingContextSubstitution` for this subtable"""
+        def class_definition(key):
+            return self[key].class_by_glyph_id()
+
+        def coverages(key):
+            return tuple(frozenset(coverage.index_by_glyph_id())
+                         for coverage in self[key])
+
+        subst_format = self['SubstFormat']
+        if subst_format == 1:
+            rule_sets = self['ChainSubRuleSet']
+            rules = {first_id: [rule.compile() for rule
+                                in rule_sets[index]['ChainSubRule']]
+                     for first_id, index
+                     in self['Coverage'].index_by_glyph_id().items()}
+            return ChainingContextSubstitution(rules.keys(), rules)
+        elif subst_format == 2:
+            rules = {class_value: [rule.compile() for rule
+                                   in rule_set['ChainSubRule']]
+                     for class_value, rule_set
+                     in enumerate(self['ChainSubClassSet']) if rule_set}
+            return ChainingContextSubstitution(
+                self['Coverage'].index_by_glyph_id().keys(), rules,
+                class_definition('BacktrackClassDef'),
+                class_definition('InputClassDef'),
+                class_definition('LookaheadClassDef'))
+        else:
+            first_coverage, *input = coverages('InputCoverage')
+            rule = ChainRule(coverages('BacktrackCoverage'), tuple(input),
+                             coverages('LookaheadCoverage'),
+                             self['SubstLookupRecord'])
+            return ChainingContextSubstitution(first_coverage, {None: [rule]})
+
+
+class ChainRule(object):
+    """Compiled chaining context rule. The backtrack, input (excluding the
+    first glyph) and lookahead sequences hold a set of accepted glyph IDs or
+    glyph classes for each glyph. The backtrack sequence is stored in reverse
+    order. `lookup_records` lists (sequence index, lookup list index)
+    tuples."""
+
+    __slots__ = ('backtrack', 'input', 'lookahead', 'lookup_records')
+
+    def __init__(self, backtrack, input, lookahead, subst_lookup_records):
+        self.backtrack = backtrack
+        self.input = input
+        self.lookahead = lookahead
+        self.lookup_records = [(record['SequenceIndex'],
+                                record['LookupListIndex'])
+                               for record in subst_lookup_records]
+
+
+class ChainingContextSubstitution(object):
+    r"""Compiled chaining contextual substitution subtable.
+
+    `rules` maps the first input glyph ID (format 1) or its class (format 2)
+    to the list of :class:`ChainRule`\ s to try. For coverage-based subtables
+    (format 3), the single rule is stored under the `None` key. The class
+    definitions are dictionaries mapping glyph IDs to their class (format 2
+    only)."""
+
+    def __init__(self, first_glyphs, rules, backtrack_classes=None,
+                 input_classes=None, lookahead_classes=None):
+        self.first_glyphs = frozenset(first_glyphs)
+        self.rules = rules
+        self.backtrack_classes = backtrack_classes
+        self.input_classes = input_classes
+        self.lookahead_classes = lookahead_classes
+
+    @staticmethod
+    def _match(glyph_ids, sequence, classes):
+        for glyph_id, accepted in zip(glyph_ids, sequence):
+            value = glyph_id if classes is None else classes.get(glyph_id, 0)
+            if value not in accepted:
+                return False
+        return True
+
+    def _find_rule(self, glyph_ids, index):
+        first_id = glyph_ids[index]
+        if None in self.rules:
+            rules = self.rules[None]
+        elif self.input_classes is None:
+            rules = self.rules.get(first_id, ())
+        else:
+            rules = self.rules.get(self.input_classes.get(first_id, 0), ())
+        for rule in rules:
+            input_end = index + 1 + len(rule.input)
+            if (index < len(rule.backtrack)
+                    or input_end + len(rule.lookahead) > len(glyph_ids)):
+                continue
+            if (self._match(glyph_ids[index - 1::-1] if index else (),
+                            rule.backtrack, self.backtrack_classes)
+                    and self._match(glyph_ids[index + 1:input_end],
+                                    rule.input, self.input_classes)
+                    and self._match(glyph_ids[input_end:], rule.lookahead,
+                                    self.lookahead_classes)):
+                return rule
+        return None
+
+    def substitute(self, glyph_ids, index, lookups):
+        if glyph_ids[index] not in self.first_glyphs:
+            return None
+        rule = self._find_rule(glyph_ids, index)
+        if rule is None:
+            return None
+        end = index + 1 + len(rule.input)
+        for sequence_index, lookup_index in rule.lookup_records:
+            position = index + sequence_index
+            length = len(glyph_ids)
+            if position < end:
+                lookups[lookup_index].substitute_at(glyph_ids, position,
+                                                    lookups)
+            end += len(glyph_ids) - length
+        return end
 
 
 class GsubTable(LayoutTable):
     """Glyph substitution table"""
     tag = 'GSUB'
     lookup_types = {1: SingleSubTable,
+                    2: MultipleSubTable,
                     3: AlternateSubTable,
-                    4: LigatureSubTable}#,
-                    #6: ChainingContextSubtable}
+                    4: LigatureSubTable,
+                    6: ChainingContextSubtable,
+                    7: ExtensionSubtable}
@@ -6,8 +6,12 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
+from warnings import warn
+
+from ...warnings import RinohWarning
 from .parse import OpenTypeTable, MultiFormatTable, Record, context_array
-from .parse import fixed, array, uint16, tag, glyph_id, offset, indirect, Packed
+from .parse import fixed, array, uint16, ulong, tag, glyph_id, offset, indirect
+from .parse import Packed
 
 
 class ListRecord(Record):
@@ -89,16 +93,34 @@ class Coverage(MultiFormatTable):
                2: [('RangeCount', uint16),
                    ('RangeRecord', context_array(RangeRecord, 'RangeCount'))]}
 
-    def index(self, glyph_id):
+    def __init__(self, file, file_offset=None):
+        super().__init__(file, file_offset)
+        # map glyph IDs to their coverage index for constant-time lookups
         if self['CoverageFormat'] == 1:
-            return self['GlyphArray'].index(glyph_id)
+            self._index_by_glyph_id = {glyph_id: index for index, glyph_id
+                                       in enumerate(self['GlyphArray'])}
         else:
+            self._index_by_glyph_id = index_by_glyph_id = {}
             for record in self['RangeRecord']:
-                if record['Start'] <= glyph_id <= record['End']:
-                    return (record['StartCoverageIndex']
-                            + glyph_id - record['Start'])
+                start, end = record['Start'], record['End']
+                start_index = record['StartCoverageIndex'] - start
+                for glyph_id in range(start, end + 1):
+                    index_by_glyph_id[glyph_id] = start_index + glyph_id
+
+    def __contains__(self, glyph_id):
+        return glyph_id in self._index_by_glyph_id
+
+    def index(self, glyph_id):
+        try:
+            return self._index_by_glyph_id[glyph_id]
+        except KeyError:
             raise ValueError
 
+    def index_by_glyph_id(self):
+        """Return a mapping of the covered glyph IDs to their coverage index.
+        The mapping is shared and should not be modified."""
+        return self._index_by_glyph_id
+
 
 class ClassRangeRecord(OpenTypeTable):
     entries = [('Start', glyph_id),
@@ -115,16 +137,37 @@ class ClassDefinition(MultiFormatTable):
                    ('ClassRangeRecord', context_array(ClassRangeRecord,
                                                       'ClassRangeCount'))]}
 
-    def class_number(self, glyph_id):
+    def __init__(self, file, file_offset=None):
+        super().__init__(file, file_offset)
+        # map glyph IDs to their class; glyphs not listed belong to class 0
+        self._class_by_glyph_id = class_by_glyph_id = {}
         if self['ClassFormat'] == 1:
-            index = glyph_id - self['StartGlyph']
-            if 0 <= index < self['GlyphCount']:
-                return self['ClassValueArray'][index]
+            start_glyph = self['StartGlyph']
+            for index, class_value in enumerate(self['ClassValueArray']):
+                if class_value:
+                    class_by_glyph_id[start_glyph + index] = class_value
         else:
             for record in self['ClassRangeRecord']:
-                if record['Start'] <= glyph_id <= record['End']:
-                    return record['Class']
-        return 0
+                class_value = record['Class']
+                if class_value:
+                    for glyph_id in range(record['Start'], record['End'] + 1):
+                        class_by_glyph_id[glyph_id] = class_value
+
+    def class_number(self, glyph_id):
+        return self._class_by_glyph_id.get(glyph_id, 0)
+
+    def class_by_glyph_id(self):
+        """Return a mapping of glyph IDs to their class. Glyphs of class 0 are
+        not included. The mapping is shared and should not be modified."""
+        return self._class_by_glyph_id
+
+
+class ExtensionSubtable(OpenTypeTable):
+    """Extension lookup subtable (GSUB type 7, GPOS type 9) that points to a
+    subtable of another lookup type using a 32-bit offset"""
+    entries = [('ExtensionFormat', uint16),
+               ('ExtensionLookupType', uint16),
+               ('ExtensionOffset', ulong)]
 
 
 class LookupTable(OpenTypeTable):
@@ -132,14 +175,33 @@ class LookupTable(OpenTypeTable):
                ('LookupFlag', LookupFlag),
                ('SubTableCount', uint16)]
 
-    def __init__(self, file, file_offset, subtable_types):
+    def __init__(self, file, file_offset, subtable_types,
+                 unsupported_types=None):
         super().__init__(file, file_offset)
+        if unsupported_types is None:
+            unsupported_types = set()
         offsets = array(uint16, self['SubTableCount'])(file)
         if self['LookupFlag']['UseMarkFilteringSet']:
             self['MarkFilteringSet'] = uint16(file)
-        subtable_type = subtable_types[self['LookupType']]
-        self['SubTable'] = [subtable_type(file, file_offset + subtable_offset)
-                            for subtable_offset in offsets]
+        subtables = []
+        for subtable_offset in offsets:
+            lookup_type = self['LookupType']
+            subtable_offset += file_offset
+            if subtable_types.get(lookup_type) is ExtensionSubtable:
+                extension = ExtensionSubtable(file, subtable_offset)
+                lookup_type = extension['ExtensionLookupType']
+                subtable_offset += extension['ExtensionOffset']
+            try:
+                subtable_type = subtable_types[lookup_type]
+            except KeyError:
+                if lookup_type not in unsupported_types:
+                    unsupported_types.add(lookup_type)
+                    warn('Lookup type {} is not supported; the lookup\'s '
+                         'subtables are not applied.'.format(lookup_type),
+                         RinohWarning)
+                continue
+            subtables.append(subtable_type(file, subtable_offset))
+        self['SubTable'] = subtables
 
     def lookup(self, *args, **kwargs):
         for subtable in self['SubTable']:
@@ -149,6 +211,138 @@ class LookupTable(OpenTypeTable):
                 pass
         raise KeyError
 
+    def compile(self, glyph_definition=None):
+        """Return a :class:`CompiledLookup` holding the compiled versions of
+        this lookup's subtables. Subtable types that cannot be applied to
+        glyph runs are left out.
+
+        The glyphs this lookup skips according to its lookup flags are
+        determined from the `glyph_definition` (GDEF) table, if any."""
+        compiled_subtables = []
+        for subtable in self['SubTable']:
+            try:
+                compile = subtable.compile
+            except AttributeError:
+                continue
+            compiled_subtables.append(compile())
+        ignored_glyphs = (glyph_definition.ignored_glyphs(
+                              self['LookupFlag'], self.get('MarkFilteringSet'))
+                          if glyph_definition else frozenset())
+        return CompiledLookup(compiled_subtables, ignored_glyphs)
+
+
+class CompiledLookup(list):
+    """A lookup's compiled subtables, ready to be applied to glyph runs.
+
+    The compiled subtables provide a `first_glyphs` attribute listing the
+    glyph IDs that can trigger them, and either a `substitute` (GSUB) or a
+    `position` (GPOS) method that applies the subtable at a given index in the
+    glyph run. These return the index of the glyph following the substituted
+    glyphs, or `True` respectively when they applied, and `None` otherwise.
+
+    `ignored_glyphs` holds the glyph IDs this lookup skips over, as selected
+    by its lookup flags."""
+
+    def __init__(self, compiled_subtables, ignored_glyphs=frozenset()):
+        super().__init__(compiled_subtables)
+        self.ignored_glyphs = ignored_glyphs
+        self.first_glyphs = set()
+        for compiled_subtable in compiled_subtables:
+            self.first_glyphs.update(compiled_subtable.first_glyphs)
+
+    def applies_to(self, glyph_ids):
+        """Return `True` if this lookup might act on a glyph in `glyph_ids`"""
+        return not self.first_glyphs.isdisjoint(glyph_ids)
+
+    def substitute(self, glyph_ids, lookups):
+        """Apply this substitution lookup to the list of glyph IDs `glyph_ids`
+        in-place. `lookups` maps lookup list indices to compiled lookups,
+        which are needed by contextual substitutions.
+
+        Ignored glyphs are left untouched and split the glyph run in parts
+        that are processed separately; ligatures and contexts do not extend
+        across them."""
+        ignored = self.ignored_glyphs
+        if not ignored or ignored.isdisjoint(glyph_ids):
+            return self._substitute_run(glyph_ids, lookups)
+        substituted = []
+        run = []
+        for glyph_id in glyph_ids:
+            if glyph_id in ignored:
+                self._substitute_run(run, lookups)
+                substituted += run
+                substituted.append(glyph_id)
+                run = []
+            else:
+                run.append(glyph_id)
+        self._substitute_run(run, lookups)
+        substituted += run
+        glyph_ids[:] = substituted
+
+    def _substitute_run(self, glyph_ids, lookups):
+        index = 0
+        while index < len(glyph_ids):
+            next_index = self.substitute_at(glyph_ids, index, lookups)
+            index = index + 1 if next_index is None else next_index
+
+    def substitute_at(self, glyph_ids, index, lookups):
+        """Apply the first subtable matching at `index` in `glyph_ids`. Return
+        the index of the glyph following the substituted glyphs, or `None`
+        when none of the subtables match."""
+        if glyph_ids[index] in self.first_glyphs:
+            for compiled_subtable in self:
+                next_index = compiled_subtable.substitute(glyph_ids, index,
+                                                          lookups)
+                if next_index is not None:
+                    return next_index
+        return None
+
+    def position(self, glyph_ids, advances, placements):
+        """Apply this positioning lookup to `glyph_ids`, adjusting the glyph
+        `advances` and horizontal `placements` (lists of values in font
+        units) in-place. Ignored glyphs are skipped over; a glyph pair can be
+        kerned across an ignored mark, for example."""
+        ignored = self.ignored_glyphs
+        if not ignored or ignored.isdisjoint(glyph_ids):
+            return self._position_run(glyph_ids, advances, placements)
+        indices = [index for index, glyph_id in enumerate(glyph_ids)
+                   if glyph_id not in ignored]
+        run_advances = [advances[index] for index in indices]
+        run_placements = [placements[index] for index in indices]
+        self._position_run([glyph_ids[index] for index in indices],
+                           run_advances, run_placements)
+        for index, advance, placement in zip(indices, run_advances,
+                                             run_placements):
+            advances[index] = advance
+            placements[index] = placement
+
+    def _position_run(self, glyph_ids, advances, placements):
+        first_glyphs = self.first_glyphs
+        for index, glyph_id in enumerate(glyph_ids):
+            if glyph_id in first_glyphs:
+                for compiled_subtable in self:
+                    if compiled_subtable.position(glyph_ids, index, advances,
+                                                  placements):
+                        break
+
+
+class CompiledLookups(dict):
+    r"""Maps lookup list indices to :class:`CompiledLookup`\ s. Lookups are
+    compiled on first access.
+
+    :attr:`glyph_definition` is set to the font's GDEF table, if present."""
+
+    def __init__(self, lookup_tables):
+        super().__init__()
+        self._lookup_tables = lookup_tables
+        self.glyph_definition = None
+
+    def __missing__(self, index):
+        lookup_table = self._lookup_tables[index]
+        self[index] = compiled_lookup \
+            = lookup_table.compile(self.glyph_definition)
+        return compiled_lookup
+
 
 class DelayedList(list):
     def __init__(self, reader, file, file_offset, item_offsets):
@@ -170,8 +364,10 @@ class LookupListTable(OpenTypeTable):
     def __init__(self, file, file_offset, types):
         super().__init__(file, file_offset)
         lookup_offsets = array(offset, self['LookupCount'])(file)
-        lookup_reader = lambda file, file_offset: LookupTable(file, file_offset,
-                                                              types)
+        # lookup types that were reported as unsupported for this font
+        self.unsupported_types = set()
+        lookup_reader = lambda file, file_offset: LookupTable(
+            file, file_offset, types, self.unsupported_types)
         self['Lookup'] = DelayedList(lookup_reader, file, file_offset,
                                      lookup_offsets)
 
@@ -187,6 +383,7 @@ class LayoutTable(OpenTypeTable):
         self['LookupList'] = LookupListTable(file,
                                              file_offset + lookup_list_offset,
                                              self.lookup_types)
+        self.compiled_lookups = CompiledLookups(self['LookupList']['Lookup'])
 
 
 class Device(OpenTypeTable):
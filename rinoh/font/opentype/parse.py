@@ -55,8 +55,8 @@ class Packed(OrderedDict):
 
 
 def array(reader, length):
-    def array_reader(file, **kwargs):
-        return [reader(file, **kwargs) for i in range(length)]
+    def array_reader(file, *args, **kwargs):
+        return [reader(file, *args, **kwargs) for i in range(length)]
     return array_reader
 
 
@@ -79,7 +79,7 @@ def context_array(reader, count_key, *indirect_args, multiplier=1):
 
 
 def indirect(reader, *indirect_args, offset_reader=offset):
-    def indirect_reader(file, base, **kwargs):
+    def indirect_reader(file, base, table=None, **kwargs):
         indirect_offset = offset_reader(file)
         restore_position = file.tell()
         args = [table[key] for key in indirect_args]
@@ -92,9 +92,12 @@ def indirect(reader, *indirect_args, offset_reader=offset):
 def indirect_array(reader, count_key, *indirect_args):
     def indirect_array_reader(file, base, table):
         offsets = array(offset, table[count_key])(file)
+        restore_position = file.tell()
         args = [table[key] for key in indirect_args]
-        return [reader(file, base + entry_offset, *args)
-                for entry_offset in offsets]
+        result = [reader(file, base + entry_offset, *args)
+                  for entry_offset in offsets]
+        file.seek(restore_position)
+        return result
     return indirect_array_reader
 
 
@@ -172,7 +175,7 @@ class TableRecord(OpenTypeTable):
 
 from .required import HmtxTable
 from .cff import CompactFontFormat
-from . import truetype, gpos, gsub, other
+from . import truetype, gdef, gpos, gsub, other
 
 
 class OpenTypeParser(dict):
@@ -205,9 +208,12 @@ class OpenTypeParser(dict):
             self['glyf'] = truetype.GlyfTable(file,
                                               table_records['glyf']['offset'],
                                               self['loca'])
-        for tag in ('kern', 'GPOS', 'GSUB'):
+        for tag in ('kern', 'GDEF', 'GPOS', 'GSUB'):
             if tag in table_records:
                 self[tag] = self._parse_table(file, table_records[tag])
+        for tag in ('GPOS', 'GSUB'):
+            if tag in self:
+                self[tag].compiled_lookups.glyph_definition = self.get('GDEF')
 
     @staticmethod
     def _parse_table(file, table_record):
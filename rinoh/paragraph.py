@@ -39,7 +39,7 @@ from itertools import tee
 
 from . import DATA_PATH
 from .dimension import DimensionBase, PT
-from .flowable import Flowable, FlowableStyle, FlowableState
+from .flowable import Flowable, FlowableStyle, FlowableState, ContentWidths
 from .font.style import SMALL_CAPITAL
 from .hyphenator import Hyphenator
 from .inline import InlineFlowableException
@@ -315,6 +315,40 @@ class ParagraphBase(Flowable):
 
         return max_line_width, descender
 
+    def content_widths(self, container):
+        """Measure the widths of the words making up this paragraph, without
+        typesetting any lines. The minimum width is determined by the widest
+        word, the maximum width by the longest line of text. The widths are
+        static unless the text includes fields (such as page references)."""
+        from .reference import Field
+
+        document = container.document
+        spans = list(self.text(document).spans(document))
+        indent = cursor = float(self.get_style('indent_first', document))
+        min_width = max_width = 0
+        start_of_line = True
+        for word in spans_to_words(spans, container):
+            if word.is_newline:
+                max_width = max(max_width, cursor)
+                indent = cursor = 0
+                start_of_line = True
+                continue
+            elif word.is_space:
+                if str(word) == '\t':      # depends on the available width
+                    return super().content_widths(container)
+                elif start_of_line:
+                    continue
+            width = word.width
+            if not word.is_space:
+                min_width = max(min_width, indent + width)
+                indent = 0
+            cursor += width
+            start_of_line = False
+        max_width = max(max_width, cursor)
+        margins = self.margins_width(document)
+        static = not any(isinstance(span, Field) for span in spans)
+        return ContentWidths(min_width + margins, max_width + margins, static)
+
 
 class Paragraph(ParagraphBase, MixedStyledText):
     def __init__(self, text_or_items, id=None, style=None, parent=None):
@@ -388,47 +422,24 @@ def create_to_glyphs(span, document):
     kerning = span.get_style('kerning', document)
     ligatures = span.get_style('ligatures', document)
     get_glyph = partial(font.get_glyph, variant=variant)
+    shaped_words = {}
     # TODO: handle ligatures at span borders
     def word_to_glyphs(word):
-        glyphs = [get_glyph(char) for char in word]
-        if ligatures:
-            glyphs = form_ligatures(glyphs, font.get_ligature)
-        if kerning:
-            glyphs_kern = kern(glyphs, font.get_kerning)
-        else:
-            glyphs_kern = [(glyph, 0.0) for glyph in glyphs]
-        return [GlyphAndWidth(glyph, scale * (glyph.width + kern_adjust))
-                for glyph, kern_adjust in glyphs_kern]
+        try:
+            glyphs, widths = shaped_words[word]
+        except KeyError:
+            glyphs_kern = font.shape([get_glyph(char) for char in word],
+                                     ligatures, kerning)
+            glyphs = [glyph for glyph, kern_adjust in glyphs_kern]
+            widths = [scale * (glyph.width + kern_adjust)
+                      for glyph, kern_adjust in glyphs_kern]
+            shaped_words[word] = glyphs, widths
+        return [GlyphAndWidth(glyph, width)
+                for glyph, width in zip(glyphs, widths)]
 
     return word_to_glyphs
 
 
-def form_ligatures(glyphs, get_ligature):
-    glyphs = iter(glyphs)
-    result = []
-    prev_glyph = next(glyphs)
-    for glyph in glyphs:
-        ligature_glyph = get_ligature(prev_glyph, glyph)
-        if ligature_glyph:
-            prev_glyph = ligature_glyph
-        else:
-            result.append(prev_glyph)
-            prev_glyph = glyph
-    result.append(prev_glyph)
-    return result
-
-
-def kern(glyphs, get_kerning):
-    glyphs = iter(glyphs)
-    result = []
-    prev_glyph = next(glyphs)
-    for glyph in glyphs:
-        result.append((prev_glyph, get_kerning(prev_glyph, glyph)))
-        prev_glyph = glyph
-    result.append((prev_glyph, 0.0))
-    return result
-
-
 class GlyphsSpan(list):
     def __init__(self, span, word_to_glyphs):
         super().__init__()
@@ -643,11 +654,13 @@ class Line(list):
         extra_space = self.width - self.cursor
         if justification == BOTH:
             # TODO: padding added to spaces should be prop. to font size
-            nr_spaces = sum(glyph_span.number_of_spaces for glyph_span in self)
+            spaces = [(glyph_span, glyph_span.number_of_spaces)
+                      for glyph_span in self]
+            nr_spaces = sum(number for glyph_span, number in spaces)
             if nr_spaces > 0:
                 add_to_spaces = extra_space / nr_spaces
-                for glyph_span in self:
-                    if glyph_span.number_of_spaces > 0:
+                for glyph_span, number in spaces:
+                    if number > 0:
                         glyph_span.space.width += add_to_spaces
         elif justification == CENTER:
             left += extra_space / 2.0
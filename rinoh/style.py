@@ -367,6 +367,16 @@ class StyledMatcher(dict):
                     if specificity:
                         yield Match(name, specificity)
 
+    def tested_attributes(self):
+        """Generator yielding the (attribute, value) pairs tested by the
+        selectors registered with this matcher"""
+        for selector in self.by_name.values():
+            for sub_selector in selector.selectors:
+                if sub_selector is Ellipsis:
+                    continue
+                for attribute, value in sub_selector.attributes.items():
+                    yield attribute, value
+
 
 class StyleSheet(OrderedDict):
     """Dictionary storing a set of related :class:`Style`s by name.
@@ -425,6 +435,20 @@ class StyleSheet(OrderedDict):
             for match in self.base.find_matches(styled):
                 yield match
 
+    def tested_attributes(self):
+        """Generator yielding the (attribute, value) pairs tested by the
+        selectors of this style sheet and its base style sheets (without
+        duplicates)"""
+        seen = set()
+        style_sheet = self
+        while style_sheet is not None:
+            for attribute, value in style_sheet.matcher.tested_attributes():
+                key = attribute, repr(value)
+                if key not in seen:
+                    seen.add(key)
+                    yield attribute, value
+            style_sheet = style_sheet.base
+
     def find_style(self, styled):
         matches = sorted(self.find_matches(styled),
                          key=attrgetter('specificity'), reverse=True)
@@ -6,27 +6,32 @@
 # Public License v3. See the LICENSE file or http://www.gnu.org/licenses/.
 
 
-from collections import Iterable
-from itertools import chain
+import csv
+
+from collections import Iterable, OrderedDict
+from itertools import chain, islice, tee
 from functools import partial
 from math import sqrt
+from random import Random
 
 from .draw import Line, Rectangle, ShapeStyle
 from .flowable import (HorizontallyAlignedFlowable,
                        HorizontallyAlignedFlowableStyle,
                        HorizontallyAlignedFlowableState)
 from .layout import MaybeContainer, VirtualContainer, EndOfContainer
+from .paragraph import Paragraph
 from .reference import Referenceable, NUMBER
 from .structure import StaticGroupedFlowables, GroupedFlowablesStyle
-from .style import Styled
+from .style import Style, Styled
 from .util import ReadAliasAttribute
 
 
-__all__ = ['Table', 'TableWithCaption',
-           'TableSection', 'TableHead', 'TableBody', 'TableRow',
+__all__ = ['Table', 'TableWithCaption', 'StreamingTable',
+           'TableSection', 'TableHead', 'TableBody', 'StreamingTableBody',
+           'CSVTableRows', 'TableRow',
            'TableCell', 'TableCellStyle', 'TableCellBorder',
            'TableCellBackground',
-           'TOP', 'MIDDLE', 'BOTTOM']
+           'TOP', 'MIDDLE', 'BOTTOM', 'AUTO', 'SAMPLE', 'FIXED']
 
 
 TOP = 'top'
@@ -34,6 +39,13 @@ MIDDLE = 'middle'
 BOTTOM = 'bottom'
 
 
+# column sizing
+
+AUTO = 'auto'
+SAMPLE = 'sample'
+FIXED = 'fixed'
+
+
 class TableState(HorizontallyAlignedFlowableState):
     def __init__(self, column_widths, body_row_index=0):
         super().__init__()
@@ -58,8 +70,31 @@ class TableState(HorizontallyAlignedFlowableState):
 
 
 class TableStyle(HorizontallyAlignedFlowableStyle):
+    """The :class:`Style` for :class:`Table` objects. It has the following
+    attributes:
+
+    * `split_minimum_rows`: Minimum number of rows to keep together when
+                            splitting the table across containers.
+    * `repeat_head`: Repeat the head rows in each container (:class:`bool`).
+    * `column_sizing`: How the column widths are determined when no fixed
+                       column widths are given. :const:`AUTO` measures all
+                       cells, :const:`SAMPLE` only those in the head rows,
+                       the first `sample_rows` body rows and
+                       `random_sample_rows` randomly selected body rows.
+                       :const:`FIXED` measures nothing; the table's
+                       `column_widths` (default: equal widths) are scaled to
+                       the table width or the available width. Columns
+                       lacking a width get the average of the given ones.
+    * `sample_rows`: Number of leading body rows measured when sampling.
+    * `random_sample_rows`: Number of randomly selected body rows measured
+                            when sampling.
+    """
+
     attributes = {'split_minimum_rows': 0,
-                  'repeat_head': False}
+                  'repeat_head': False,
+                  'column_sizing': AUTO,
+                  'sample_rows': 100,
+                  'random_sample_rows': 100}
 
 
 NEVER_SPLIT = float('+inf')
@@ -78,6 +113,7 @@ class Table(HorizontallyAlignedFlowable):
         body.parent = self
         self.width = width
         self.column_widths = column_widths
+        self._cell_styles = None
 
     def render(self, container, last_descender, state=None):
         # TODO: allow data to override style (align)
@@ -110,50 +146,69 @@ class Table(HorizontallyAlignedFlowable):
                 raise EndOfContainer(state)
         return sum(state.column_widths), 0
 
-    def _size_columns(self, container):
+    def _size_columns(self, container, rows=None):
         """Calculate the table's column sizes constrained by:
 
         - requested relative widths
         - container width (= available width)
         - cell contents
 
+        The cell contents considered are those of `rows`, which defaults to
+        the table's head and body rows selected by the `column_sizing` style
+        attribute.
+
         """
-        def calculate_column_widths(max_cell_width):
-            """Calculate required column widths given a maximum cell width"""
-            def cell_content_width(cell):
-                buffer = VirtualContainer(container, width=max_cell_width)
-                width, _ = cell.flow(buffer, None)
-                return float(width)
-
-            widths = [0] * self.body.num_columns
-            for row in chain(self.head or [], self.body):
-                for cell in (cell for cell in row if cell.colspan == 1):
+        document = container.document
+        num_columns = self.num_columns
+        if not num_columns:
+            return []
+        column_sizing = self.get_style('column_sizing', document)
+        fixed_width = self._fixed_width(container)
+        if column_sizing == FIXED:
+            rel_column_widths = self._fixed_column_widths()
+            table_width = fixed_width or float(container.width)
+            scale = table_width / sum(rel_column_widths)
+            return [width * scale for width in rel_column_widths]
+        if rows is None:
+            if column_sizing == SAMPLE:
+                rows = chain(self.head or [], self._sample_rows(document))
+            else:
+                rows = chain(self.head or [], self.body)
+        # measure each cell only once; the minimum and maximum content widths
+        # are obtained from a single measuring pass (no rendering)
+        cell_widths = [(cell, cell.content_widths(container))
+                       for row in rows for cell in row]
+
+        def calculate_column_widths(width):
+            """Calculate required column widths given the 'minimum' or
+            'maximum' cell content widths"""
+            widths = [0] * num_columns
+            for cell, content_widths in cell_widths:
+                if cell.colspan == 1:
                     col = int(cell.column_index)
-                    widths[col] = max(widths[col], cell_content_width(cell))
-            for row in chain(self.head or [], self.body):
-                for cell in (cell for cell in row if cell.colspan > 1):
+                    widths[col] = max(widths[col],
+                                      getattr(content_widths, width))
+            for cell, content_widths in cell_widths:
+                if cell.colspan > 1:
                     c = int(cell.column_index)
                     c_end = c + cell.colspan
-                    padding = cell_content_width(cell) - sum(widths[c:c_end])
+                    content_width = getattr(content_widths, width)
+                    padding = content_width - sum(widths[c:c_end])
                     if padding > 0:
                         per_column_padding = padding / cell.colspan
                         for i in range(cell.colspan):
                             widths[c + i] += per_column_padding
             return widths
 
-        try:
-            fixed_width = self.width.to_points(container.width)
-        except AttributeError:
-            fixed_width = self.width if self.width else None
         max_table_width = fixed_width or container.width
-        max_column_widths = calculate_column_widths(float('+inf'))
+        max_column_widths = calculate_column_widths('maximum')
         # determine relative column widths
         if self.column_widths:
             rel_column_widths = self.column_widths
         elif sum(max_column_widths) <= max_table_width:
             rel_column_widths = max_column_widths
         else:
-            min_column_widths = calculate_column_widths(0)
+            min_column_widths = calculate_column_widths('minimum')
             rel_column_widths = [sqrt(minimum * maximum) for minimum, maximum
                                  in zip(min_column_widths, max_column_widths)]
         # determine the total table width
@@ -171,6 +226,47 @@ class Table(HorizontallyAlignedFlowable):
         scale = float(table_width) / sum(rel_column_widths)
         return [width * scale for width in rel_column_widths]
 
+    @property
+    def num_columns(self):
+        """The number of columns in this table. If the body has no rows (a
+        streamed body may turn out to be empty), it is taken from the head or
+        from `column_widths` instead."""
+        for section in (self.body, self.head):
+            if section is not None and section.num_columns is not None:
+                return section.num_columns
+        return len(self.column_widths) if self.column_widths else 0
+
+    def _fixed_column_widths(self):
+        """Return the relative column widths for :const:`FIXED` column sizing.
+        Columns for which no width is given (`None` or beyond the end of the
+        `column_widths` list) get the average of the given widths."""
+        num_columns = self.num_columns
+        widths = list(self.column_widths or [])[:num_columns]
+        widths += [None] * (num_columns - len(widths))
+        given = [width for width in widths if width is not None]
+        default = sum(given) / len(given) if given else 1
+        return [default if width is None else width for width in widths]
+
+    def _fixed_width(self, container):
+        try:
+            return self.width.to_points(container.width)
+        except AttributeError:
+            return self.width if self.width else None
+
+    def _sample_rows(self, document):
+        """Return the leading body rows and a random selection of the other
+        body rows, as determined by the `sample_rows` and `random_sample_rows`
+        style attributes. The random selection is the same for each rendering
+        pass."""
+        sample_rows = self.get_style('sample_rows', document)
+        random_sample_rows = self.get_style('random_sample_rows', document)
+        other_rows = range(sample_rows, len(self.body))
+        random_indices = Random(0).sample(other_rows,
+                                          min(random_sample_rows,
+                                              len(other_rows)))
+        return chain(self.body[:sample_rows],
+                     (self.body[index] for index in sorted(random_indices)))
+
     @classmethod
     def _render_section(cls, container, rows, column_widths):
         rendered_rows = []
@@ -213,31 +309,28 @@ class Table(HorizontallyAlignedFlowable):
                             rendered_rows[i].height += padding
         return rendered_rows
 
-    @staticmethod
-    def _place_rows_and_render_borders(container, rendered_rows):
+    def _place_rows_and_render_borders(self, container, rendered_rows):
         """Place the rendered cells onto the page canvas and draw borders around
         them."""
-        def draw_cell_border(rendered_cell, cell_height, container):
-            cell_width = rendered_cell.width
-            background = TableCellBackground((0, 0), cell_width, cell_height,
-                                             parent=rendered_cell.cell)
-            background.render(container)
-            for position in ('top', 'right', 'bottom', 'left'):
-                border = TableCellBorder(rendered_cell, cell_height, position)
-                border.render(container)
-
         document = container.document
+        if (self._cell_styles is None
+                or self._cell_styles.document is not document):
+            self._cell_styles = CellStyles(document)
         y_cursor = container.cursor
         for r, rendered_row in enumerate(rendered_rows):
             container.advance(rendered_row.height)
-            for c, rendered_cell in enumerate(rendered_row):
+            grid = CellGrid()
+            for rendered_cell in rendered_row:
+                cell_height = sum(rendered_row.height for rendered_row in
+                                  rendered_rows[r:r + rendered_cell.rowspan])
+                styles = self._cell_styles.styles_for(rendered_cell,
+                                                       cell_height)
+                grid.add_cell(rendered_cell, cell_height, styles)
+            grid.render(container, y_cursor)
+            for rendered_cell in rendered_row:
                 cell_height = sum(rendered_row.height for rendered_row in
                                   rendered_rows[r:r + rendered_cell.rowspan])
                 x_cursor = rendered_cell.x_position
-                y_pos = float(y_cursor + cell_height)
-                cell_container = VirtualContainer(container)
-                draw_cell_border(rendered_cell, cell_height, cell_container)
-                cell_container.place_at(container, x_cursor, y_pos)
                 vertical_align = rendered_cell.cell.get_style('vertical_align',
                                                               document)
                 if vertical_align == TOP:
@@ -251,6 +344,85 @@ class Table(HorizontallyAlignedFlowable):
             y_cursor += rendered_row.height
 
 
+class StreamingTableState(TableState):
+    def __init__(self, column_widths, rows, rendered_rows=None,
+                 body_row_index=0):
+        super().__init__(column_widths, body_row_index)
+        self.rows = rows
+        self.rendered_rows = rendered_rows or []
+
+    def __copy__(self):
+        copy_rows, self.rows = tee(self.rows)
+        return self.__class__(self.column_widths, copy_rows,
+                              list(self.rendered_rows), self.body_row_index)
+
+
+class StreamingTable(Table):
+    """A table whose body rows are read from a :class:`StreamingTableBody`
+    while rendering. Only the rows being placed on the current page are kept
+    in memory. Each row is rendered only once; rendered rows that do not fit
+    in the container are carried over to the next one.
+
+    Since the body rows are not known in advance, the column widths are
+    determined from the head rows and the first `sample_rows` body rows (see
+    :class:`TableStyle`), unless `column_sizing` is set to :const:`FIXED`."""
+
+    def _initial_state(self, container):
+        document = container.document
+        rows = self.body.rows()
+        if self.get_style('column_sizing', document) == FIXED:
+            # read the first row to determine the number of columns
+            leading_rows = list(islice(rows, 1))
+            column_widths = self._size_columns(container)
+        else:
+            sample_rows = self.get_style('sample_rows', document)
+            leading_rows = list(islice(rows, sample_rows))
+            column_widths = self._size_columns(container,
+                                               chain(self.head or [],
+                                                     leading_rows))
+        return StreamingTableState(column_widths, chain(leading_rows, rows))
+
+    def render(self, container, last_descender, state=None):
+        get_style = partial(self.get_style, document=container.document)
+        state = state or self._initial_state(container)
+        initial = state.initial
+        column_widths = state.column_widths
+        with MaybeContainer(container) as maybe_container:
+            def place_rows(rendered_rows):
+                sum_row_heights = sum(row.height for row in rendered_rows)
+                if sum_row_heights > maybe_container.remaining_height:
+                    return False
+                self._place_rows_and_render_borders(maybe_container,
+                                                    rendered_rows)
+                return True
+
+            # head rows
+            if self.head and (initial or get_style('repeat_head')):
+                for rendered_rows in self._render_section(container, self.head,
+                                                          column_widths):
+                    if not place_rows(rendered_rows):
+                        raise EndOfContainer(state)
+            # body rows (rows carried over from the previous container first)
+            carried_rows, state.rendered_rows = state.rendered_rows, []
+            placed_rows = []
+            body_rows = chain(carried_rows,
+                              self._render_section(container, state.rows,
+                                                   column_widths))
+            for rendered_rows in body_rows:
+                if not place_rows(rendered_rows):
+                    split_minimum_rows = get_style('split_minimum_rows')
+                    if initial and state.body_row_index < split_minimum_rows:
+                        # this container's content will be discarded
+                        state.rendered_rows = placed_rows
+                        state.body_row_index = 0
+                    state.rendered_rows.append(rendered_rows)
+                    raise EndOfContainer(state)
+                if initial:
+                    placed_rows.append(rendered_rows)
+                state.body_row_index += len(rendered_rows)
+        return sum(column_widths), 0
+
+
 class TableWithCaption(Referenceable, StaticGroupedFlowables):
     category = 'Table'
 
@@ -273,9 +445,25 @@ class TableSection(Styled, list):
         for row in self:
             row.prepare(document)
 
+    def index_of(self, row):
+        try:
+            index = self._row_indices[id(row)]
+            if self[index] is row:
+                return index
+        except (AttributeError, KeyError, IndexError):
+            pass
+        self._row_indices = {id(item): i for i, item in enumerate(self)}
+        return self._row_indices[id(row)]
+
+    @property
+    def num_rows(self):
+        return len(self)
+
     @property
     def num_columns(self):
-        return sum(cell.colspan for cell in self[0])
+        """The number of columns spanned by the first row, or `None` if this
+        section has no rows"""
+        return sum(cell.colspan for cell in self[0]) if self else None
 
 
 class TableHead(TableSection):
@@ -286,6 +474,76 @@ class TableBody(TableSection):
     pass
 
 
+class StreamingTableBody(TableBody):
+    r"""A table body that does not hold its rows, but reads them from `rows`
+    while the table is being rendered. `rows` is an iterable of
+    :class:`TableRow`\s that is iterated over once for each rendering pass
+    (it should not be a one-shot iterator). Cells spanning multiple rows are
+    not supported."""
+
+    def __init__(self, rows, style=None, parent=None):
+        super().__init__([], style=style, parent=parent)
+        self._rows = rows
+        self._num_rows = 0
+        self._num_columns = None
+
+    def rows(self):
+        """Generator yielding the rows read from the source. One row is read
+        ahead, so that the last row can be identified (`row_index=-1`)."""
+        self._num_rows = 0
+        rows = iter(self._rows)
+        try:
+            row = self._adopt(next(rows))
+        except StopIteration:
+            return
+        for next_row in rows:
+            self._adopt(next_row)
+            yield row
+            row = next_row
+        yield row
+
+    def _adopt(self, row):
+        if row.maximum_rowspan > 1:
+            raise NotImplementedError('StreamingTableBody does not support '
+                                      'cells spanning multiple rows')
+        row.parent = self
+        row._section_index = self._num_rows
+        self._num_rows += 1
+        if self._num_columns is None:
+            self._num_columns = sum(cell.colspan for cell in row)
+        return row
+
+    def prepare(self, document):
+        pass
+
+    def index_of(self, row):
+        return row._section_index
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    @property
+    def num_columns(self):
+        return self._num_columns
+
+
+class CSVTableRows(object):
+    """Iterable yielding a :class:`TableRow` for each of the records in the
+    CSV file `filename`. Each field is converted to a :class:`Paragraph`.
+    Additional keyword arguments are passed to :func:`csv.reader`."""
+
+    def __init__(self, filename, **fmtparams):
+        self.filename = filename
+        self.fmtparams = fmtparams
+
+    def __iter__(self):
+        with open(self.filename, newline='') as csv_file:
+            for record in csv.reader(csv_file, **self.fmtparams):
+                yield TableRow([TableCell([Paragraph(field)])
+                                for field in record])
+
+
 class TableRow(Styled, list):
     section = ReadAliasAttribute('parent')
 
@@ -305,7 +563,7 @@ class TableRow(Styled, list):
 
     @property
     def _index(self):
-        return next(i for i, item in enumerate(self.section) if item is self)
+        return self.section.index_of(self)
 
     def get_rowspanned_columns(self):
         """Return a dictionary mapping column indices to the number of columns
@@ -340,6 +598,19 @@ class TableCell(StaticGroupedFlowables):
         super().__init__(flowables, id=id, style=style, parent=parent)
         self.rowspan = rowspan
         self.colspan = colspan
+        self._content_widths = None
+
+    def content_widths(self, container):
+        """Measure the cell's content, or return the widths measured before
+        for the same document. Only widths that do not depend on the rendering
+        pass are kept, so cells without fields are measured only once."""
+        document = container.document
+        if self._content_widths and self._content_widths[0] is document:
+            return self._content_widths[1]
+        widths = super().content_widths(container)
+        if widths.static:
+            self._content_widths = document, widths
+        return widths
 
     @property
     def row_index(self):
@@ -365,6 +636,7 @@ class Index(object):
     def __eq__(self, other):
         if isinstance(other, slice):
             indices = range(*other.indices(self.num_items))
+            return any(index in indices for index in self)
         elif isinstance(other, Iterable):
             indices = other
         else:
@@ -381,7 +653,7 @@ class Index(object):
 
 class RowIndex(Index):
     def __int__(self):
-        return next(i for i, row in enumerate(self.section) if row is self.row)
+        return self.row._index
 
     def __iter__(self):
         index = int(self)
@@ -389,7 +661,7 @@ class RowIndex(Index):
 
     @property
     def num_items(self):
-        return len(self.section)
+        return self.section.num_rows
 
 
 class ColumnIndex(Index):
@@ -475,3 +747,128 @@ class TableCellBackgroundStyle(ShapeStyle):
 
 class TableCellBackground(Rectangle):
     style_class = TableCellBackgroundStyle
+
+
+BORDER_POSITIONS = ('top', 'right', 'bottom', 'left')
+
+
+class CellStyles(dict):
+    """Resolves the styles of the background and borders of rendered table
+    cells. Cells that cannot be told apart by the selectors in the document's
+    style sheet share the same styles; these are looked up only once.
+
+    Items are tuples of the background's stroke width, stroke color and fill
+    color, followed by the stroke width and color of the top, right, bottom
+    and left borders. Widths and colors are `None` when not drawn."""
+
+    def __init__(self, document):
+        super().__init__()
+        self.document = document
+        self.attribute_tests = list(document.stylesheet.tested_attributes())
+
+    def signature(self, cell):
+        """Return a key identifying the selectors in the style sheet that
+        match the cell's background and borders. Only the cell and its row
+        and section are considered; other ancestors are shared by all cells
+        in the table."""
+        def element_signature(element):
+            style = element.style
+            if isinstance(style, Style):
+                style = id(style)
+            return ((type(element), style)
+                    + tuple(hasattr(element, attribute)
+                            and getattr(element, attribute) == value
+                            for attribute, value in self.attribute_tests))
+
+        row = cell.parent
+        return (element_signature(cell), element_signature(row),
+                element_signature(row.parent))
+
+    def styles_for(self, rendered_cell, cell_height):
+        key = self.signature(rendered_cell.cell)
+        try:
+            return self[key]
+        except KeyError:
+            styles = self[key] = self._resolve(rendered_cell, cell_height)
+            return styles
+
+    def _resolve(self, rendered_cell, cell_height):
+        document = self.document
+
+        def stroke(shape):
+            stroke_width = shape.get_style('stroke_width', document)
+            stroke_color = shape.get_style('stroke_color', document)
+            if stroke_width and stroke_color:
+                return stroke_width, stroke_color
+            return None, None
+
+        background = TableCellBackground((0, 0), rendered_cell.width,
+                                         cell_height,
+                                         parent=rendered_cell.cell)
+        styles = stroke(background) + (background.get_style('fill_color',
+                                                            document), )
+        for position in BORDER_POSITIONS:
+            border = TableCellBorder(rendered_cell, cell_height, position)
+            styles += stroke(border)
+        return styles
+
+
+class CellGrid(object):
+    """Collects the backgrounds and borders of the cells in a table row,
+    grouped by style, so that each group can be drawn as a single path."""
+
+    def __init__(self):
+        self.backgrounds = OrderedDict()
+        self.borders = OrderedDict()
+
+    def add_cell(self, rendered_cell, cell_height, styles):
+        """Add the background and borders of `rendered_cell`. Coordinates
+        are relative to the top of the row (y pointing upwards)."""
+        left = rendered_cell.x_position
+        right = left + rendered_cell.width
+        top, bottom = 0, - cell_height
+        stroke_width, stroke_color, fill_color = styles[:3]
+        if stroke_width or fill_color:
+            key = (stroke_width and float(stroke_width),
+                   stroke_color and stroke_color.rgba,
+                   fill_color and fill_color.rgba)
+            _, rectangles = self.backgrounds.setdefault(
+                key, (styles[:3], []))
+            rectangles.append(((left, bottom), (right, bottom),
+                               (right, top), (left, top)))
+        corners = dict(top=((left, top), (right, top)),
+                       right=((right, top), (right, bottom)),
+                       bottom=((left, bottom), (right, bottom)),
+                       left=((left, bottom), (left, top)))
+        for i, position in enumerate(BORDER_POSITIONS):
+            stroke_width, stroke_color = styles[3 + 2 * i:5 + 2 * i]
+            if stroke_width:
+                key = float(stroke_width), stroke_color.rgba
+                _, lines = self.borders.setdefault(
+                    key, ((stroke_width, stroke_color), []))
+                lines.append(corners[position])
+
+    def render(self, container, top):
+        """Draw the collected backgrounds and borders onto `container`,
+        relative to its vertical position `top`."""
+        grid_container = VirtualContainer(container)
+        canvas = grid_container.canvas
+        for styles, rectangles in self.backgrounds.values():
+            stroke_width, stroke_color, fill_color = styles
+            with canvas.save_state():
+                for points in rectangles:
+                    canvas.line_path(points)
+                    canvas.close_path()
+                if stroke_width and fill_color:
+                    canvas.stroke_and_fill(stroke_width, stroke_color,
+                                           fill_color)
+                elif stroke_width:
+                    canvas.stroke(stroke_width, stroke_color)
+                else:
+                    canvas.fill(fill_color)
+        for (stroke_width, stroke_color), lines in self.borders.values():
+            with canvas.save_state():
+                for points in lines:
+                    canvas.line_path(points)
+                canvas.stroke(stroke_width, stroke_color)
+        grid_container.place_at(container, 0, top)
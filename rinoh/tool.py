@@ -3,6 +3,8 @@ import argparse
 import os
 
 from rinoh import paper
+from rinoh.document import (SCREEN, PRINT, DRAFT_COMPRESSION,
+                            DEFAULT_COMPRESSION, RELEASE_COMPRESSION)
 
 from rinoh.backend import pdf
 from rinoh.frontend.rst import ReStructuredTextParser
@@ -10,6 +12,13 @@ from rinoh.frontend.rst import ReStructuredTextParser
 from rinohlib.templates.article import Article, ArticleOptions
 
 
+OUTPUT_PROFILES = {str(profile): profile for profile in (SCREEN, PRINT)}
+COMPRESSION_PROFILES = {str(profile): profile
+                        for profile in (DRAFT_COMPRESSION,
+                                        DEFAULT_COMPRESSION,
+                                        RELEASE_COMPRESSION)}
+
+
 def main():
     parser = argparse.ArgumentParser(description='Render a reStructuredText '
                                                  'document to PDF.')
@@ -17,6 +26,16 @@ def main():
                        help='the reStructuredText document to render')
     parser.add_argument('--paper', type=str, nargs='?', default='A4',
                        help='the paper size to render to (default: A4)')
+    parser.add_argument('--profile', type=str, choices=OUTPUT_PROFILES,
+                        help='downsample images to suit on-screen reading '
+                             '(150 DPI) or printing (300 DPI)')
+    parser.add_argument('--compression', type=str,
+                        choices=COMPRESSION_PROFILES,
+                        help='compress the PDF output for speed (draft) or '
+                             'size (release) (default: default)')
+    parser.add_argument('--compression-threads', type=int,
+                        help='the number of threads compressing the PDF '
+                             'output concurrently')
     args = parser.parse_args()
 
     try:
@@ -40,5 +59,11 @@ def main():
     with open(input_filename) as input_file:
         document_tree = parser.parse(input_file)
     options = ArticleOptions(page_size=page_size)
+    if args.profile:
+        options.output_profile = OUTPUT_PROFILES[args.profile]
+    if args.compression:
+        options.compression = COMPRESSION_PROFILES[args.compression]
+    if args.compression_threads:
+        options.compression_threads = args.compression_threads
     document = Article(document_tree, options, backend=pdf)
     document.render(input_root)
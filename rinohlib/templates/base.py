@@ -1,7 +1,7 @@
 
 from rinoh.dimension import DimensionBase, PT, CM
 from rinoh.document import (Document, DocumentPart, Page, PageOrientation,
-                            PORTRAIT)
+                            PORTRAIT, OutputProfile, CompressionProfile)
 from rinoh.layout import (Container, ChainedContainer, FootnoteContainer, Chain,
                           UpExpandingContainer, DownExpandingContainer)
 from rinoh.paper import Paper, A4
@@ -191,6 +191,12 @@ class DocumentOptions(dict, metaclass=WithNamedDescriptors):
     footer_text = Option(MixedStyledText, Tab() + Variable(PAGE_NUMBER)
                                           + '/' + Variable(NUMBER_OF_PAGES),
                          'The text to place in the page footer')
+    output_profile = Option(OutputProfile, None, 'Limits the resolution of '
+                            'images to suit the intended use of the output')
+    compression = Option(CompressionProfile, None, 'The compression levels '
+                         'to use for the output')
+    compression_threads = Option(int, None, 'The number of threads '
+                                 'compressing the PDF output concurrently')
 
     def __init__(self, **options):
         for name, value in options.items():
@@ -209,5 +215,8 @@ class DocumentTemplate(Document):
 
     def __init__(self, content_flowables, options=None, backend=None):
         self.options = options or self.options_class()
+        self.output_profile = self.options['output_profile']
+        self.compression = self.options['compression']
+        self.compression_threads = self.options['compression_threads']
         super().__init__(content_flowables, self.options['stylesheet'],
                          backend=backend)
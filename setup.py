@@ -73,7 +73,8 @@ setup(
                         ]},
     scripts=['bin/rinoh'],
     install_requires=['docutils', 'purepng>=0.1.1'],
-    extras_require = {'bitmap':  ['Pillow']},
+    extras_require = {'bitmap':  ['Pillow'],
+                      'speedups': ['numpy']},
     provides=[PACKAGE, LIB],
     #test_suite='nose.collector',
 
@@ -0,0 +1,43 @@
+"""Measures the cost of wrapping the spans of hyperlinked text.
+
+Run from the repository root: python -m tests.annotation_benchmark"""
+
+import gc
+import time
+
+from rinoh.annotation import HyperLink, AnnotatedText
+from rinoh.text import SingleStyledText, MixedStyledText
+
+
+def link_heavy_text(number_of_links):
+    """A paragraph's worth of text where every other item is a hyperlink"""
+    items = []
+    for index in range(number_of_links):
+        link = AnnotatedText([SingleStyledText('link {}'.format(index))],
+                             HyperLink('http://example.com/{}'.format(index)))
+        items += [SingleStyledText('plain text '), link]
+    return MixedStyledText(items)
+
+
+def spans_per_second(text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for span in text.spans(None):
+            span.text
+            getattr(span, 'annotation', None)
+    elapsed = time.perf_counter() - start
+    return repeat * len(text) / elapsed
+
+
+def main():
+    text = link_heavy_text(5000)
+    gc.collect()
+    rate = spans_per_second(text, 10)
+    spans = list(text.spans(None))
+    classes = len(set(type(span) for span in spans))
+    print('{:.0f} spans/s, {} span classes for {} spans'
+          .format(rate, classes, len(spans)))
+
+
+if __name__ == '__main__':
+    main()
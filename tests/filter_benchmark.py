@@ -0,0 +1,87 @@
+"""Measures the decoding throughput of the PDF stream filters.
+
+Run from the repository root: python -m tests.filter_benchmark"""
+
+import time
+
+from io import BytesIO
+from random import Random
+
+from rinoh.backend.pdf.filter import (FlateDecode, FlateDecodeParams,
+                                      RunLengthDecode, ASCII85Decode)
+
+
+def sample_data(size):
+    """Compressible data: random words drawn from a small vocabulary"""
+    random = Random(42)
+    words = [bytes(random.randrange(97, 123) for _ in range(length))
+             for length in range(2, 10)]
+    out = bytearray()
+    while len(out) < size:
+        out += random.choice(words) + b' '
+    return bytes(out[:size])
+
+
+def encode(stream_filter, data, **kwargs):
+    encoded = BytesIO()
+    encoder = stream_filter.encoder(encoded, **kwargs)
+    encoder.write(data)
+    encoder.flush()
+    return encoded.getvalue()
+
+
+def up_predicted(data, bytes_per_row):
+    """Apply the PNG UP predictor to all rows of `data`"""
+    out = bytearray()
+    previous = bytes(bytes_per_row)
+    for start in range(0, len(data), bytes_per_row):
+        row = data[start:start + bytes_per_row]
+        out.append(2)
+        out += bytes((x - b) & 0xFF for x, b in zip(row, previous))
+        previous = row
+    return bytes(out)
+
+
+def decode_throughput(stream_filter, encoded, size, read_size):
+    """Decoding throughput in MB/s, reading `read_size` bytes at a time"""
+    start = time.perf_counter()
+    decoder = stream_filter.decoder(BytesIO(encoded))
+    total = 0
+    while True:
+        chunk = decoder.read(read_size)
+        total += len(chunk)
+        if not chunk or read_size < 0:
+            break
+    elapsed = time.perf_counter() - start
+    assert total == size
+    return size / elapsed / 1e6
+
+
+def main():
+    size = 4 * 3 * 1024 * 100     # a whole number of rows for PNG UP
+    data = sample_data(size)
+    flate = FlateDecode()
+    params = FlateDecodeParams(predictor=12, colors=3, columns=1024)
+    predicted = FlateDecode(params)
+    small = data[:size // 16]
+    cases = [('FlateDecode', flate, encode(flate, data), size),
+             ('FlateDecode (PNG UP)', predicted,
+              encode(flate, up_predicted(data, params.bytes_per_column)),
+              size),
+             ('RunLengthDecode', RunLengthDecode(),
+              encode(RunLengthDecode(), small), len(small)),
+             ('ASCII85Decode', ASCII85Decode(),
+              encode(ASCII85Decode(), small), len(small))]
+    read_sizes = (-1, 65536, 4096, 100)
+    print('{:24}'.format('MB/s') + ''.join('{:>10}'.format('read({})'.format(n))
+                                           for n in read_sizes))
+    for name, stream_filter, encoded, decoded_size in cases:
+        print('{:24}'.format(name)
+              + ''.join('{:10.1f}'.format(decode_throughput(stream_filter,
+                                                            encoded,
+                                                            decoded_size, n))
+                        for n in read_sizes))
+
+
+if __name__ == '__main__':
+    main()
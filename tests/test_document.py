@@ -0,0 +1,76 @@
+import unittest
+
+from io import BytesIO
+from types import SimpleNamespace
+
+from rinoh.backend import pdf, BasicImageStore
+from rinoh.document import Document, CompressionProfile, RELEASE_COMPRESSION
+from rinoh.paragraph import Paragraph
+from rinoh.structure import Section, Heading
+
+from rinohlib.templates.article import Article, ArticleOptions
+from rinohlib.templates.book import (Book, BookOptions, FrontMatter,
+                                     BodyMatter, TitlePart)
+from rinohlib.templates.base import TableOfContentsPart
+
+
+class TestDocument(unittest.TestCase):
+
+    def test_page_numbers(self):
+        flowables = [Section([Heading('Section {}'.format(i))]
+                             + [Paragraph('paragraph {}'.format(j))
+                                for j in range(30)])
+                     for i in range(3)]
+        document = Book(flowables, options=BookOptions(), backend=pdf)
+        document.render(file=BytesIO())
+        front_matter, body_matter = document._sections
+        self.assertIsInstance(front_matter, FrontMatter)
+        self.assertIsInstance(body_matter, BodyMatter)
+        title_part, toc_part = front_matter._parts
+        self.assertIsInstance(title_part, TitlePart)
+        self.assertIsInstance(toc_part, TableOfContentsPart)
+        # both front matter parts end on a left page; the single-page parts
+        # are followed by a blank page
+        self.assertEqual([page.number for page in title_part.pages], [1, 2])
+        self.assertEqual([page.number for page in toc_part.pages], [3, 4])
+        # page numbers restart in each section and follow the page order
+        for section in (front_matter, body_matter):
+            pages = list(section.pages)
+            self.assertEqual([section.page_number(page) for page in pages],
+                             list(range(1, len(pages) + 1)))
+        self.assertGreater(body_matter.number_of_pages, 2)
+        # rendering again numbers the pages from scratch
+        document.render(file=BytesIO())
+        self.assertEqual([page.number for page in front_matter.pages],
+                         [1, 2, 3, 4])
+
+    def test_compression(self):
+        def render(compression=None):
+            options = dict(compression=compression) if compression else {}
+            document = Article([Paragraph('compressed ' * 200)],
+                               options=ArticleOptions(**options),
+                               backend=pdf)
+            output = BytesIO()
+            document.render(file=output)
+            return output.getvalue()
+
+        default = render()
+        uncompressed = render(CompressionProfile('none', 0, 0, 0))
+        self.assertIn(b'/FlateDecode', default)
+        self.assertNotIn(b'/FlateDecode', uncompressed)
+        self.assertGreater(len(uncompressed), len(default))
+        self.assertLessEqual(len(render(RELEASE_COMPRESSION)), len(default))
+
+    def test_backend_without_image_store(self):
+        class MinimalDocument(Document):
+            sections = []
+
+        backend = SimpleNamespace(Document=lambda document, creator: None,
+                                  Image=lambda filename: ('image', filename))
+        document = MinimalDocument([], None, backend=backend)
+        images = document.images
+        self.assertIsInstance(images, BasicImageStore)
+        images.prefetch('photo.png')
+        self.assertEqual(images.get_image('photo.png', 0.5, 150),
+                         ('image', 'photo.png'))
+        images.close()
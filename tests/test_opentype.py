@@ -0,0 +1,169 @@
+
+import os
+import unittest
+import warnings
+
+from rinoh.font.opentype import OpenTypeFont
+from rinoh.font.opentype.gdef import LIGATURE_GLYPH
+from rinoh.font.opentype.gpos import MarkAttachment, GlyphPairs
+from rinoh.font.opentype.gsub import (SingleSubstitution, LigatureTrie,
+                                      ChainRule, ChainingContextSubstitution)
+from rinoh.font.opentype.layout import CompiledLookup, LookupTable
+from rinoh.font.style import SMALL_CAPITAL
+
+
+TEST_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_font(filename):
+    return OpenTypeFont(os.path.join(TEST_PATH, filename))
+
+
+class TestOpenType(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.termes = _load_font('texgyretermes-regular.otf')
+        cls.cuprum = _load_font('Cuprum.otf')
+        cls.puritan = _load_font('Puritan2.otf')
+
+    def test_coverage_index(self):
+        lookup = self.termes['GPOS']['LookupList']['Lookup'][1]
+        coverage = lookup['SubTable'][0]['Coverage']
+        for glyph_id in coverage['GlyphArray']:
+            self.assertIn(glyph_id, coverage)
+            self.assertEqual(coverage['GlyphArray'][coverage.index(glyph_id)],
+                             glyph_id)
+        self.assertRaises(ValueError, coverage.index, 0xFFFF)
+
+    def test_class_definition(self):
+        lookup = self.cuprum['GPOS']['LookupList']['Lookup'][0]
+        subtable = lookup['SubTable'][2]
+        class_def = subtable['ClassDef1']
+        for record in class_def['ClassRangeRecord']:
+            for glyph_id in (record['Start'], record['End']):
+                self.assertEqual(class_def.class_number(glyph_id),
+                                 record['Class'])
+        self.assertEqual(class_def.class_number(0xFFFF), 0)
+
+    def test_kerning(self):
+        glyph = self.termes.get_glyph
+        self.assertEqual(self.termes.get_kerning(glyph('V'), glyph('A')), -125)
+        self.assertEqual(self.termes.get_kerning(glyph('A'), glyph('V')), -130)
+        self.assertEqual(self.termes.get_kerning(glyph('T'), glyph('o')), -90)
+        self.assertEqual(self.termes.get_kerning(glyph('x'), glyph('x')), 0.0)
+        glyph = self.cuprum.get_glyph
+        self.assertEqual(self.cuprum.get_kerning(glyph('U'), glyph('A')), -30)
+
+    def test_ligatures(self):
+        glyph = self.termes.get_glyph
+        self.assertEqual(self.termes.get_ligature(glyph('f'), glyph('f')).code,
+                         123)
+        self.assertEqual(self.termes.get_ligature(glyph('f'), glyph('i')).code,
+                         126)
+        self.assertIsNone(self.termes.get_ligature(glyph('a'), glyph('b')))
+
+    def test_small_capitals(self):
+        self.assertEqual(self.termes.get_glyph('s').code, 99)
+        self.assertEqual(self.termes.get_glyph('s', SMALL_CAPITAL).code, 1029)
+
+    def test_compiled_kerning(self):
+        font = self.cuprum
+        lookup_tables = font._get_lookup_tables('GPOS', 'kern', 'latn')
+        pair_adjustments = font._get_pair_adjustments('latn', None, ('kern', ))
+        for a_id in range(0, 366, 3):
+            for b_id in range(0, 366, 5):
+                for lookup_table in lookup_tables:
+                    try:
+                        reference = lookup_table.lookup(a_id, b_id)
+                        break
+                    except KeyError:
+                        pass
+                else:
+                    try:
+                        reference = font['kern'][0].pairs[a_id][b_id]
+                    except KeyError:
+                        reference = 0.0
+                self.assertEqual(pair_adjustments.get_adjustment(a_id, b_id),
+                                 reference)
+
+    def test_shape(self):
+        font = self.termes
+        glyphs = [font.get_glyph(char) for char in 'officeVA']
+        shaped = font.shape(glyphs)
+        self.assertEqual([glyph.code for glyph, adjust in shaped],
+                         [82, 124, 44, 51, 112, 28])
+        self.assertEqual([adjust for glyph, adjust in shaped],
+                         [0, 0, 0, -85, -125, 0])
+        unshaped = font.shape(glyphs, ligatures=False, kerning=False)
+        self.assertEqual([glyph for glyph, adjust in unshaped], glyphs)
+        self.assertEqual(font.shape([]), [])
+
+    def test_chaining_context_substitution(self):
+        single = CompiledLookup([SingleSubstitution({2: 20})])
+        ligature = LigatureTrie()
+        ligature.add([2, 3], 23)
+        lookups = {0: single, 1: CompiledLookup([ligature])}
+        # substitute 2 by 20 when preceded by 1 and followed by 3, 4
+        rule = ChainRule((frozenset([1]), ), (), (frozenset([3]),
+                                                  frozenset([4])),
+                         [dict(SequenceIndex=0, LookupListIndex=0)])
+        chaining = CompiledLookup([ChainingContextSubstitution([2],
+                                                               {2: [rule]})])
+        glyph_ids = [1, 2, 3, 4, 2, 3, 2, 3, 4]
+        chaining.substitute(glyph_ids, lookups)
+        self.assertEqual(glyph_ids, [1, 20, 3, 4, 2, 3, 2, 3, 4])
+        lookups[1].substitute(glyph_ids, lookups)
+        self.assertEqual(glyph_ids, [1, 20, 3, 4, 23, 23, 4])
+
+    def test_mark_attachment(self):
+        lookup = CompiledLookup([MarkAttachment({9: (0, 50)}, {1: [300]})])
+        glyph_ids = [1, 9, 2]
+        advances = [500, 0, 400]
+        placements = [0, 0, 0]
+        lookup.position(glyph_ids, advances, placements)
+        self.assertEqual(placements, [0, 300 - 50 - 500, 0])
+
+    def test_glyph_definition(self):
+        gdef = self.puritan['GDEF']
+        glyph_classes = gdef['GlyphClassDef'].class_by_glyph_id()
+        ligatures = set(glyph_id for glyph_id, glyph_class
+                        in glyph_classes.items()
+                        if glyph_class == LIGATURE_GLYPH)
+        self.assertTrue(ligatures)
+        lookup_table = self.puritan['GSUB']['LookupList']['Lookup'][0]
+        flag = lookup_table['LookupFlag']
+        self.assertEqual(gdef.ignored_glyphs(flag), frozenset())
+        flag = dict(flag, IgnoreLigatures=True)
+        self.assertEqual(gdef.ignored_glyphs(flag), ligatures)
+
+    def test_ignored_glyphs(self):
+        ligature = LigatureTrie()
+        ligature.add([2, 3], 23)
+        lookup = CompiledLookup([ligature], ignored_glyphs=frozenset([9]))
+        glyph_ids = [2, 9, 3, 2, 3, 9]
+        lookup.substitute(glyph_ids, {})
+        self.assertEqual(glyph_ids, [2, 9, 3, 23, 9])
+        kerning = CompiledLookup([GlyphPairs({1: {2: -50}, 9: {2: -10}})],
+                                 ignored_glyphs=frozenset([9]))
+        glyph_ids = [1, 9, 2, 9]
+        advances = [500, 0, 400, 0]
+        placements = [0, 0, 0, 0]
+        kerning.position(glyph_ids, advances, placements)
+        self.assertEqual(advances, [450, 0, 400, 0])
+
+    def test_unsupported_lookup_type_warned_once(self):
+        lookups = self.cuprum['GPOS']['LookupList']['Lookup']
+        lookup = lookups[0]
+        self.assertEqual(lookup['LookupType'], 2)
+        self.assertGreater(len(lookup['SubTable']), 1)
+        reported = set()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            for _ in range(2):
+                unsupported = LookupTable(lookups._file, lookups._offsets[0],
+                                          {}, reported)
+                self.assertEqual(unsupported['SubTable'], [])
+        self.assertEqual(len(caught), 1)
+        self.assertIn('Lookup type 2', str(caught[0].message))
+        self.assertEqual(reported, {2})
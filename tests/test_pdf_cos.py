@@ -0,0 +1,125 @@
+import unittest
+
+from io import BytesIO
+
+from rinoh.backend.pdf import cos
+from rinoh.backend.pdf.filter import FlateDecode
+
+
+def icc_stream(data, deferred=False):
+    stream = cos.Stream(filter=FlateDecode(), deferred=deferred)
+    stream['N'] = cos.Integer(3)
+    stream.write(data)
+    return stream
+
+
+class TestDocument(unittest.TestCase):
+
+    def test_deduplicate_streams(self):
+        document = cos.Document('test')
+        streams = [icc_stream(b'profile'), icc_stream(b'profile'),
+                   icc_stream(b'profile', True), icc_stream(b'profile', True),
+                   icc_stream(b'other profile')]
+        for stream in streams:
+            document.register(stream)
+        references = [stream.bytes(document) for stream in streams]
+        self.assertEqual(references[0], references[1])
+        self.assertEqual(references[2], references[3])
+        self.assertNotIn(references[4], references[:4])
+        self.assertEqual(len(document), 3)
+        output = BytesIO()
+        document.write(output)
+        self.assertEqual(output.getvalue().count(b'endstream'), 3)
+
+    def test_compression_threads(self):
+        def write(compression_threads):
+            document = cos.Document('test')
+            document.timestamp = 0
+            document.info['CreationDate'] = cos.Date(0)
+            data = [' '.join(str(i * j) for j in range(2000)).encode('ascii')
+                    for i in range(8)]
+            streams = [icc_stream(data[0]), cos.Stream(deferred=True)]
+            streams[1].write(data[1])
+            streams += [icc_stream(chunk, deferred=True) for chunk in data[2:]]
+            # reading a deferred stream encodes it before the document is
+            # written
+            self.assertEqual(streams[-1].read(), data[-1])
+            for stream in streams:
+                document.register(stream)
+            output = BytesIO()
+            document.write(output, compression_threads)
+            return output.getvalue()
+
+        sequential = write(None)
+        self.assertEqual(write(4), sequential)
+        self.assertEqual(write(1), sequential)
+
+    def test_streams_referring_to_indirect_objects(self):
+        document = cos.Document('test')
+        streams = [icc_stream(b'profile'), icc_stream(b'profile')]
+        for stream in streams:
+            stream['Metadata'] = cos.Dictionary(indirect=True)
+            stream.register_indirect(document)
+        self.assertEqual(len(document), 4)
+
+    def test_max_identifier(self):
+        document = cos.Document('test')
+        for i in range(3):
+            document.register(cos.Dictionary(indirect=True))
+        self.assertEqual(document.max_identifier, 3)
+        del document[3]
+        self.assertEqual(document.max_identifier, 2)
+        del document[1]
+        self.assertEqual(document.max_identifier, 2)
+
+
+class TestObjects(unittest.TestCase):
+
+    def test_string_bytes(self):
+        document = cos.Document('test')
+        self.assertEqual(cos.String('plain').bytes(document), b'(plain)')
+        self.assertEqual(cos.String(b'a (b)\\\n\t').bytes(document),
+                         b'(a \\(b\\)\\\\\\n\\t)')
+
+    def test_name_bytes(self):
+        document = cos.Document('test')
+        self.assertEqual(cos.Name('Plain').bytes(document), b'/Plain')
+        self.assertEqual(cos.Name('A B#(C)').bytes(document),
+                         b'/A#20B#23#28C#29')
+
+
+class TestNameTree(unittest.TestCase):
+
+    def check_tree(self, count):
+        document = cos.Document('test')
+        tree = cos.NameTree()
+        for i in reversed(range(count)):
+            tree.add(cos.String('dest{:05d}'.format(i)), cos.Integer(i))
+        tree.add(cos.String('dest00000'), cos.Integer(-1))  # duplicate
+        tree.register_indirect(document)
+
+        def leaves(node, depth=0):
+            if 'Kids' in node:
+                self.assertLessEqual(len(node['Kids']), tree.MAX_ENTRIES)
+                for kid in node['Kids']:
+                    first, last = kid['Limits']
+                    kid_leaves = list(leaves(kid, depth + 1))
+                    self.assertEqual(first, kid_leaves[0][1][0])
+                    self.assertEqual(last, kid_leaves[-1][1][-2])
+                    yield from kid_leaves
+            else:
+                yield depth, node['Names']
+
+        self.assertNotIn('Limits', tree)
+        depths, names_arrays = zip(*leaves(tree))
+        self.assertEqual(len(set(depths)), 1)
+        names = [name for names in names_arrays for name in names[::2]]
+        values = [value for names in names_arrays for value in names[1::2]]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(values, list(range(count)))
+        return depths[0]
+
+    def test_name_tree(self):
+        self.assertEqual(self.check_tree(10), 0)
+        self.assertEqual(self.check_tree(1000), 1)
+        self.assertEqual(self.check_tree(10000), 2)
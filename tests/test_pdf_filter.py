@@ -0,0 +1,54 @@
+import unittest
+
+from io import BytesIO
+from random import Random
+
+from rinoh.backend.pdf import filter
+from rinoh.backend.pdf.filter import PNGReconstructor, paeth_predictor
+
+
+def png_filter(rows, predictor, bpp):
+    """Apply `predictor` to each of `rows` (straightforward implementation)"""
+    out = bytearray()
+    previous = bytes(len(rows[0]))
+    for row in rows:
+        out.append(predictor)
+        for index, value in enumerate(row):
+            a = row[index - bpp] if index >= bpp else 0
+            b = previous[index]
+            c = previous[index - bpp] if index >= bpp else 0
+            prediction = [0, a, b, (a + b) // 2,
+                          paeth_predictor(a, b, c)][predictor]
+            out.append((value - prediction) % 256)
+        previous = row
+    return bytes(out)
+
+
+class TestPNGReconstructor(unittest.TestCase):
+    def check_reconstruct(self, read_size):
+        random = Random(42)
+        for bpp in (1, 3, 4):
+            rows = [bytes(random.randrange(256) for _ in range(bpp * 17))
+                    for _ in range(9)]
+            for predictor in range(5):
+                data = png_filter(rows, predictor, bpp)
+                reconstructor = PNGReconstructor(BytesIO(data), bpp * 17, bpp)
+                out = bytearray()
+                while True:
+                    chunk = reconstructor.read(read_size)
+                    if not chunk:
+                        break
+                    out += chunk
+                self.assertEqual(bytes(out), b''.join(rows))
+
+    def test_reconstruct(self):
+        self.check_reconstruct(-1)
+        self.check_reconstruct(5)
+        self.check_reconstruct(100)
+
+    def test_reconstruct_without_numpy(self):
+        numpy, filter.numpy = filter.numpy, None
+        try:
+            self.test_reconstruct()
+        finally:
+            filter.numpy = numpy
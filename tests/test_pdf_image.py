@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from rinoh.backend import pdf
+from rinoh.backend.pdf.xobject import DEVICE_GRAY, DEVICE_RGB
+from rinoh.backend.pdf.xobject.icc import SRGB, get_icc_stream
+from rinoh.backend.pdf.xobject.jpeg import JPEGReader
+from rinoh.backend.pdf.reader import PDFPageReader, PDFReaderCache
+from rinoh.document import SCREEN, PRINT
+from rinoh.float import Image
+from rinoh.paragraph import Paragraph
+
+from rinohlib.templates.article import Article, ArticleOptions
+
+
+def render(flowables, **options):
+    options = ArticleOptions(table_of_contents=False, **options)
+    document = Article(flowables, options=options, backend=pdf)
+    output = BytesIO()
+    document.render(file=output)
+    return document, output.getvalue()
+
+
+class TestPDFImage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def image_file(self, filename, width, height, dpi=72):
+        path = os.path.join(self.directory, filename)
+        image = PILImage.new('RGB', (width, height), (200, 40, 40))
+        image.save(path, dpi=(dpi, dpi))
+        return path
+
+    def test_jpeg_source_files(self):
+        filename = self.image_file('photo.jpg', 40, 30)
+        with open(filename, 'rb') as file:
+            jpeg_data = file.read()
+        document, output = render([Image(filename)])
+        jpeg_reader = document.images.get_image(filename).xobject
+        self.assertIsInstance(jpeg_reader, JPEGReader)
+        self.assertIn(jpeg_data, output)
+        # each backend document copies the JPEG data using its own files,
+        # which are closed once the PDF has been written
+        backend_document = document.backend_document
+        self.assertIsNone(jpeg_reader.source_files)
+        self.assertEqual(backend_document.source_files._files, {})
+        second_document, second_output = render([Image(filename)])
+        self.assertIsNot(second_document.backend_document.source_files,
+                         backend_document.source_files)
+        self.assertIn(jpeg_data, second_output)
+
+    def test_jpeg_source_read_once(self):
+        filename = self.image_file('photo.jpg', 40, 30)
+        copies = []
+        copy_chunks = JPEGReader._copy_chunks
+
+        def counting_copy_chunks(jpeg_reader, file):
+            copies.append(jpeg_reader)
+            return copy_chunks(jpeg_reader, file)
+
+        with patch.object(JPEGReader, '_copy_chunks', counting_copy_chunks):
+            render([Image(filename), Image(filename)])
+        # the JPEG data is only read while writing the PDF
+        self.assertEqual(len(copies), 1)
+
+    def test_prefetch_workers(self):
+        filenames = [self.image_file('image{}.png'.format(i), 20 + i, 10)
+                     for i in range(3)]
+        document, output = render([Image(filename)
+                                   for filename in filenames])
+        images = document.images
+        # the worker threads are shut down once the document is written
+        self.assertIsNone(images._executor)
+        self.assertEqual(images._pending, {})
+        widths = [images.get_image(filename).xobject['Width']
+                  for filename in filenames]
+        self.assertEqual(widths, [20, 21, 22])
+        # prefetching again starts new workers
+        images.prefetch(self.image_file('another.png', 10, 10))
+        self.assertIsNotNone(images._executor)
+        images.close()
+        self.assertIsNone(images._executor)
+
+    def test_icc_stream(self):
+        rgb = get_icc_stream(SRGB, 3, DEVICE_RGB)
+        gray = get_icc_stream(SRGB, 1, DEVICE_GRAY)
+        self.assertIs(get_icc_stream(SRGB, 3, DEVICE_RGB), rgb)
+        self.assertIsNot(gray, rgb)
+        self.assertEqual((int(rgb['N']), rgb['Alternate']), (3, DEVICE_RGB))
+        self.assertEqual((int(gray['N']), gray['Alternate']),
+                         (1, DEVICE_GRAY))
+
+    def test_downsample(self):
+        def placed_image(filename, output_profile, scale=1.0):
+            options = dict(output_profile=output_profile)
+            document, _ = render([Image(filename, scale=scale)],
+                                 **(options if output_profile else {}))
+            page = document.backend_document.pages[0]
+            xobject = page.cos_page['Resources']['XObject']['Im1']
+            return int(xobject['Width']), int(xobject['Height'])
+
+        large = self.image_file('large.png', 1200, 600, dpi=600)
+        self.assertEqual(placed_image(large, None), (1200, 600))
+        self.assertEqual(placed_image(large, SCREEN), (300, 150))
+        self.assertEqual(placed_image(large, PRINT), (600, 300))
+        # JPEG images are recompressed as JPEG
+        photo = self.image_file('large.jpg', 1200, 600, dpi=600)
+        self.assertEqual(placed_image(photo, SCREEN), (300, 150))
+        # images below (or not far enough above) the target resolution
+        small = self.image_file('small.png', 400, 200, dpi=200)
+        self.assertEqual(placed_image(small, None), (400, 200))
+        self.assertEqual(placed_image(small, SCREEN), (400, 200))
+        # the effective resolution depends on the scale the image is placed at
+        self.assertEqual(placed_image(small, SCREEN, scale=0.5), (150, 75))
+
+    def test_downsampled_size(self):
+        filename = self.image_file('large.png', 1200, 600, dpi=600)
+        images = pdf.ImageStore()
+        image = images.get_image(filename)
+        downsampled = images.get_image(filename, 1.0, 150)
+        self.assertEqual(downsampled.xobject['Width'], 300)
+        self.assertAlmostEqual(downsampled.width, image.width)
+        self.assertAlmostEqual(downsampled.height, image.height)
+        self.assertIs(images.get_image(filename, 1.0, 150), downsampled)
+        self.assertIs(images.get_image(filename, 1.0, 600), image)
+
+    def test_pdf_readers(self):
+        filename = os.path.join(self.directory, 'pages.pdf')
+        with open(filename, 'wb') as file:
+            _, data = render([Paragraph('paragraph {}'.format(i))
+                              for i in range(150)])
+            file.write(data)
+        pdf_readers = PDFReaderCache()
+        for page_number in (1, 2):
+            PDFPageReader(filename, page_number, pdf_readers)
+        self.assertEqual(len(pdf_readers), 1)
+        [reader] = pdf_readers.values()
+        self.assertFalse(reader.data.closed)
+        pdf_readers.close()
+        self.assertEqual(len(pdf_readers), 0)
+        self.assertTrue(reader.data.closed)
+        # the readers are scoped to the document's image store
+        document, output = render([Image(filename, scale=0.3)])
+        self.assertEqual(len(document.images.pdf_readers), 0)
+        self.assertIn(b'/Subtype /Form', output)
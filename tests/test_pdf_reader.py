@@ -1,20 +1,58 @@
+import unittest
 
+from io import BytesIO
 
-import unittest
+from rinoh.backend.pdf import cos
+from rinoh.backend.pdf.reader import PDFObjectReader
 
 
-from pyte.backend.pdf.reader import PDFObjectReader
+def read_item(data):
+    return PDFObjectReader(BytesIO(data)).next_item()
 
 
 class TestPDFReader(unittest.TestCase):
 
     def test_read_name(self):
         def test_name(bytes_name, unicode_name):
-            name = read_name(BytesIO(bytes_name))
+            name = read_item(b'/' + bytes_name)
             self.assertEqual(str(name), unicode_name)
 
-        test_name(b'Adobe#20Green Blue', 'Adobe Green Blue')
+        test_name(b'Adobe#20Green Blue', 'Adobe Green')
         test_name(b'PANTONE#205757#20CV', 'PANTONE 5757 CV')
         test_name(b'paired#28#29parentheses', 'paired()parentheses')
         test_name(b'The_Key_of_F#23_Minor', 'The_Key_of_F#_Minor')
         test_name(b'A#42', 'AB')
+
+    def test_read_string(self):
+        def test_string(bytes_string, expected):
+            string = read_item(b'(' + bytes_string + b')')
+            self.assertEqual(bytes(string), expected)
+
+        test_string(b'Strings may contain (balanced) parentheses',
+                    b'Strings may contain (balanced) parentheses')
+        test_string(b'escaped \\( and \\) and \\\\', b'escaped ( and ) and \\')
+        test_string(b'\\n\\r\\t\\b\\f', b'\n\r\t\b\f')
+        test_string(b'octal \\053\\53\\0053', b'octal ++\x053')
+        test_string(b'split \\\nline', b'split line')
+        test_string(b'', b'')
+
+    def test_read_hex_string(self):
+        self.assertEqual(bytes(read_item(b'<901FA3>')), b'\x90\x1f\xa3')
+        self.assertEqual(bytes(read_item(b'<90 1F A>')), b'\x90\x1f\xa0')
+
+    def test_read_number_and_reference(self):
+        self.assertEqual(read_item(b'  % comment\n-12 '), -12)
+        self.assertEqual(read_item(b'+.5'), 0.5)
+        reference = read_item(b'12 0 R')
+        self.assertIsInstance(reference, cos.Reference)
+        self.assertEqual(reference.identifier, 12)
+        array = read_item(b'[12 0 R 4 5]')
+        self.assertEqual(len(array), 3)
+
+    def test_read_dictionary(self):
+        dictionary = read_item(b'<</Type/Font/Size 12/Kids[1 0 R 2 0 R]'
+                               b'/Name(text)/Nested<</A true>>>>')
+        self.assertEqual(dictionary['Size'], 12)
+        self.assertEqual(dictionary['Name'], b'text')
+        self.assertEqual(len(dictionary.items()), 5)
+        self.assertIs(dictionary['Nested']['A'].value, True)
@@ -0,0 +1,297 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+from rinoh.backend import pdf
+from rinoh.layout import VirtualContainer
+from rinoh.paragraph import Paragraph
+from rinoh.reference import Variable, PAGE_NUMBER
+from rinoh.table import (Table, TableHead, TableBody, TableRow, TableCell,
+                         TableStyle, TableCellBackground, TableCellBorder,
+                         StreamingTable, StreamingTableBody, CSVTableRows,
+                         AUTO, SAMPLE, FIXED)
+from rinoh.text import MixedStyledText
+
+from rinohlib.stylesheets import ieee, sphinx
+from rinohlib.templates.article import Article, ArticleOptions
+
+
+def render(flowables, **options):
+    options = ArticleOptions(table_of_contents=False, **options)
+    document = Article(flowables, options=options, backend=pdf)
+    document.render(file=BytesIO())
+    return document
+
+
+def cell(text):
+    return TableCell([Paragraph(text)])
+
+
+class CountingCell(TableCell):
+    def __init__(self, flowables):
+        super().__init__(flowables)
+        self.flow_count = 0
+
+    def flow(self, container, last_descender, state=None):
+        self.flow_count += 1
+        return super().flow(container, last_descender, state=state)
+
+
+class StreamedRows(object):
+    """Yields new rows on each rendering pass, keeping the last ones"""
+
+    def __init__(self, count):
+        self.count = count
+        self.rows = None
+
+    def __iter__(self):
+        self.rows = [TableRow([CountingCell([Paragraph('row {}'.format(i))]),
+                               CountingCell([Paragraph('value')])])
+                     for i in range(self.count)]
+        return iter(self.rows)
+
+
+class RecordingStreamingTable(StreamingTable):
+    """Records the rows placed in the last rendering pass"""
+
+    def __init__(self, body, head=None, **kwargs):
+        super().__init__(body, head=head, **kwargs)
+        self.placed = []
+
+    def _place_rows_and_render_borders(self, container, rendered_rows):
+        super()._place_rows_and_render_borders(container, rendered_rows)
+        self.placed += [(rendered_row.row, container.page)
+                        for rendered_row in rendered_rows]
+
+
+class SizingTable(Table):
+    """Records the column widths determined for the table"""
+
+    column_widths_used = None
+
+    def _size_columns(self, container, rows=None):
+        widths = super()._size_columns(container, rows)
+        self.column_widths_used = widths
+        return widths
+
+
+class SizingStreamingTable(SizingTable, StreamingTable):
+    pass
+
+
+def sized_column_widths(column_sizing, column_widths=None, **style):
+    """Render a table with a wide first column in its last row only and
+    return the column widths determined for it"""
+    rows = [TableRow([cell('x'), cell('y')]) for _ in range(20)]
+    rows.append(TableRow([cell('a rather wide cell'), cell('y')]))
+    table = SizingTable(TableBody(rows), column_widths=column_widths,
+                        style=TableStyle(column_sizing=column_sizing,
+                                         **style))
+    render([table])
+    return table.column_widths_used
+
+
+class PerCellTable(Table):
+    """Draws the background and borders of each cell separately"""
+
+    def _place_rows_and_render_borders(self, container, rendered_rows):
+        y_cursor = container.cursor
+        for r, rendered_row in enumerate(rendered_rows):
+            container.advance(rendered_row.height)
+            for rendered_cell in rendered_row:
+                cell_height = sum(rendered_row.height for rendered_row in
+                                  rendered_rows[r:r + rendered_cell.rowspan])
+                cell_container = VirtualContainer(container)
+                TableCellBackground((0, 0), rendered_cell.width, cell_height,
+                                    parent=rendered_cell.cell
+                                    ).render(cell_container)
+                for position in ('top', 'right', 'bottom', 'left'):
+                    TableCellBorder(rendered_cell, cell_height,
+                                    position).render(cell_container)
+                x_cursor = rendered_cell.x_position
+                cell_container.place_at(container, x_cursor,
+                                        float(y_cursor + cell_height))
+                rendered_cell.container.place_at(container, x_cursor,
+                                                 float(y_cursor))
+            y_cursor += rendered_row.height
+
+
+def drawn_shapes(document):
+    """Return the sorted line segments stroked and polygons filled on the
+    pages of `document`, in page coordinates"""
+    shapes = []
+    for page_number, page in enumerate(document.backend_document.pages):
+        state = ((1, 0, 0, 1, 0, 0), 1.0, (0, 0, 0), (0, 0, 0))
+        stack, subpaths, in_text = [], [], False
+        for line in page.canvas.getvalue().splitlines():
+            operands, _, operator = line.rpartition(' ')
+            if in_text or operator == 'BT':
+                in_text = operator != 'ET'
+                continue
+            operands = operands.split()
+            matrix, width, stroke_color, fill_color = state
+            if operator == 'q':
+                stack.append(state)
+            elif operator == 'Q':
+                state = stack.pop()
+            elif operator == 'cm':
+                a, b, c, d, e, f = map(float, operands)
+                a0, b0, c0, d0, e0, f0 = matrix
+                matrix = (a * a0 + b * c0, a * b0 + b * d0,
+                          c * a0 + d * c0, c * b0 + d * d0,
+                          e * a0 + f * c0 + e0, e * b0 + f * d0 + f0)
+                state = matrix, width, stroke_color, fill_color
+            elif operator == 'w':
+                state = matrix, float(operands[0]), stroke_color, fill_color
+            elif operator in ('RG', 'rg'):
+                color = tuple(round(float(value), 3) for value in operands)
+                if operator == 'RG':
+                    state = matrix, width, color, fill_color
+                else:
+                    state = matrix, width, stroke_color, color
+            elif operator == 'm':
+                subpaths.append([])
+            if operator in ('m', 'l'):
+                x, y = map(float, operands)
+                a, b, c, d, e, f = matrix
+                subpaths[-1].append((round(a * x + c * y + e, 2),
+                                     round(b * x + d * y + f, 2)))
+            elif operator in ('s', 'f', 'B'):
+                for points in subpaths:
+                    if operator in ('f', 'B'):
+                        start = points.index(min(points))
+                        polygon = tuple(points[start:] + points[:start])
+                        shapes.append((page_number, 'fill', fill_color,
+                                       polygon))
+                    if operator in ('s', 'B'):
+                        if len(points) > 2:
+                            points = points + points[:1]
+                        for segment in zip(points, points[1:]):
+                            shapes.append((page_number, 'stroke',
+                                           round(width, 2), stroke_color,
+                                           tuple(sorted(segment))))
+                subpaths = []
+    return sorted(shapes)
+
+
+class TestTable(unittest.TestCase):
+
+    def test_cell_backgrounds_and_borders(self):
+        def table(table_class):
+            head = TableHead([TableRow([cell('name'), cell('value'),
+                                        cell('unit')])])
+            rows = [TableRow([cell('row {}'.format(i)), cell('value'),
+                              cell('m')]) for i in range(60)]
+            spanning = TableCell([Paragraph('spans two rows and columns')],
+                                 rowspan=2, colspan=2)
+            rows.append(TableRow([spanning, cell('m')]))
+            rows.append(TableRow([cell('s')]))
+            return table_class(TableBody(rows), head=head)
+
+        for stylesheet in (ieee.styles, sphinx.stylesheet):
+            batched = drawn_shapes(render([table(Table)],
+                                          stylesheet=stylesheet))
+            per_cell = drawn_shapes(render([table(PerCellTable)],
+                                           stylesheet=stylesheet))
+            self.assertTrue(any(shape[1] == 'stroke' for shape in batched))
+            self.assertEqual(batched, per_cell)
+        # the sphinx style sheet fills the cells on even rows
+        self.assertTrue(any(shape[1] == 'fill' for shape in batched))
+
+    def test_content_widths(self):
+        short, long = cell('a'), cell('a much longer text')
+        field = TableCell([Paragraph(MixedStyledText(['page ',
+                                                      Variable(PAGE_NUMBER)]))])
+        table = Table(TableBody([TableRow([short, field]),
+                                 TableRow([long, cell('b')])]))
+        document = render([table])
+        short_widths = short._content_widths[1]
+        long_widths = long._content_widths[1]
+        self.assertGreater(long_widths.maximum, long_widths.minimum)
+        self.assertGreater(long_widths.maximum, short_widths.maximum)
+        self.assertEqual(short_widths.minimum, short_widths.maximum)
+        # cells holding fields are measured again in each rendering pass
+        self.assertIsNone(field._content_widths)
+        document.render(file=BytesIO())
+        self.assertIs(short._content_widths[1], short_widths)
+
+    def test_streaming_table(self):
+        rows = StreamedRows(150)
+        table = RecordingStreamingTable(StreamingTableBody(rows))
+        render([table])
+        last_rows = set(map(id, rows.rows))
+        placed = [(row, page) for row, page in table.placed
+                  if id(row) in last_rows]
+        self.assertEqual([row for row, page in placed], rows.rows)
+        self.assertGreater(len(set(page for row, page in placed)), 1)
+        for row in rows.rows:
+            for cell in row:
+                self.assertEqual(cell.flow_count, 1)
+
+    def test_streaming_table_without_rows(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        header_csv = os.path.join(directory, 'header.csv')
+        with open(header_csv, 'w') as file:
+            file.write('name,value,unit\n')
+        empty_csv = os.path.join(directory, 'empty.csv')
+        open(empty_csv, 'w').close()
+        [header] = CSVTableRows(header_csv)
+        table = RecordingStreamingTable(
+            StreamingTableBody(CSVTableRows(empty_csv)),
+            head=TableHead([header]))
+        self.assertEqual(table.num_columns, 3)
+        render([table])
+        # only the head is placed (once in each rendering pass)
+        self.assertTrue(table.placed)
+        self.assertTrue(all(row is header for row, page in table.placed))
+        # without a head, the column count is taken from the column widths
+        table = RecordingStreamingTable(
+            StreamingTableBody(CSVTableRows(empty_csv)),
+            column_widths=[1, 2])
+        self.assertEqual(table.num_columns, 2)
+        render([table])
+        self.assertEqual(table.placed, [])
+
+    def test_column_sizing(self):
+        auto = sized_column_widths(AUTO)
+        self.assertGreater(auto[0], auto[1])
+        # the wide cell is not part of the sample
+        sample = sized_column_widths(SAMPLE, sample_rows=5,
+                                     random_sample_rows=0)
+        self.assertLess(sample[0], auto[0])
+        # the sample includes all rows
+        self.assertEqual(sized_column_widths(SAMPLE, sample_rows=100,
+                                             random_sample_rows=100), auto)
+        self.assertEqual(sized_column_widths(SAMPLE, sample_rows=5,
+                                             random_sample_rows=100), auto)
+
+    def test_fixed_column_sizing(self):
+        first, second = sized_column_widths(FIXED, column_widths=[1, 3])
+        self.assertAlmostEqual(3 * first, second)
+        # no column widths given: equal widths spanning the available width
+        equal = sized_column_widths(FIXED)
+        self.assertAlmostEqual(equal[0], equal[1])
+        self.assertAlmostEqual(sum(equal), first + second)
+        # missing widths default to the average of the given widths
+        for column_widths in ([2, None], [2]):
+            self.assertEqual(sized_column_widths(FIXED,
+                                                 column_widths=column_widths),
+                             equal)
+
+    def test_fixed_column_sizing_without_rows(self):
+        for table_class, body in ((SizingTable, TableBody([])),
+                                  (SizingStreamingTable,
+                                   StreamingTableBody([]))):
+            head = TableHead([TableRow([cell('name'), cell('value'),
+                                        cell('unit')])])
+            table = table_class(body, head=head, column_widths=[2, 1],
+                                style=TableStyle(column_sizing=FIXED))
+            render([table])
+            first, second, third = table.column_widths_used
+            self.assertAlmostEqual(first, 2 * second)
+            self.assertAlmostEqual(third, (first + second) / 2)